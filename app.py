@@ -1,458 +1,1267 @@
-from flask import Flask, render_template, request, send_file, jsonify, Response
+from flask import Flask, request, jsonify, Response, g, abort, send_from_directory, send_file
 import zipfile
 import io
-import re
+import abc
 import json
 import os
-import unicodedata
-from werkzeug.utils import secure_filename
+import functools
+import itertools
+import collections
+import hashlib
+import tempfile
+import time
+import sys
+import contextlib
+import threading
+import concurrent.futures
 
-app = Flask(__name__)
+# The processing pipeline lives in rtlfixer.py so it can be used without Flask
+from rtlfixer import (
+    U202B, U202C, U200F, Cue, PARSERS, PROCESS_OPTIONS,
+    SRT_TIMING_PATTERN, ASS_TIME_PATTERN, ASS_BREAK_PATTERN, ASS_OVERRIDE_PATTERN, ENCODING_SAMPLE_BYTES,
+    VTT_TIMING_PATTERN, LRC_TIME_PATTERN, LRC_WORD_TIME_PATTERN, INPUT_FORMATS, sniff_format, ms_to_ts_vtt, ms_to_ts_lrc,
+    is_music_line, parse_bracket_options, get_text_filter, text_filter_key,
+    bidi_classes, bidi_direction, rtl_marking_needed,
+    ms_to_ts_srt, ms_to_ts_ass, frac_to_ms, parse_timestamp,
+    parse_srt, input_format_for, detect_input_format, FORMAT_SNIFF_CHARS, iter_process_document,
+    sniff_encoding, sniff_buffer_encoding, mapped_content, MMAP_MIN_BYTES,
+    Validator, VALIDATION_BUDGET_MS, warm_up, fix_file_outputs, iter_encoded, output_filename,
+    resolve_output_format, resolve_output_formats, process_options, is_zip_archive, archive_members,
+)
+# The baseline helpers stay importable from here; __all__ marks them as
+# re-exports rather than dead imports
+from rtlfixer import (
+    TASHKEEL, remove_arabic_tashkeel, remove_tags, clean_brackets, apply_text_filters,
+    ts_srt_to_ms, ts_ass_to_ms, process_srt, process_ass,
+    convert_srt_to_ass, convert_ass_to_srt, convert_srt_to_vtt, convert_srt_to_lrc, detect_encoding,
+)
+from assets import index_response, static_response, prerender
+
+__all__ = [
+    'app', 'TASHKEEL', 'remove_arabic_tashkeel', 'remove_tags', 'clean_brackets',
+    'apply_text_filters', 'ts_srt_to_ms', 'ts_ass_to_ms', 'process_srt', 'process_ass',
+    'convert_srt_to_ass', 'convert_ass_to_srt', 'convert_srt_to_vtt', 'convert_srt_to_lrc',
+    'detect_encoding',
+]
+
+# /static is served by static_file() below, from memory with fingerprints and ETags
+app = Flask(__name__, static_folder=None)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
+# Zip uploads: cap on the extracted size of the subtitles inside one archive
+app.config['ARCHIVE_MAX_BYTES'] = int(os.environ.get('ARCHIVE_MAX_BYTES', 256 * 1024 * 1024))
+# Single uploads at least this large are read through an mmap of werkzeug's spooled temp file
+app.config['MMAP_MIN_BYTES'] = int(os.environ.get('MMAP_MIN_BYTES', MMAP_MIN_BYTES))
+# Time a single /process or /preview request may spend on validation rules
+app.config['VALIDATION_BUDGET_MS'] = int(os.environ.get('VALIDATION_BUDGET_MS', VALIDATION_BUDGET_MS))
+# Compile patterns and build lookup tables at import, so a cold start's first request does not
+app.config['WARM_UP'] = os.environ.get('WARM_UP', 'true').lower() == 'true'
+# Batch uploads: pool size, 'process' or 'thread' pool, and the smallest batch worth parallelizing
+app.config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+app.config['BATCH_EXECUTOR'] = os.environ.get('BATCH_EXECUTOR', 'process')
+app.config['BATCH_PARALLEL_MIN_FILES'] = int(os.environ.get('BATCH_PARALLEL_MIN_FILES', 4))
+# Result cache: 'memory', 'disk' (CACHE_DIR may be a volume shared between instances) or 'none'
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')
+app.config['CACHE_MAX_BYTES'] = int(os.environ.get('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+app.config['CACHE_DIR'] = os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'rtl-fixer-cache'))
+# Per-request sampling profiler, triggered by an "X-Profile: 1" request header when enabled
+app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'rtl-fixer-profiles'))
+# Background jobs (/jobs): store backend and location, worker threads, and how long finished jobs are kept
+app.config['JOB_STORE'] = os.environ.get('JOB_STORE', 'sqlite')
+app.config['JOB_DIR'] = os.environ.get('JOB_DIR', os.path.join(tempfile.gettempdir(), 'rtl-fixer-jobs'))
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_TTL_SECONDS'] = int(os.environ.get('JOB_TTL_SECONDS', 3600))
+# ASGI mode (asgi.py): worker threads, requests allowed to wait for one, the body size
+# that counts as large (large requests leave one worker free), bytes of upload that
+# delay a request by one second in the queue, and the in-memory spool size
+app.config['ASYNC_WORKERS'] = int(os.environ.get('ASYNC_WORKERS', 4))
+app.config['ASYNC_QUEUE_LIMIT'] = int(os.environ.get('ASYNC_QUEUE_LIMIT', 64))
+app.config['ASYNC_LARGE_BYTES'] = int(os.environ.get('ASYNC_LARGE_BYTES', 1024 * 1024))
+app.config['ASYNC_PRIORITY_BYTES_PER_S'] = int(os.environ.get('ASYNC_PRIORITY_BYTES_PER_S', 10 * 1024 * 1024))
+app.config['ASYNC_SPOOL_BYTES'] = int(os.environ.get('ASYNC_SPOOL_BYTES', 1024 * 1024))
 
-# The special 'Right-to-Left Embedding' Unicode character
-U202B = '\u202b'
-U202C = '\u202c' # PDF (Pop Directional Formatting)
+if app.config['WARM_UP']:
+    warm_up()
+    prerender()
 
-TASHKEEL = set([
-    '\u064b', '\u064c', '\u064d', '\u064e', '\u064f', '\u0650', '\u0651', '\u0652', 
-    '\u0653', '\u0654', '\u0655', '\u0656', '\u0657', '\u0658',
-    '\u0610', '\u0611', '\u0612', '\u0613', '\u0614', '\u0615', '\u0616', '\u0617', 
-    '\u0618', '\u0619', '\u061a',
-    '\u06d6', '\u06d7', '\u06d8', '\u06d9', '\u06da', '\u06db', '\u06dc'
-])
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
 
-def remove_arabic_tashkeel(text):
-    return ''.join(c for c in text if c not in TASHKEEL)
+def get_batch_executor():
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            workers = app.config['BATCH_WORKERS']
+            if app.config['BATCH_EXECUTOR'] == 'process':
+                try:
+                    _batch_executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+                except (OSError, NotImplementedError, ImportError):
+                    # No usable multiprocessing here (e.g. serverless sandboxes without /dev/shm)
+                    pass
+            if _batch_executor is None:
+                _batch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        return _batch_executor
 
-def remove_tags(text, keep_italic=False, keep_bold=False, keep_font_color=False):
-    # Remove ASS override tags {...}
-    text = re.sub(r'\{.*?\}', '', text)
-    
-    # Selectively remove HTML tags
-    def replacer(match):
-        tag = match.group(0)
-        tag_lower = tag.lower()
-        if keep_italic and (tag_lower == '<i>' or tag_lower == '</i>'):
-            return tag
-        if keep_bold and (tag_lower == '<b>' or tag_lower == '</b>'):
-            return tag
-        if keep_font_color and (tag_lower.startswith('<font') or tag_lower == '</font>'):
-            return tag
-        return ''
-        
-    text = re.sub(r'<[^>]+>', replacer, text)
-    return text
+def reset_batch_executor(broken):
+    # A process pool that lost a worker cannot be reused; fall back to threads
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            _batch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=app.config['BATCH_WORKERS'])
+
+def submit_fix_file(upload, opts, encoding_hint=None):
+    filename, content_bytes, fallback_name, opts = unpack_upload(upload, opts)
+    executor = get_batch_executor()
+    try:
+        return executor.submit(fix_file_timed, filename, content_bytes, opts, fallback_name, encoding_hint)
+    except concurrent.futures.BrokenExecutor:
+        reset_batch_executor(executor)
+        return get_batch_executor().submit(fix_file_timed, filename, content_bytes, opts, fallback_name, encoding_hint)
 
-def is_music_line(text):
-    # Strip tags to check just the text content
-    clean_text = re.sub(r'<[^>]+>', '', re.sub(r'\{.*?\}', '', text)).strip()
-    return bool(re.match(r'^[\s\u266a\u266b\u266c\u266d~*\-\.]+$', clean_text))
+def unpack_upload(upload, opts):
+    # An upload may carry its own options as a fourth item
+    if len(upload) > 3:
+        return upload
+    filename, content_bytes, fallback_name = upload
+    return filename, content_bytes, fallback_name, opts
 
-def clean_brackets(text, opts):
-    if not opts:
-        return text
-        
+def run_fix_file(upload, opts, timings=None):
+    filename, content_bytes, fallback_name, opts = unpack_upload(upload, opts)
     try:
-        options = json.loads(opts) if isinstance(opts, str) else opts
-    except:
-        return text
-
-    if options.get('remove_square'):
-        text = re.sub(r'\[.*?\]', '', text)
-    if options.get('remove_round'):
-        text = re.sub(r'\(.*?\)', '', text)
-    if options.get('remove_angle'):
-        # Only remove angle brackets if they aren't part of kept HTML tags
-        # A simple approach: remove <...> if it doesn't look like a standard HTML formatting tag
-        text = re.sub(r'<(?!\/?(?:i|b|font)[ >]).*?>', '', text)
-    if options.get('remove_curly_text'):
-        # This removes curly braces that were not removed by ASS tag removal (e.g. non-override curlies)
-        text = re.sub(r'\{.*?\}', '', text)
-        
-    if 'custom_pairs' in options:
-        for pair in options['custom_pairs']:
-            if len(pair) == 2:
-                o, c = re.escape(pair[0]), re.escape(pair[1])
-                text = re.sub(f'{o}.*?{c}', '', text)
-                
-    return text
-
-def ts_srt_to_ms(ts):
-    parts = ts.split(':')
-    if len(parts) == 3:
-        h = int(parts[0])
-        m = int(parts[1])
-        s_ms = parts[2].split(',')
-        s = int(s_ms[0])
-        ms = int(s_ms[1]) if len(s_ms) > 1 else 0
-        return h * 3600000 + m * 60000 + s * 1000 + ms
-    return 0
-
-def ms_to_ts_srt(ms):
-    ms = max(0, ms)
-    h = ms // 3600000
-    ms %= 3600000
-    m = ms // 60000
-    ms %= 60000
-    s = ms // 1000
-    ms %= 1000
-    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
-
-def ts_ass_to_ms(ts):
-    parts = ts.split(':')
-    if len(parts) == 3:
-        h = int(parts[0])
-        m = int(parts[1])
-        s_cs = parts[2].split('.')
-        s = int(s_cs[0])
-        cs = int(s_cs[1]) if len(s_cs) > 1 else 0
-        return h * 3600000 + m * 60000 + s * 1000 + cs * 10
-    return 0
-
-def ms_to_ts_ass(ms):
-    ms = max(0, ms)
-    h = ms // 3600000
-    ms %= 3600000
-    m = ms // 60000
-    ms %= 60000
-    s = ms // 1000
-    ms %= 1000
-    cs = ms // 10
-    return f"{h}:{m:02d}:{s:02d}.{cs:02d}"
-
-def apply_text_filters(text, opts):
-    if opts.get('remove_tashkeel'):
-        text = remove_arabic_tashkeel(text)
-    if opts.get('remove_all_tags'):
-        text = remove_tags(text, opts.get('keep_italic'), opts.get('keep_bold'), opts.get('keep_font_color'))
-    if opts.get('clean_brackets'):
-        text = clean_brackets(text, opts.get('bracket_options'))
-    if opts.get('fix_rtl'):
-        # FIX: only apply RTL marker to non-empty lines to avoid corrupting
-        # SRT block separators and timestamp lines with stray Unicode chars.
+        return fix_file_cached(filename, content_bytes, opts, fallback_name, timings), None
+    except Exception as e:
+        return None, e
+
+def iter_fixed_files(uploads, opts, timings=None):
+    # uploads: iterable of (filename, content_bytes, fallback_name[, opts]), consumed lazily.
+    # Yields (outputs, error) pairs in upload order, outputs being one
+    # (out_filename, out_bytes) per output format, each one as soon as it and
+    # everything before it is done. At most two files per worker are in flight,
+    # so only a bounded number of inputs is held in memory at once.
+    workers = app.config['BATCH_WORKERS']
+    uploads = iter(uploads)
+    head = list(itertools.islice(uploads, app.config['BATCH_PARALLEL_MIN_FILES']))
+    if len(head) < app.config['BATCH_PARALLEL_MIN_FILES'] or workers <= 1:
+        for upload in itertools.chain(head, uploads):
+            yield run_fix_file(upload, opts, timings)
+        return
+
+    cache = get_result_cache()
+
+    def collect(upload, future, keys):
+        try:
+            result = future.result()
+        except concurrent.futures.BrokenExecutor:
+            reset_batch_executor(get_batch_executor())
+            return run_fix_file(upload, opts, timings)
+        except Exception as e:
+            return None, e
+        if keys is None:
+            return result, None
+        outputs, stages = result
+        if timings is not None:
+            timings.merge(stages)
+        for key, (_, out_bytes) in zip(keys, outputs):
+            cache.set(key, out_bytes)
+        return outputs, None
+
+    pending = collections.deque()
+    for upload in itertools.chain(head, uploads):
+        # Cache lookups happen here, in the parent, so every worker shares them
+        filename, content_bytes, fallback_name, upload_opts = unpack_upload(upload, opts)
+        digest = content_digest(content_bytes)
+        output_formats = resolve_output_formats(upload_opts)
+        keys = [process_cache_key(filename, digest, upload_opts, output_format) for output_format in output_formats]
+        cached = [cache.get('process', key) for key in keys]
+        if None not in cached:
+            future = concurrent.futures.Future()
+            future.set_result([(output_filename(filename, output_format, fallback_name), out_bytes)
+                               for output_format, out_bytes in zip(output_formats, cached)])
+            keys = None
+        else:
+            future = submit_fix_file(upload, opts, cached_encoding(cache, digest, upload_opts))
+        pending.append((upload, future, keys))
+        if len(pending) >= workers * 2:
+            yield collect(*pending.popleft())
+    while pending:
+        yield collect(*pending.popleft())
+
+def take_upload_stream(f):
+    # Take ownership of a spooled upload: the request closes its files
+    # before a streamed body is consumed
+    stream, f.stream = f.stream, io.BytesIO()
+    return stream
+
+def upload_inputs(files):
+    # [(filename, stream)] for the uploaded files, every zip archive replaced by
+    # the subtitles inside it. Members keep their path in the archive, under the
+    # archive's own name when other files came with it. Raises ValueError for a
+    # bad or oversized archive.
+    inputs = []
+    for index, f in enumerate(files):
+        stream = take_upload_stream(f)
+        if not is_zip_archive(stream):
+            inputs.append((f.filename, stream))
+            continue
+        prefix = ''
+        if len(files) > 1:
+            prefix = (os.path.splitext(os.path.basename(f.filename or ''))[0] or f'Archive_{index + 1}') + '/'
+        members = archive_members(stream, app.config['ARCHIVE_MAX_BYTES'])
+        inputs.extend((prefix + name, member) for name, member in members)
+    return inputs
+
+def iter_upload_bytes(uploads):
+    # uploads: [(filename, stream, fallback_name)], each stream read only when needed
+    for filename, stream, fallback_name in uploads:
+        with stream:
+            content_bytes = stream.read()
+        yield filename, content_bytes, fallback_name
+
+class ZipStreamSink:
+    # Write-only, unseekable file object: zipfile then emits data descriptors
+    # and every entry can be handed to the client as soon as it is written
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_zip_stream(results, timings=None):
+    timings = timings or StageTimings(publish=False)
+    sink = ZipStreamSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for outputs, error in results:
+            if error is not None:
+                continue # Continue processing other files
+            for out_filename, out_bytes in outputs:
+                with timings.stage('zip', len(out_bytes)):
+                    zf.writestr(out_filename, out_bytes)
+            yield sink.drain()
+    # Central directory
+    yield sink.drain()
+
+def attachment_headers(filename):
+    import urllib.parse
+    encoded_name = urllib.parse.quote(filename)
+    return {"Content-Disposition": f"attachment; filename*=UTF-8''{encoded_name}"}
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def sniff_stream_encoding(stream, input_encoding='auto'):
+    # Pick an encoding from the first chunk only; the stream position is left untouched
+    position = stream.tell()
+    head = stream.read(ENCODING_SAMPLE_BYTES + 1)
+    stream.seek(position)
+    return sniff_buffer_encoding(head, input_encoding)
+
+def iter_decoded_lines(stream, encoding):
+    # Universal-newline decoding straight off the (spooled) upload stream,
+    # which is closed once exhausted
+    with io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline=None) as reader:
+        for line in reader:
+            yield line[:-1] if line.endswith('\n') else line
+
+def iter_timed(chunks, timings, name):
+    # Records the whole lifetime of a streamed body as one stage
+    start = time.perf_counter()
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+        yield chunk
+    timings.add(name, time.perf_counter() - start, total)
+
+def stream_fixed_file(f, opts, timings=None):
+    output_format = resolve_output_format(opts)
+    stream = take_upload_stream(f)
+    encoding = sniff_stream_encoding(stream, opts['input_encoding'])
+    position = stream.tell()
+    head = stream.read(FORMAT_SNIFF_CHARS).decode(encoding, errors='replace')
+    stream.seek(position)
+    lines = iter_decoded_lines(stream, encoding)
+    # Validated as in the non-stream path, so auto_fix gives the same output;
+    # the report is only complete with the body, so there is no X-Validation
+    validator = Validator(auto_fix=opts['auto_fix'], budget_ms=app.config['VALIDATION_BUDGET_MS'])
+    chunks = iter_process_document(lines, detect_input_format(head, f.filename or ''), output_format, opts, validator)
+
+    body = iter_encoded(chunks, output_format)
+    if timings is not None:
+        body = iter_timed(body, timings, 'stream')
+    return Response(
+        body,
+        mimetype="text/plain",
+        headers=attachment_headers(output_filename(f.filename, output_format))
+    )
+
+# ---------------------------------------------------------------------------
+# Preview
+#
+# The encoding is sniffed from a prefix of the upload and cues are parsed
+# lazily off the decoded stream, stopping as soon as the requested window
+# (the first N cues and an optional cue range) is filled. Totals, when
+# asked for, come from a cheap line scan over the rest of the stream that
+# never builds cue objects.
+# ---------------------------------------------------------------------------
+
+PREVIEW_MAX_CUES = 100      # cap for max_cues and for the length of a cue range
+PREVIEW_MAX_LINES = 10      # lines in the flat 'preview' list
+
+class PreviewTotals:
+    # Cue count, running time and RTL line ratio from a pass-through line scan
+    def __init__(self, file_type):
+        self.file_type = file_type
+        self.cues = 0
+        self.lines = 0
+        self.rtl_lines = 0
+        self.mixed_lines = 0
+        self.end = 0
+
+    def count_text(self, text):
         if text.strip():
-            if opts.get('fix_rtl_pdf'):
-                text = U202B + text.replace(U202B, '').replace(U202C, '') + U202C
-            else:
-                text = U202B + text.replace(U202B, '')
-    return text
+            self.lines += 1
+            classes = bidi_classes(text)
+            if 'R' in classes:
+                self.rtl_lines += 1
+                if 'L' in classes:
+                    self.mixed_lines += 1
 
-def process_srt(content, opts):
-    lines = content.splitlines()
-    processed_lines = []
-    
-    timestamp_pattern = re.compile(r'^(\d{2}:\d{2}:\d{2},\d{3})\s*-->\s*(\d{2}:\d{2}:\d{2},\d{3})$')
-    
-    time_shift_ms = opts.get('time_shift_ms', 0)
-    from_ts = opts.get('time_shift_from', "00:00:00,000")
-    from_ms = ts_srt_to_ms(from_ts) if time_shift_ms != 0 else 0
-    
-    i = 0
-    block_index = 1
-    while i < len(lines):
-        line = lines[i]
-        
-        # Look for a number line followed by a timestamp line
-        if line.strip().isdigit() and i + 1 < len(lines) and timestamp_pattern.match(lines[i + 1].strip()):
-            ts_line = lines[i + 1].strip()
-            match = timestamp_pattern.match(ts_line)
-            start_ts, end_ts = match.groups()
-            
-            # Shift timestamps
-            if time_shift_ms != 0:
-                start_ms = ts_srt_to_ms(start_ts)
-                end_ms = ts_srt_to_ms(end_ts)
-                if start_ms >= from_ms:
-                    start_ts = ms_to_ts_srt(start_ms + time_shift_ms)
-                    end_ts = ms_to_ts_srt(end_ms + time_shift_ms)
-            
-            ts_line_modified = f"{start_ts} --> {end_ts}"
-            
-            i += 2
-            
-            # Read text lines
-            text_lines = []
-            while i < len(lines) and lines[i].strip() != '':
-                text_lines.append(lines[i])
-                i += 1
-                
-            joined_text = '\n'.join(text_lines)
-            
-            # Remove music lines if requested
-            if opts.get('remove_music_lines') and is_music_line(joined_text):
-                while i < len(lines) and lines[i].strip() == '':
-                    i += 1
-                continue
-                
-            # Apply text filters to each line
-            filtered_lines = [apply_text_filters(tl, opts) for tl in text_lines]
-            
-            processed_lines.append(str(block_index))
-            processed_lines.append(ts_line_modified)
-            processed_lines.extend(filtered_lines)
-            processed_lines.append("")
-            block_index += 1
-            
-        elif line.strip() == '':
-            # Extra empty lines can be skipped, we ensure one empty line after each block
+    def scan(self, lines):
+        file_type = self.file_type
+        in_cue = False
+        for line in lines:
+            if file_type == 'srt':
+                stripped = line.strip()
+                match = SRT_TIMING_PATTERN.match(stripped) if '-->' in stripped else None
+                if match:
+                    g = match.groups()
+                    self.cues += 1
+                    self.end = max(self.end, int(g[4]) * 3600000 + int(g[5]) * 60000 + int(g[6]) * 1000 + frac_to_ms(g[7]))
+                elif not stripped.isdigit():
+                    self.count_text(stripped)
+            elif file_type == 'vtt':
+                # Text is whatever follows a timing line up to the next blank
+                # line, so identifiers and NOTE blocks are not counted
+                stripped = line.strip()
+                match = VTT_TIMING_PATTERN.match(stripped) if '-->' in stripped else None
+                if match:
+                    g = match.groups()
+                    self.cues += 1
+                    self.end = max(self.end, int(g[4] or 0) * 3600000 + int(g[5]) * 60000 + int(g[6]) * 1000 + int(g[7]))
+                    in_cue = True
+                elif not stripped:
+                    in_cue = False
+                elif in_cue:
+                    self.count_text(stripped)
+            elif file_type == 'lrc':
+                # One cue per time stamp with text, as parse_lrc counts them;
+                # the end is the last stamp
+                stamps = LRC_TIME_PATTERN.findall(line)
+                if stamps:
+                    self.end = max(self.end, *(int(m) * 60000 + int(s) * 1000 + frac_to_ms(frac) for m, s, frac in stamps))
+                    text = LRC_WORD_TIME_PATTERN.sub('', LRC_TIME_PATTERN.sub('', line)).strip()
+                    if text:
+                        self.cues += len(stamps)
+                        self.count_text(text)
+            elif line.lstrip().startswith('Dialogue:'):
+                parts = line.split(',', 9)
+                if len(parts) == 10 and ASS_TIME_PATTERN.match(parts[2]):
+                    self.cues += 1
+                    self.end = max(self.end, parse_timestamp(parts[2]))
+                    for text in ASS_BREAK_PATTERN.split(parts[9]):
+                        self.count_text(text)
+            yield line
+
+    def summary(self):
+        return {
+            'cues': self.cues,
+            'duration_ms': self.end,
+            'duration': ms_to_ts_srt(self.end),
+            'lines': self.lines,
+            'rtl_lines': self.rtl_lines,
+            'mixed_lines': self.mixed_lines,
+            'rtl_ratio': round(self.rtl_lines / self.lines, 4) if self.lines else 0.0,
+        }
+
+def preview_line(text):
+    text = text.strip()
+    # Markers from an earlier fix are left out of the analysis (RLM is itself strong RTL)
+    classes = bidi_classes(text.replace(U202B, '').replace(U202C, '').strip(U200F))
+    return {
+        'text': text[:100] + ('...' if len(text) > 100 else ''),
+        'has_rtl': 'R' in classes,
+        'direction': bidi_direction(classes),
+        'mixed': 'R' in classes and 'L' in classes,
+        # What smart marking would add: None, 'embed', 'start', 'end' or 'both'
+        'needs_marking': rtl_marking_needed(classes),
+        'is_rtl_fixed': U202B in text or text.startswith(U200F) or text.endswith(U200F)
+    }
+
+def preview_cue(number, cue, file_type):
+    lines = cue.lines
+    if file_type == 'ass':
+        lines = [ASS_OVERRIDE_PATTERN.sub('', line) for line in lines]
+    to_ts = PREVIEW_TIMESTAMPS[file_type]
+    return {
+        'index': number,
+        'start': to_ts(cue.start),
+        'end': to_ts(cue.end),
+        'lines': [preview_line(line) for line in lines if line.strip()],
+    }
+
+PREVIEW_TIMESTAMPS = {'srt': ms_to_ts_srt, 'ass': ms_to_ts_ass, 'vtt': ms_to_ts_vtt, 'lrc': ms_to_ts_lrc}
+
+def preview_options(form):
+    # (max_cues, (first, last) 1-based inclusive cue range or None, with_totals, validate)
+    max_cues = max(0, min(int(form.get('max_cues', 10)), PREVIEW_MAX_CUES))
+    cue_range = None
+    if form.get('range_start'):
+        first = int(form['range_start'])
+        last = int(form.get('range_end') or first + 9)
+        if first < 1 or last < first:
+            raise ValueError('Invalid cue range')
+        cue_range = (first, min(last, first + PREVIEW_MAX_CUES - 1))
+    # Totals and validation read the whole upload, so both are opt-in: by
+    # default a preview costs the same whatever the size of the file
+    with_totals = form.get('totals', 'false').lower() == 'true'
+    validate = form.get('validate', 'false').lower() == 'true'
+    return max_cues, cue_range, with_totals, validate
+
+def preview_document(lines, file_type, max_cues=10, cue_range=None, with_totals=False, validator=None):
+    # lines is consumed lazily: without totals or a validator, reading stops
+    # at the end of the window; a validator keeps parsing until its budget is spent
+    issues = []
+    totals = PreviewTotals(file_type) if with_totals else None
+    source = totals.scan(lines) if totals else iter(lines)
+    parser = parse_srt(source, issues) if file_type == 'srt' else PARSERS[file_type](source)
+    cues = validator.iter_validated(parser, file_type) if validator else parser
+    last = max(max_cues, cue_range[1] if cue_range else 0)
+
+    first_cues = []
+    range_cues = []
+    number = 0
+    for item in cues:
+        if not isinstance(item, Cue):
+            continue
+        number += 1
+        if number <= max_cues:
+            first_cues.append(preview_cue(number, item, file_type))
+        if cue_range and cue_range[0] <= number <= cue_range[1]:
+            range_cues.append(preview_cue(number, item, file_type))
+        if number >= last and (validator is None or validator.truncated):
+            break
+    cues.close()
+    parser.close()
+
+    if number == 0 and file_type != 'ass':
+        issues.append("No valid subtitle blocks found")
+    data = {
+        'issues': issues,
+        'cues': first_cues,
+        'preview': [line for cue in first_cues for line in cue['lines']][:PREVIEW_MAX_LINES],
+    }
+    if cue_range:
+        data['range'] = {'start': cue_range[0], 'end': cue_range[1], 'cues': range_cues}
+    if validator:
+        data['validation'] = validator.report()
+    if totals:
+        for _ in source:
             pass
-        else:
-            # Random non-conforming lines
-            processed_lines.append(line)
-        i += 1
-        
-    return '\n'.join(processed_lines)
+        data['totals'] = totals.summary()
+    return data
 
-def process_ass(content, opts):
-    lines = content.splitlines()
-    processed_lines = []
-    
-    time_shift_ms = opts.get('time_shift_ms', 0)
-    from_ts = opts.get('time_shift_from', "0:00:00.00")
-    from_ms = ts_ass_to_ms(from_ts) if time_shift_ms != 0 else 0
-    
-    for line in lines:
-        if line.strip().startswith('Dialogue:'):
-            parts = line.split(',', 9)
-            if len(parts) == 10:
-                start_ts, end_ts = parts[1], parts[2]
-                
-                if time_shift_ms != 0:
-                    start_ms = ts_ass_to_ms(start_ts)
-                    end_ms = ts_ass_to_ms(end_ts)
-                    if start_ms >= from_ms:
-                        parts[1] = ms_to_ts_ass(start_ms + time_shift_ms)
-                        parts[2] = ms_to_ts_ass(end_ms + time_shift_ms)
-                
-                text_portion = parts[9]
-                
-                if opts.get('remove_music_lines') and is_music_line(text_portion.replace('\\N', '\n').replace('\\n', '\n')):
-                    continue
-                
-                # Apply text filters. Note: ASS lines use \N or \n for breaks.
-                # We split by \N or \n, apply filters, then join.
-                break_pattern = re.compile(r'(\\[Nn])')
-                sub_parts = break_pattern.split(text_portion)
-                for j in range(0, len(sub_parts), 2):
-                    sub_parts[j] = apply_text_filters(sub_parts[j], opts)
-                
-                parts[9] = ''.join(sub_parts)
-                processed_lines.append(','.join(parts))
+def stream_digest(stream):
+    # content_digest() of a seekable stream, read in chunks; the position is restored
+    position = stream.tell()
+    digest = hashlib.blake2b(digest_size=20)
+    for chunk in iter(functools.partial(stream.read, STREAM_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    stream.seek(position)
+    return digest.hexdigest()
+
+def fix_file_timed(filename, content_bytes, opts, fallback_name="Subtitle", encoding_hint=None):
+    # Pool entry point: stage timings travel back to the parent with the result
+    timings = StageTimings(publish=False)
+    outputs = fix_file_outputs(filename, content_bytes, opts, fallback_name, encoding_hint, timings)
+    return outputs, timings.stages
+
+# ---------------------------------------------------------------------------
+# Content-addressed result cache
+#
+# Keys are hash(file bytes) + a canonical encoding of the options + the
+# input/output formats; values are the encoded output bytes.
+# ---------------------------------------------------------------------------
+
+class MemoryCache:
+    # In-process LRU bounded by the total size of the stored values
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+class DiskCache:
+    # One file per entry; access times drive LRU eviction. Any number of
+    # instances can share the directory.
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = None    # estimated, refreshed on every eviction scan
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fh:
+                value = fh.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as fh:
+                fh.write(value)
+            os.replace(fh.name, path)
+        except OSError:
+            return
+        with self._lock:
+            if self.size is None:
+                self._evict()
             else:
-                processed_lines.append(line)
-        else:
-            processed_lines.append(line)
-            
-    return '\n'.join(processed_lines)
-
-def convert_srt_to_ass(content):
-    lines = content.splitlines()
-    ass_lines = [
-        "[Script Info]",
-        "ScriptType: v4.00+",
-        "WrapStyle: 0",
-        "ScaledBorderAndShadow: yes",
-        "Collisions: Normal",
-        "",
-        "[V4+ Styles]",
-        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding",
-        "Style: Default,Arial,40,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,2,0,2,10,10,10,0",
-        "",
-        "[Events]",
-        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text"
-    ]
-    
-    timestamp_pattern = re.compile(r'^(\d{2}:\d{2}:\d{2}),(\d{3})\s*-->\s*(\d{2}:\d{2}:\d{2}),(\d{3})$')
-    
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        if line.strip().isdigit() and i + 1 < len(lines):
-            ts_match = timestamp_pattern.match(lines[i + 1].strip())
-            if ts_match:
-                start_hms, start_ms, end_hms, end_ms = ts_match.groups()
-                start_cs = int(start_ms) // 10
-                end_cs = int(end_ms) // 10
-                
-                # ASS timestamp format: H:MM:SS.cc
-                start_ts = f"{int(start_hms[:2])}:{start_hms[3:]}.{start_cs:02d}"
-                end_ts = f"{int(end_hms[:2])}:{end_hms[3:]}.{end_cs:02d}"
-                
-                i += 2
-                text_lines = []
-                while i < len(lines) and lines[i].strip() != '':
-                    text_lines.append(lines[i].strip())
-                    i += 1
-                
-                text_joined = '\\N'.join(text_lines)
-                ass_lines.append(f"Dialogue: 0,{start_ts},{end_ts},Default,,0,0,0,,{text_joined}")
+                self.size += len(value)
+                if self.size > self.max_bytes:
+                    self._evict()
+
+    def _evict(self):
+        entries = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_atime, st.st_size, path))
+        self.size = sum(size for _, size, _ in entries)
+        entries.sort()
+        # Trim to 90% so eviction scans stay rare
+        for _, size, path in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
                 continue
-        i += 1
-    
-    return '\n'.join(ass_lines)
+            self.size -= size
 
-def convert_ass_to_srt(content):
-    lines = content.splitlines()
-    srt_lines = []
-    
-    block_index = 1
-    for line in lines:
-        if line.strip().startswith('Dialogue:'):
-            parts = line.split(',', 9)
-            if len(parts) == 10:
-                start_ts, end_ts = parts[1], parts[2]
-                
-                def ass_ts_to_srt(ts):
-                    p = ts.split(':')
-                    if len(p) == 3:
-                        h = int(p[0])
-                        m = int(p[1])
-                        s_cs = p[2].split('.')
-                        s = int(s_cs[0])
-                        cs = int(s_cs[1]) if len(s_cs) > 1 else 0
-                        return f"{h:02d}:{m:02d}:{s:02d},{cs*10:03d}"
-                    return "00:00:00,000"
-                
-                start_srt = ass_ts_to_srt(start_ts)
-                end_srt = ass_ts_to_srt(end_ts)
-                
-                text_portion = parts[9]
-                text_portion = re.sub(r'\{.*?\}', '', text_portion) # Strip ASS overrides
-                text_portion = text_portion.replace('\\N', '\n').replace('\\n', '\n')
-                
-                srt_lines.append(str(block_index))
-                srt_lines.append(f"{start_srt} --> {end_srt}")
-                srt_lines.append(text_portion)
-                srt_lines.append("")
-                block_index += 1
-                
-    return '\n'.join(srt_lines)
-
-def convert_srt_to_vtt(content):
-    lines = content.splitlines()
-    vtt_lines = ["WEBVTT", ""]
-    
-    timestamp_pattern = re.compile(r'^(\d{2}:\d{2}:\d{2}),(\d{3})\s*-->\s*(\d{2}:\d{2}:\d{2}),(\d{3})$')
-    
-    for line in lines:
-        match = timestamp_pattern.match(line.strip())
-        if match:
-            # Replace comma with dot
-            vtt_lines.append(f"{match.group(1)}.{match.group(2)} --> {match.group(3)}.{match.group(4)}")
+class ResultCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+
+    def get(self, namespace, key):
+        value = self.backend.get(key) if self.backend is not None else None
+        if value is None:
+            self.misses[namespace] += 1
         else:
-            vtt_lines.append(line)
-            
-    return '\n'.join(vtt_lines)
+            self.hits[namespace] += 1
+        return value
 
-def convert_srt_to_lrc(content):
-    lines = content.splitlines()
-    lrc_lines = []
-    
-    timestamp_pattern = re.compile(r'^(\d{2}):(\d{2}):(\d{2}),(\d{3})\s*-->')
-    
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        if line.strip().isdigit() and i + 1 < len(lines):
-            ts_match = timestamp_pattern.match(lines[i + 1].strip())
-            if ts_match:
-                h, m, s, ms = ts_match.groups()
-                total_m = int(h) * 60 + int(m)
-                cs = int(ms) // 10
-                lrc_ts = f"[{total_m:02d}:{s}.{cs:02d}]"
-                
-                i += 2
-                text_lines = []
-                while i < len(lines) and lines[i].strip() != '':
-                    text_lines.append(lines[i].strip())
-                    i += 1
-                
-                text_joined = ' '.join(text_lines)
-                lrc_lines.append(f"{lrc_ts}{text_joined}")
+    def set(self, key, value):
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def stats(self):
+        namespaces = set(self.hits) | set(self.misses)
+        return {
+            'backend': type(self.backend).__name__ if self.backend is not None else None,
+            'size_bytes': getattr(self.backend, 'size', 0) or 0,
+            'max_bytes': getattr(self.backend, 'max_bytes', 0),
+            'hits': sum(self.hits.values()),
+            'misses': sum(self.misses.values()),
+            'by_namespace': {ns: {'hits': self.hits[ns], 'misses': self.misses[ns]} for ns in sorted(namespaces)},
+        }
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache():
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            backend = app.config['CACHE_BACKEND']
+            if backend == 'memory':
+                _result_cache = ResultCache(MemoryCache(app.config['CACHE_MAX_BYTES']))
+            elif backend == 'disk':
+                _result_cache = ResultCache(DiskCache(app.config['CACHE_DIR'], app.config['CACHE_MAX_BYTES']))
+            else:
+                _result_cache = ResultCache(None)
+        return _result_cache
+
+def content_digest(content_bytes):
+    return hashlib.blake2b(content_bytes, digest_size=20).hexdigest()
+
+def canonical_options(opts):
+    # Everything but the output format, which process keys carry on their own;
+    # time_shift_from defaults to zero in that format's notation, so it is compared in ms
+    options = {k: v for k, v in opts.items() if k not in ('output_format', 'output_formats')}
+    options['bracket_options'] = parse_bracket_options(opts.get('bracket_options'))
+    options['time_shift_from'] = parse_timestamp(opts.get('time_shift_from'))
+    return json.dumps(options, sort_keys=True, separators=(',', ':'))
+
+def cache_key(namespace, digest, *parts):
+    return hashlib.blake2b('\0'.join((namespace, digest) + parts).encode('utf-8'), digest_size=20).hexdigest()
+
+def process_cache_key(filename, digest, opts, output_format=None):
+    # One entry per output format, shared by requests that asked for several
+    output_format = output_format or resolve_output_format(opts)
+    return cache_key('process', digest, input_format_for(filename or ''), output_format, canonical_options(opts))
+
+def validation_cache_key(filename, digest, opts):
+    # Validation runs before any writer, so one report serves every output format
+    return cache_key('validation', digest, input_format_for(filename or ''), canonical_options(opts))
+
+def encoding_cache_key(digest):
+    return cache_key('encoding', digest)
+
+def cached_encoding(cache, digest, opts):
+    # (encoding, confidence) detected by an earlier /preview of the same bytes
+    if opts['input_encoding'] != 'auto':
+        return None
+    cached = cache.get('encoding', encoding_cache_key(digest))
+    return tuple(json.loads(cached)) if cached is not None else None
+
+def fix_file_cached(filename, content_bytes, opts, fallback_name="Subtitle", timings=None):
+    return fix_file_incremental(filename, content_bytes, opts, fallback_name, timings)[0]
+
+def cue_hash(text):
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=12).hexdigest()
+
+class CueIndex:
+    # Fingerprints (timing + text) of every cue of a document, and the
+    # filtered text for each distinct raw cue text. Loaded from the previous
+    # upload of the same document, it lets a re-upload skip the text filters
+    # for every cue whose text did not change and report what did.
+    def __init__(self, previous=None):
+        self.previous = previous
+        self.fingerprints = []
+        self.texts = {}
+        self.refiltered = 0
+
+    def filter_cues(self, items, opts):
+        # Same contract as filter_cues()
+        text_filter = get_text_filter(opts)
+        remove_music = opts.get('remove_music_lines')
+        known = self.previous['texts'] if self.previous else {}
+
+        for item in items:
+            if isinstance(item, Cue):
+                text = '\n'.join(item.lines)
+                text_hash = cue_hash(text)
+                self.fingerprints.append(cue_hash(f'{item.start}\0{item.end}\0{text}'))
+                if text_hash in self.texts:
+                    lines = self.texts[text_hash]
+                elif text_hash in known:
+                    lines = known[text_hash]
+                else:
+                    self.refiltered += 1
+                    if remove_music and is_music_line(text):
+                        lines = None
+                    else:
+                        lines = [text_filter(line) for line in item.lines]
+                self.texts[text_hash] = lines
+                if lines is None:
+                    continue
+                item.lines = list(lines)
+            yield item
+
+    def diff(self):
+        # Summary of the cue-level changes against the previous upload
+        if self.previous is None:
+            return None
+        import difflib
+        before = self.previous['fingerprints']
+        summary = {'cues': len(self.fingerprints), 'previous_cues': len(before), 'unchanged': 0,
+                   'changed': 0, 'added': 0, 'removed': 0, 'refiltered': self.refiltered, 'changed_cues': []}
+        matcher = difflib.SequenceMatcher(None, before, self.fingerprints, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                summary['unchanged'] += j2 - j1
                 continue
-        i += 1
-        
-    return '\n'.join(lrc_lines)
+            if tag == 'replace':
+                summary['changed'] += min(i2 - i1, j2 - j1)
+                summary['added'] += max(0, (j2 - j1) - (i2 - i1))
+                summary['removed'] += max(0, (i2 - i1) - (j2 - j1))
+            elif tag == 'insert':
+                summary['added'] += j2 - j1
+            else:
+                summary['removed'] += i2 - i1
+            # 1-based cue numbers in the new upload (before music-line removal)
+            summary['changed_cues'].extend(range(j1 + 1, j2 + 1))
+        del summary['changed_cues'][CUE_DIFF_MAX_LISTED:]
+        return summary
 
-def detect_encoding(content_bytes):
-    try:
-        return content_bytes.decode('utf-8-sig')
-    except UnicodeDecodeError:
+    def dumps(self, digest):
+        return json.dumps({'digest': digest, 'fingerprints': self.fingerprints, 'texts': self.texts},
+                          ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+CUE_DIFF_MAX_LISTED = 200
+
+def cue_index_key(digest, opts):
+    # One index per document version and filter settings; retiming options are
+    # applied after the filters, so they do not invalidate it. A client names
+    # the version to diff against by its digest (X-Document-Digest of the
+    # earlier response), which only someone holding that document can know.
+    return cache_key('cues', digest, repr(text_filter_key(opts)), str(bool(opts.get('remove_music_lines'))))
+
+def fix_file_incremental(filename, content_bytes, opts, fallback_name="Subtitle", timings=None, validator=None,
+                         previous_digest=None, track_changes=False):
+    # Returns (outputs, diff, validation, digest): outputs has one
+    # (out_filename, out_bytes) per output format, diff is None unless
+    # previous_digest names a stored version, validation is None without a
+    # validator. The cue index of this version is only stored for a client
+    # that asked to track changes or is already doing so; most uploads never
+    # come back, and the index is about as large as the output.
+    cache = get_result_cache()
+    digest = content_digest(content_bytes)
+    output_formats = resolve_output_formats(opts)
+    keys = [process_cache_key(filename, digest, opts, output_format) for output_format in output_formats]
+    index_key = cue_index_key(digest, opts)
+    track = track_changes or bool(previous_digest)
+    previous = None
+    if previous_digest:
+        cached_index = cache.get('cues', cue_index_key(previous_digest, opts))
+        previous = json.loads(cached_index) if cached_index is not None else None
+
+    cached = [cache.get('process', key) for key in keys]
+    # The report of a validated result is cached next to it
+    report_key = validation_cache_key(filename, digest, opts)
+    cached_report = cache.get('validation', report_key) if validator is not None and None not in cached else None
+    current = cache.get('cues', index_key) if track and None not in cached else None
+    # A tracked version needs its own index, for this diff and the next one
+    if None not in cached and (validator is None or cached_report is not None) and (not track or current is not None):
+        outputs = [(output_filename(filename, output_format, fallback_name), out_bytes)
+                   for output_format, out_bytes in zip(output_formats, cached)]
+        validation = json.loads(cached_report) if cached_report is not None else None
+        diff = None
+        if previous is not None:
+            stored = CueIndex(previous)
+            stored.fingerprints = json.loads(current)['fingerprints']
+            diff = stored.diff()
+        return outputs, diff, validation, digest
+
+    cue_index = CueIndex(previous)
+    outputs = fix_file_outputs(filename, content_bytes, opts, fallback_name, cached_encoding(cache, digest, opts), timings, cue_index, validator)
+    for key, (_, out_bytes) in zip(keys, outputs):
+        cache.set(key, out_bytes)
+    if track:
+        cache.set(index_key, cue_index.dumps(digest))
+    validation = None
+    if validator is not None:
+        # Truncated reports too, flag included: a large file would otherwise never hit
+        validation = validator.report()
+        cache.set(report_key, json.dumps(validation).encode('utf-8'))
+    return outputs, cue_index.diff(), validation, digest
+
+# ---------------------------------------------------------------------------
+# Instrumentation
+#
+# Every request collects per-stage durations, bytes and cue counts. They are
+# reported in a Server-Timing header (for stages finished before the headers
+# go out) and accumulated process-wide for /metrics in Prometheus text format.
+# ---------------------------------------------------------------------------
+
+REQUEST_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}      # stage -> [seconds, bytes, cues, calls]
+        self.requests = {}    # (endpoint, status) -> count
+        self.durations = {}   # endpoint -> [bucket counts..., sum, count]
+
+    def observe_stage(self, name, seconds, nbytes=0, cues=0, calls=1):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0.0, 0, 0, 0])
+            entry[0] += seconds
+            entry[1] += nbytes
+            entry[2] += cues
+            entry[3] += calls
+
+    def observe_request(self, endpoint, status, seconds):
+        with self._lock:
+            self.requests[(endpoint, status)] = self.requests.get((endpoint, status), 0) + 1
+            entry = self.durations.setdefault(endpoint, [0] * len(REQUEST_DURATION_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(REQUEST_DURATION_BUCKETS):
+                if seconds <= bound:
+                    entry[i] += 1
+            entry[-2] += seconds
+            entry[-1] += 1
+
+    def render(self, cache=None):
+        out = []
+        with self._lock:
+            out.append('# HELP rtlfixer_requests_total Requests handled, by endpoint and status.')
+            out.append('# TYPE rtlfixer_requests_total counter')
+            for (endpoint, status), count in sorted(self.requests.items()):
+                out.append(f'rtlfixer_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+            out.append('# HELP rtlfixer_request_duration_seconds Request duration including streamed bodies.')
+            out.append('# TYPE rtlfixer_request_duration_seconds histogram')
+            for endpoint, entry in sorted(self.durations.items()):
+                for bound, count in zip(REQUEST_DURATION_BUCKETS, entry):
+                    out.append(f'rtlfixer_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                out.append(f'rtlfixer_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {entry[-1]}')
+                out.append(f'rtlfixer_request_duration_seconds_sum{{endpoint="{endpoint}"}} {entry[-2]:.6f}')
+                out.append(f'rtlfixer_request_duration_seconds_count{{endpoint="{endpoint}"}} {entry[-1]}')
+
+            for index, (metric, help_text) in enumerate((
+                ('rtlfixer_stage_seconds_total', 'Time spent per pipeline stage.'),
+                ('rtlfixer_stage_bytes_total', 'Bytes handled per pipeline stage.'),
+                ('rtlfixer_stage_cues_total', 'Cues handled per pipeline stage.'),
+                ('rtlfixer_stage_calls_total', 'Invocations per pipeline stage.'),
+            )):
+                out.append(f'# HELP {metric} {help_text}')
+                out.append(f'# TYPE {metric} counter')
+                for name, entry in sorted(self.stages.items()):
+                    value = f'{entry[index]:.6f}' if index == 0 else entry[index]
+                    out.append(f'{metric}{{stage="{name}"}} {value}')
+
+        if cache is not None:
+            for metric, counter in (('rtlfixer_cache_hits_total', cache.hits), ('rtlfixer_cache_misses_total', cache.misses)):
+                out.append(f'# TYPE {metric} counter')
+                for namespace, count in sorted(counter.items()):
+                    out.append(f'{metric}{{namespace="{namespace}"}} {count}')
+        return '\n'.join(out) + '\n'
+
+METRICS = Metrics()
+
+class StageTimings:
+    # Per-request stage recorder. With publish=False (pool workers) nothing
+    # reaches METRICS until the parent merges the stages in.
+    def __init__(self, publish=True):
+        self.stages = {}    # stage -> [seconds, bytes, cues, calls]
+        self.publish = publish
+
+    def add(self, name, seconds, nbytes=0, cues=0, calls=1):
+        entry = self.stages.setdefault(name, [0.0, 0, 0, 0])
+        entry[0] += seconds
+        entry[1] += nbytes
+        entry[2] += cues
+        entry[3] += calls
+        if self.publish:
+            METRICS.observe_stage(name, seconds, nbytes, cues, calls)
+
+    def merge(self, stages):
+        for name, (seconds, nbytes, cues, calls) in stages.items():
+            self.add(name, seconds, nbytes, cues, calls)
+
+    @contextlib.contextmanager
+    def stage(self, name, nbytes=0, cues=0):
+        # The yielded record lets the caller fill in byte and cue counts
+        record = {'bytes': nbytes, 'cues': cues}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.add(name, time.perf_counter() - start, record['bytes'], record['cues'])
+
+    def server_timing(self):
+        entries = []
+        for name, (seconds, nbytes, cues, calls) in self.stages.items():
+            desc = [f'{calls}x']
+            if nbytes:
+                desc.append(f'{nbytes}B')
+            if cues:
+                desc.append(f'{cues} cues')
+            entries.append(f'{name};dur={seconds * 1000:.2f};desc="{" ".join(desc)}"')
+        return ', '.join(entries)
+
+class SamplingProfiler:
+    # Samples one thread's Python stack from a background thread and dumps the
+    # counts in collapsed-stack format (flamegraph.pl / speedscope compatible).
+    # Work running inside pool processes is not sampled.
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f'{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})')
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as fh:
+            for stack, count in self.samples.most_common():
+                fh.write(f'{stack} {count}\n')
+
+@app.before_request
+def start_request_instrumentation():
+    g.request_started = time.perf_counter()
+    g.timings = StageTimings()
+    g.profiler = None
+    if app.config['PROFILING_ENABLED'] and request.headers.get('X-Profile') == '1':
+        g.profiler = SamplingProfiler(threading.get_ident())
+        g.profiler.start()
+
+@app.after_request
+def finish_request_instrumentation(response):
+    started = g.get('request_started')
+    timings = g.get('timings')
+    if started is None or timings is None:
+        return response
+
+    app_time = f'app;dur={(time.perf_counter() - started) * 1000:.2f}'
+    stages = timings.server_timing()
+    response.headers['Server-Timing'] = f'{stages}, {app_time}' if stages else app_time
+
+    endpoint = request.endpoint or 'unknown'
+    status = response.status_code
+    profiler = g.get('profiler')
+    profile_name = None
+    if profiler is not None:
+        profile_name = f'{time.strftime("%Y%m%d-%H%M%S")}-{endpoint}-{id(profiler):x}.folded'
+        response.headers['X-Profile-Dump'] = profile_name
+
+    def on_close():
+        # Runs after a streamed body has been fully sent
+        METRICS.observe_request(endpoint, status, time.perf_counter() - started)
+        if profiler is not None:
+            profiler.stop()
+            os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+            profiler.dump(os.path.join(app.config['PROFILE_DIR'], profile_name))
+
+    response.call_on_close(on_close)
+    return response
+
+# ---------------------------------------------------------------------------
+# Jobs
+#
+# POST /jobs spools the uploads into a job store and returns at once; a small
+# background pool runs the same pipeline as /process and records per-file
+# progress as files finish. Clients poll GET /jobs/<id> and fetch the file or
+# zip from GET /jobs/<id>/result. Jobs need a long-lived process (a container
+# or VM): serverless functions freeze background threads between requests.
+# ---------------------------------------------------------------------------
+
+class JobStore(abc.ABC):
+    # Storage interface for jobs. `job` is a plain dict:
+    #   id, status ('queued' | 'running' | 'done' | 'failed'), created, started,
+    #   finished, opts, files ([{name, status, bytes_in, bytes_out, error}]),
+    #   result_name, result_type (its Content-Type), error
+    @abc.abstractmethod
+    def create(self, job, inputs):
+        # inputs: [(filename, stream)] saved alongside the job; fills in
+        # each file's bytes_in
         pass
 
-    try:
-        decoded = content_bytes.decode('utf-16')
-        if len(decoded.strip()) > 0 and not all(ord(c) < 32 for c in decoded[:100]):
-            return decoded
-    except UnicodeDecodeError:
+    @abc.abstractmethod
+    def get(self, job_id):
         pass
 
-    try:
-        return content_bytes.decode('utf-8')
-    except UnicodeDecodeError:
+    @abc.abstractmethod
+    def update(self, job_id, **fields):
         pass
 
-    try:
-        return content_bytes.decode('latin-1')
-    except UnicodeDecodeError:
+    @abc.abstractmethod
+    def read_input(self, job_id, index):
         pass
 
-    raise UnicodeDecodeError("utf-8", content_bytes, 0, len(content_bytes), "Unable to decode file content")
+    @abc.abstractmethod
+    def result_path(self, job_id):
+        pass
 
-def validate_srt_content(content):
-    issues = []
-    lines = content.splitlines()
-    timestamp_pattern = re.compile(r'^\d{2}:\d{2}:\d{2},\d{3} --> \d{2}:\d{2}:\d{2},\d{3}$')
+    @abc.abstractmethod
+    def delete_expired(self, ttl):
+        # Finished and failed jobs created more than ttl seconds ago; queued
+        # and running ones are still owned by the executor
+        pass
 
-    if not lines:
-        issues.append("File is empty")
-        return issues
+class SQLiteJobStore(JobStore):
+    # Job records live in a SQLite database and the uploads and results as
+    # plain files next to it, one directory per job
+    COLUMNS = ('id', 'status', 'created', 'started', 'finished', 'opts', 'files', 'result_name', 'error', 'result_type')
+    JSON_COLUMNS = ('opts', 'files')
 
-    if lines[0].startswith('\ufeff'):
-        issues.append("File contains BOM marker")
+    def __init__(self, directory):
+        import sqlite3
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._connect = functools.partial(sqlite3.connect, os.path.join(directory, 'jobs.sqlite3'), timeout=30)
+        with contextlib.closing(self._connect()) as db, db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, created REAL, started REAL,'
+                ' finished REAL, opts TEXT, files TEXT, result_name TEXT, error TEXT, result_type TEXT)'
+            )
+            # Databases created before result_type was recorded
+            if 'result_type' not in [row[1] for row in db.execute('PRAGMA table_info(jobs)')]:
+                db.execute('ALTER TABLE jobs ADD COLUMN result_type TEXT')
 
-    subtitle_blocks = 0
-    for i, line in enumerate(lines):
-        if line.strip().isdigit():
-            subtitle_blocks += 1
-            if i + 1 < len(lines) and timestamp_pattern.match(lines[i + 1]):
-                continue
+    def job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def create(self, job, inputs):
+        os.makedirs(self.job_dir(job['id']))
+        for index, (filename, stream) in enumerate(inputs):
+            with stream, open(os.path.join(self.job_dir(job['id']), f'input_{index}'), 'wb') as fh:
+                while True:
+                    chunk = stream.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    fh.write(chunk)
+            job['files'][index]['bytes_in'] = os.path.getsize(fh.name)
+        row = [json.dumps(job.get(c)) if c in self.JSON_COLUMNS else job.get(c) for c in self.COLUMNS]
+        with contextlib.closing(self._connect()) as db, db:
+            db.execute(f'INSERT INTO jobs VALUES ({",".join("?" * len(self.COLUMNS))})', row)
+
+    def get(self, job_id):
+        with contextlib.closing(self._connect()) as db:
+            row = db.execute(f'SELECT {",".join(self.COLUMNS)} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(self.COLUMNS, row))
+        for column in self.JSON_COLUMNS:
+            job[column] = json.loads(job[column])
+        return job
+
+    def update(self, job_id, **fields):
+        values = [json.dumps(v) if k in self.JSON_COLUMNS else v for k, v in fields.items()]
+        assignments = ', '.join(f'{k} = ?' for k in fields)
+        with contextlib.closing(self._connect()) as db, db:
+            db.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', values + [job_id])
+
+    def read_input(self, job_id, index):
+        with open(os.path.join(self.job_dir(job_id), f'input_{index}'), 'rb') as fh:
+            return fh.read()
+
+    def result_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), 'result')
+
+    def delete_expired(self, ttl):
+        import shutil
+        cutoff = time.time() - ttl
+        with contextlib.closing(self._connect()) as db, db:
+            # Queued and running jobs are left alone however old they are:
+            # the executor will still look them up
+            expired = [row[0] for row in db.execute(
+                "SELECT id FROM jobs WHERE created < ? AND status IN ('done', 'failed')", (cutoff,)
+            )]
+            db.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in expired])
+        for job_id in expired:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        return len(expired)
+
+JOB_STORES = {
+    'sqlite': SQLiteJobStore,
+}
+
+_job_store = None
+_job_executor = None
+_job_lock = threading.Lock()
+_jobs_last_cleanup = 0.0
+_jobs_cleanup_lock = threading.Lock()
+
+def get_job_store():
+    global _job_store
+    with _job_lock:
+        if _job_store is None:
+            _job_store = JOB_STORES[app.config['JOB_STORE']](app.config['JOB_DIR'])
+        return _job_store
+
+def get_job_executor():
+    global _job_executor
+    with _job_lock:
+        if _job_executor is None:
+            _job_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=app.config['JOB_WORKERS'], thread_name_prefix='job'
+            )
+        return _job_executor
+
+def cleanup_jobs(store):
+    # Expired jobs are swept at most once a minute, piggybacking on new submissions
+    global _jobs_last_cleanup
+    now = time.time()
+    with _jobs_cleanup_lock:
+        if now - _jobs_last_cleanup < 60:
+            return
+        _jobs_last_cleanup = now
+    store.delete_expired(app.config['JOB_TTL_SECONDS'])
+
+def submit_job(uploads, opts, archive=False):
+    # uploads: [(filename, stream)]; returns the new job id. archive: the
+    # uploads came out of a zip, which is answered with a zip as in /process
+    import uuid
+    store = get_job_store()
+    cleanup_jobs(store)
+    job = {
+        'id': uuid.uuid4().hex,
+        'status': 'queued',
+        'created': time.time(),
+        'opts': opts,
+        'files': [{'name': filename, 'status': 'pending', 'bytes_in': 0, 'bytes_out': 0, 'error': None}
+                  for filename, _ in uploads],
+    }
+    store.create(job, uploads)
+    get_job_executor().submit(run_job, store, job['id'], archive)
+    return job['id']
+
+def run_job(store, job_id, archive=False):
+    job = store.get(job_id)
+    if job is None:
+        # Deleted from the store behind the executor's back
+        return
+    files = job['files']
+    opts = job['opts']
+    store.update(job_id, status='running', started=time.time())
+    timings = StageTimings()
+    try:
+        uploads = ((entry['name'], store.read_input(job_id, index), f"Subtitle_{index + 1}")
+                   for index, entry in enumerate(files))
+        results = iter_fixed_files(uploads, opts, timings)
+        with open(store.result_path(job_id), 'wb') as fh:
+            # One file in one format is returned as is, anything else as a
+            # zip, as /process does
+            if not archive and len(files) == 1 and len(resolve_output_formats(opts)) == 1:
+                result_name = write_job_file(store, job_id, files, results, fh)
+                result_type = 'text/plain'
             else:
-                issues.append(f"Invalid SRT structure around line {i + 1}")
+                result_name = batch_zip_name([entry['name'] for entry in files])
+                result_type = 'application/zip'
+                with zipfile.ZipFile(fh, 'w', zipfile.ZIP_DEFLATED) as zf:
+                    write_job_zip(store, job_id, files, results, zf, timings)
+    except Exception as e:
+        store.update(job_id, status='failed', finished=time.time(), files=files, error=str(e))
+        return
+    if all(entry['status'] == 'error' for entry in files):
+        store.update(job_id, status='failed', finished=time.time(), files=files, error='No file could be processed')
+        return
+    store.update(job_id, status='done', finished=time.time(), files=files,
+                 result_name=result_name, result_type=result_type)
 
-    if subtitle_blocks == 0:
-        issues.append("No valid subtitle blocks found")
+def record_job_file(store, job_id, files, index, outputs, error):
+    entry = files[index]
+    if error is not None:
+        entry['status'] = 'error'
+        entry['error'] = str(error)
+    else:
+        entry['status'] = 'done'
+        entry['bytes_out'] = sum(len(out_bytes) for _, out_bytes in outputs)
+    store.update(job_id, files=files)
+
+def write_job_file(store, job_id, files, results, fh):
+    outputs, error = next(results)
+    record_job_file(store, job_id, files, 0, outputs, error)
+    if error is not None:
+        raise error
+    out_filename, out_bytes = outputs[0]
+    fh.write(out_bytes)
+    return out_filename
+
+def write_job_zip(store, job_id, files, results, zf, timings):
+    for index, (outputs, error) in enumerate(results):
+        if error is None:
+            for out_filename, out_bytes in outputs:
+                with timings.stage('zip', len(out_bytes)):
+                    zf.writestr(out_filename, out_bytes)
+        record_job_file(store, job_id, files, index, outputs, error)
 
-    return issues
-
-def preview_srt_content(content, max_lines=10):
-    lines = content.splitlines()
-    preview_lines = []
-    timestamp_pattern = re.compile(r'^\d{2}:\d{2}:\d{2},\d{3} --> \d{2}:\d{2}:\d{2},\d{3}$')
-
-    current_block = []
-    for line in lines[:50]:
-        if line.strip().isdigit() and len(current_block) == 0:
-            current_block = [line]
-        elif timestamp_pattern.match(line) and len(current_block) == 1:
-            current_block.append(line)
-        elif line.strip() == '' and len(current_block) == 2:
-            current_block.append(line)
-        elif len(current_block) == 3 and line.strip():
-            text_line = line.strip()
-            if text_line:
-                has_rtl = any('\u0590' <= c <= '\u05FF' or '\u0600' <= c <= '\u06FF' or '\u0750' <= c <= '\u077F' for c in text_line)
-                preview_lines.append({
-                    'text': text_line[:100] + ('...' if len(text_line) > 100 else ''),
-                    'has_rtl': has_rtl,
-                    'is_rtl_fixed': U202B in text_line
-                })
-                if len(preview_lines) >= max_lines:
-                    break
-            current_block = []
-
-    return preview_lines
+def job_status(job):
+    files = job['files']
+    finished = [entry for entry in files if entry['status'] != 'pending']
+    bytes_in = sum(entry['bytes_in'] for entry in finished)
+    status = {
+        'id': job['id'],
+        'status': job['status'],
+        'created': job['created'],
+        'started': job['started'],
+        'finished': job['finished'],
+        'total_files': len(files),
+        'processed_files': len(finished),
+        'failed_files': sum(entry['status'] == 'error' for entry in files),
+        'progress': len(finished) / len(files) if files else 1.0,
+        'files': files,
+        'error': job['error'],
+    }
+    if job['started']:
+        elapsed = (job['finished'] or time.time()) - job['started']
+        if elapsed > 0:
+            status['throughput'] = {
+                'files_per_s': round(len(finished) / elapsed, 3),
+                'mb_per_s': round(bytes_in / elapsed / 1e6, 3),
+            }
+    if job['status'] == 'done':
+        status['result_name'] = job['result_name']
+    return status
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(METRICS.render(get_result_cache()), mimetype='text/plain; version=0.0.4')
+
+@app.route("/profiles/<name>", methods=["GET"])
+def profile_dump(name):
+    if not app.config['PROFILING_ENABLED']:
+        abort(404)
+    return send_from_directory(app.config['PROFILE_DIR'], name, mimetype='text/plain')
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(get_result_cache().stats())
 
 @app.route("/preview", methods=["POST"])
 def preview():
@@ -463,186 +1272,338 @@ def preview():
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
 
+    # Known extensions only matter when the content does not settle it
+    extension_type = INPUT_FORMATS.get(os.path.splitext(file.filename.lower())[1])
+
     try:
-        content_bytes = file.read()
-        content = detect_encoding(content_bytes)
-
-        filename_lower = file.filename.lower()
-        preview_data = {
-            'filename': file.filename,
-            'size': len(content_bytes),
-            'encoding': 'utf-8-sig' if content_bytes.startswith(b'\xef\xbb\xbf') else 'utf-8',
-            'issues': []
-        }
+        max_cues, cue_range, with_totals, validate = preview_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        stream = file.stream
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(0)
 
-        if filename_lower.endswith('.srt'):
-            issues = validate_srt_content(content)
-            preview_data['issues'] = issues
-            preview_data['preview'] = preview_srt_content(content)
-            preview_data['type'] = 'srt'
-        elif filename_lower.endswith('.ass'):
-            preview_data['preview'] = content.splitlines()[:10]
-            preview_data['type'] = 'ass'
+        # The UI previews a file right before processing it, and re-uploads
+        # are common, so full previews are cached by content. Hashing is a
+        # plain byte scan; a windowed preview without totals skips it and
+        # stays constant-time.
+        cache = get_result_cache()
+        digest = stream_digest(stream) if with_totals else None
+        if digest is not None:
+            key = cache_key('preview', digest, str(extension_type), str(max_cues), repr(cue_range), str(validate))
+            cached = cache.get('preview', key)
         else:
-            return jsonify({'error': 'Unsupported file type'}), 400
+            cached = None
 
+        if cached is not None:
+            preview_data = json.loads(cached)
+        else:
+            with g.timings.stage('sniff'):
+                encoding, confidence = sniff_encoding(stream.read(ENCODING_SAMPLE_BYTES + 1))
+                stream.seek(0)
+                # The format from content, as /process does (detect_input_format),
+                # but content nobody recognizes under an unknown extension is refused
+                file_type = sniff_format(stream.read(FORMAT_SNIFF_CHARS).decode(encoding, errors='replace')) or extension_type
+                stream.seek(0)
+            if file_type is None:
+                return jsonify({'error': 'Unsupported file type'}), 400
+            if digest is not None:
+                # /process reuses this instead of sniffing the same bytes again
+                cache.set(encoding_cache_key(digest), json.dumps([encoding, confidence]).encode('utf-8'))
+            lines = iter_decoded_lines(stream, encoding)
+            with g.timings.stage('preview') as record:
+                validator = Validator(budget_ms=app.config['VALIDATION_BUDGET_MS']) if validate else None
+                preview_data = preview_document(lines, file_type, max_cues, cue_range, with_totals, validator)
+                record['cues'] = len(preview_data['cues'])
+            lines.close()
+            preview_data.update({
+                'encoding': encoding,
+                'encoding_confidence': confidence,
+                'type': file_type
+            })
+            if digest is not None:
+                cache.set(key, json.dumps(preview_data).encode('utf-8'))
+
+        preview_data['filename'] = file.filename
+        preview_data['size'] = size
         return jsonify(preview_data)
 
     except Exception as e:
         return jsonify({'error': f'Error processing file: {str(e)}'}), 500
 
+def batch_zip_name(filenames):
+    first_name = os.path.splitext(filenames[0])[0] if filenames and filenames[0] else "Subtitles"
+    if not first_name:
+        first_name = "Subtitle"
+    more = len(filenames) - 1
+    if more <= 0:
+        return f"{first_name}_Fixed.by.@bruuhim.zip"
+    return f"{first_name}_and_{more}_more_Fixed.by.@bruuhim.zip"
+
 @app.route("/process", methods=["POST"])
 def process():
     files = request.files.getlist("files")
     if not files:
         return jsonify({'error': 'No files uploaded'}), 400
         
-    opts = {
-        'output_format': request.form.get('output_format', 'srt'),
-        'input_encoding': request.form.get('input_encoding', 'auto'),
-        'fix_rtl': request.form.get('fix_rtl', 'true').lower() == 'true',
-        'fix_rtl_pdf': request.form.get('fix_rtl_pdf', 'false').lower() == 'true',
-        'time_shift_ms': int(request.form.get('time_shift_ms', 0)),
-        'time_shift_from': request.form.get('time_shift_from', "00:00:00,000" if request.form.get('output_format', 'srt') == 'srt' else "0:00:00.00"),
-        'remove_music_lines': request.form.get('remove_music_lines', 'false').lower() == 'true',
-        'remove_tashkeel': request.form.get('remove_tashkeel', 'false').lower() == 'true',
-        'remove_all_tags': request.form.get('remove_all_tags', 'false').lower() == 'true',
-        'keep_italic': request.form.get('keep_italic', 'false').lower() == 'true',
-        'keep_bold': request.form.get('keep_bold', 'false').lower() == 'true',
-        'keep_font_color': request.form.get('keep_font_color', 'false').lower() == 'true',
-        'clean_brackets': request.form.get('clean_brackets', 'false').lower() == 'true',
-        'bracket_options': request.form.get('bracket_options', '{}')
-    }
-    download_mode = request.form.get('download_mode', 'zip')
+    try:
+        opts = process_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Streaming mode decodes, processes and encodes a single file chunk by chunk
+    stream_mode = request.form.get('stream', 'false').lower() == 'true'
     
-    if len(files) == 1:
+    # A zip upload goes through the batch path below, even on its own
+    if len(files) == 1 and not is_zip_archive(files[0].stream):
         try:
+            # Several output formats of one file come back as a zip of the variants
+            if stream_mode and len(opts['output_formats']) == 1:
+                return stream_fixed_file(files[0], opts, g.timings)
+
             f = files[0]
-            content_bytes = f.read()
-            
-            # Decode based on input_encoding
-            if opts['input_encoding'] != 'auto':
-                try:
-                    content = content_bytes.decode(opts['input_encoding'])
-                except Exception:
-                    content = detect_encoding(content_bytes) # fallback
-            else:
-                content = detect_encoding(content_bytes)
-                
-            filename_lower = f.filename.lower()
-            output_format = opts['output_format']
-            
-            # If the user asks for a specific output, process in original format first, then convert
-            input_is_ass = filename_lower.endswith('.ass')
-            
-            if input_is_ass:
-                fixed_content = process_ass(content, opts)
-                if output_format == 'srt' or output_format == 'vtt' or output_format == 'lrc':
-                    fixed_content = convert_ass_to_srt(fixed_content)
-            else:
-                fixed_content = process_srt(content, opts)
-                if output_format == 'ass':
-                    fixed_content = convert_srt_to_ass(fixed_content)
-                    
-            if output_format == 'vtt':
-                fixed_content = convert_srt_to_vtt(fixed_content)
-            elif output_format == 'lrc':
-                fixed_content = convert_srt_to_lrc(fixed_content)
-                
-            # Determine output filename
-            base_name = os.path.splitext(f.filename)[0]
-            if not base_name:
-                base_name = "Subtitle"
-            ext_map = {'srt': '.srt', 'ass': '.ass', 'vtt': '.vtt', 'lrc': '.lrc'}
-            out_ext = ext_map.get(output_format, '.srt')
-            out_filename = f"{base_name}_Fixed.by.@bruuhim{out_ext}"
-            
-            # Encode output
-            if out_ext in ['.srt', '.ass']:
-                out_bytes = fixed_content.encode('utf-8-sig') # with BOM
+            # Large uploads are spooled to a temp file by werkzeug; map it rather than read it
+            validator = Validator(auto_fix=opts['auto_fix'], budget_ms=app.config['VALIDATION_BUDGET_MS'])
+            # Change tracking: track_changes=true on the first upload, then
+            # previous_digest=<X-Document-Digest of the last response> on each
+            # re-upload to get X-Cue-Diff against that version
+            previous_digest = request.form.get('previous_digest') or None
+            track_changes = request.form.get('track_changes', 'false').lower() == 'true'
+            with take_upload_stream(f) as stream, mapped_content(stream, app.config['MMAP_MIN_BYTES']) as content:
+                outputs, diff, validation, digest = fix_file_incremental(
+                    f.filename, content, opts, timings=g.timings, validator=validator,
+                    previous_digest=previous_digest, track_changes=track_changes,
+                )
+
+            if len(outputs) == 1:
+                out_filename, out_bytes = outputs[0]
+                mimetype = "text/plain"
             else:
-                out_bytes = fixed_content.encode('utf-8')
-                
-            import urllib.parse
-            encoded_name = urllib.parse.quote(out_filename)
+                out_filename = batch_zip_name([f.filename])
+                out_bytes = b''.join(iter_zip_stream([(outputs, None)], g.timings))
+                mimetype = 'application/zip'
+            headers = attachment_headers(out_filename)
+            if previous_digest or track_changes:
+                headers['X-Document-Digest'] = digest
+            if diff is not None:
+                # Cue-level changes since the version named by previous_digest
+                headers['X-Cue-Diff'] = json.dumps(diff, separators=(',', ':'))
+            # Counts only; /preview lists the problems themselves
+            headers['X-Validation'] = json.dumps(
+                {k: v for k, v in validation.items() if k != 'problems'}, separators=(',', ':')
+            )
             return Response(
                 out_bytes,
-                mimetype="text/plain",
-                headers={"Content-Disposition": f"attachment; filename*=UTF-8''{encoded_name}"}
+                mimetype=mimetype,
+                headers=headers
             )
             
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
-    memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for f in files:
-            try:
-                content_bytes = f.read()
-                
-                if opts['input_encoding'] != 'auto':
-                    try:
-                        content = content_bytes.decode(opts['input_encoding'])
-                    except Exception:
-                        content = detect_encoding(content_bytes)
-                else:
-                    content = detect_encoding(content_bytes)
-
-                filename_lower = f.filename.lower()
-                output_format = opts['output_format']
-                
-                input_is_ass = filename_lower.endswith('.ass')
-                
-                if input_is_ass:
-                    fixed_content = process_ass(content, opts)
-                    if output_format == 'srt' or output_format == 'vtt' or output_format == 'lrc':
-                        fixed_content = convert_ass_to_srt(fixed_content)
-                else:
-                    fixed_content = process_srt(content, opts)
-                    if output_format == 'ass':
-                        fixed_content = convert_srt_to_ass(fixed_content)
-                        
-                if output_format == 'vtt':
-                    fixed_content = convert_srt_to_vtt(fixed_content)
-                elif output_format == 'lrc':
-                    fixed_content = convert_srt_to_lrc(fixed_content)
-
-                base_name = os.path.splitext(f.filename)[0]
-                if not base_name:
-                    base_name = f"Subtitle_{files.index(f) + 1}"
-                ext_map = {'srt': '.srt', 'ass': '.ass', 'vtt': '.vtt', 'lrc': '.lrc'}
-                out_ext = ext_map.get(output_format, '.srt')
-                out_filename = f"{base_name}_Fixed.by.@bruuhim{out_ext}"
-
-                if out_ext in ['.srt', '.ass']:
-                    out_bytes = fixed_content.encode('utf-8-sig')
-                else:
-                    out_bytes = fixed_content.encode('utf-8')
+    try:
+        inputs = upload_inputs(files)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not inputs:
+        return jsonify({'error': 'No subtitle files found in the upload'}), 400
+    zip_name = batch_zip_name([f.filename for f in files])
 
-                zf.writestr(out_filename, out_bytes)
-            except Exception as e:
-                pass # Continue processing other files
+    # Entries are streamed as they finish; the inputs, archive members
+    # included, are read lazily by the generator
+    uploads = [(filename, stream, f"Subtitle_{index + 1}") for index, (filename, stream) in enumerate(inputs)]
+    results = iter_fixed_files(iter_upload_bytes(uploads), opts, g.timings)
+    return Response(
+        iter_zip_stream(results, g.timings),
+        mimetype='application/zip',
+        headers=attachment_headers(zip_name)
+    )
 
-    memory_file.seek(0)
-    
-    first_name = os.path.splitext(files[0].filename)[0] if files and files[0].filename else "Subtitles"
-    if not first_name:
-        first_name = "Subtitle"
-    more = len(files) - 1
-    if more <= 0:
-        zip_name = f"{first_name}_Fixed.by.@bruuhim.zip"
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    files = request.files.getlist("files")
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+    try:
+        opts = process_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    archive = any(is_zip_archive(f.stream) for f in files)
+    try:
+        inputs = upload_inputs(files)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not inputs:
+        return jsonify({'error': 'No subtitle files found in the upload'}), 400
+    job_id = submit_job(inputs, opts, archive)
+    return jsonify({'id': job_id, 'status_url': f'/jobs/{job_id}', 'result_url': f'/jobs/{job_id}/result'}), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_info(job_id):
+    job = get_job_store().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job_status(job))
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    store = get_job_store()
+    job = store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job['status'] == 'failed':
+        # The job ran and its error is the answer; the request itself is fine
+        return jsonify({'error': job['error'], 'status': job['status']}), 409
+    if job['status'] != 'done':
+        return jsonify({'error': 'Job is not finished', 'status': job['status']}), 409
+    # Jobs finished before result_type was recorded go by the result's name
+    mimetype = job['result_type'] or ('application/zip' if job['result_name'].endswith('.zip') else 'text/plain')
+    response = send_file(store.result_path(job_id), mimetype=mimetype)
+    response.headers.update(attachment_headers(job['result_name']))
+    return response
+
+def parse_api_document(doc, number, defaults, memo):
+    # One decoded NDJSON document -> (filename, content_bytes, fallback_name, opts);
+    # raises ValueError for anything malformed
+    options = doc.get('options') or {}
+    if not isinstance(options, dict):
+        raise ValueError("'options' must be an object")
+    unknown = sorted(set(options) - set(PROCESS_OPTIONS))
+    if unknown:
+        raise ValueError(f"Unknown options: {', '.join(unknown)}")
+
+    # Documents sharing the same options are validated once
+    memo_key = json.dumps(options, sort_keys=True)
+    if memo_key not in memo:
+        memo[memo_key] = process_options(collections.ChainMap(options, defaults))
+    opts = memo[memo_key]
+
+    if isinstance(doc.get('text'), str):
+        content_bytes = doc['text'].encode('utf-8', 'surrogatepass')
+        opts = dict(opts, input_encoding='utf-8')
+    elif isinstance(doc.get('content_base64'), str):
+        import base64
+        content_bytes = base64.b64decode(doc['content_base64'], validate=True)
     else:
-        zip_name = f"{first_name}_and_{more}_more_Fixed.by.@bruuhim.zip"
+        raise ValueError("Each document needs 'text' or 'content_base64'")
+
+    fallback_name = f"Document_{number}"
+    filename = doc.get('filename') or fallback_name
+    if not isinstance(filename, str):
+        raise ValueError(f"'filename' must be a string: {filename!r}")
+    input_format = doc.get('format')
+    if input_format:
+        if not isinstance(input_format, str) or input_format not in PARSERS:
+            raise ValueError(f"Unsupported input format: {input_format!r}")
+        filename = f"{os.path.splitext(filename)[0]}.{input_format}"
+    return filename, content_bytes, fallback_name, opts
+
+def iter_api_documents(stream, defaults, default_opts):
+    # Yields (id, upload, error) per non-blank NDJSON line, reading the body lazily
+    memo = {json.dumps({}): default_opts}
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        doc_id = number
+        try:
+            doc = json.loads(line)
+            if not isinstance(doc, dict):
+                raise ValueError('Each line must be a JSON object')
+            doc_id = doc.get('id', number)
+            upload = parse_api_document(doc, number, defaults, memo)
+        except ValueError as e:
+            yield doc_id, None, e
+            continue
+        yield doc_id, upload, None
+
+def iter_api_results(documents, response_content='text', timings=None):
+    # Documents that failed validation never reach the pipeline; their errors
+    # are interleaved back in input order
+    pending = collections.deque()
+
+    def uploads():
+        for doc_id, upload, error in documents:
+            pending.append((doc_id, error))
+            if error is None:
+                yield upload
+
+    def output_fields(out_filename, out_bytes):
+        fields = {'filename': out_filename}
+        if response_content == 'base64':
+            import base64
+            fields['content_base64'] = base64.b64encode(out_bytes).decode('ascii')
+        else:
+            fields['text'] = out_bytes.decode('utf-8-sig')
+        return fields
+
+    def result_line(doc_id, outputs, error):
+        if error is not None:
+            return json.dumps({'id': doc_id, 'ok': False, 'error': str(error)}, ensure_ascii=False) + '\n'
+        line = {'id': doc_id, 'ok': True}
+        if len(outputs) == 1:
+            line.update(output_fields(*outputs[0]))
+        else:
+            # Several output formats: one entry each, in the order they were asked for
+            line['outputs'] = [output_fields(*output) for output in outputs]
+        return json.dumps(line, ensure_ascii=False) + '\n'
+
+    for outputs, error in iter_fixed_files(uploads(), None, timings):
+        doc_id, rejected = pending.popleft()
+        while rejected is not None:
+            yield result_line(doc_id, None, rejected)
+            doc_id, rejected = pending.popleft()
+        yield result_line(doc_id, outputs, error)
+    while pending:
+        doc_id, rejected = pending.popleft()
+        yield result_line(doc_id, None, rejected)
+
+@app.route("/api/v1/process", methods=["POST"])
+def api_process():
+    # NDJSON in, NDJSON out: one document per line, e.g.
+    #   {"id": "ep1", "filename": "ep1.srt", "text": "...", "options": {"output_format": "vtt"}}
+    #   {"id": "ep2", "format": "ass", "content_base64": "...", "options": {"fix_rtl": false}}
+    # Query parameters set the default options for every document, and
+    # response_content=base64 returns raw output bytes instead of text.
+    # Results stream back in input order as documents finish.
+    try:
+        default_opts = process_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response_content = request.args.get('response_content', 'text')
+    if response_content not in ('text', 'base64'):
+        return jsonify({'error': "response_content must be 'text' or 'base64'"}), 400
+
+    # Repeated output_format arguments stay a list, as process_options reads
+    # them from the MultiDict, when a document's options are merged in
+    defaults = request.args.to_dict()
+    if 'output_format' in request.args:
+        defaults['output_format'] = request.args.getlist('output_format')
+    documents = iter_api_documents(request.stream, defaults, default_opts)
+    return Response(
+        iter_api_results(documents, response_content, g.timings),
+        mimetype='application/x-ndjson'
+    )
+
+def asset_response(result):
+    # (status, headers, body) from assets.py; werkzeug drops the body of HEAD requests
+    status, headers, body = result
+    return Response(body, status=status, headers=headers)
 
-    return send_file(
-        memory_file,
-        download_name=zip_name,
-        as_attachment=True,
-        mimetype='application/zip'
+@app.route("/static/<path:filename>", methods=["GET"])
+def static_file(filename):
+    result = static_response(
+        filename, request.args.get('v'), 'GET',
+        request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding'),
     )
+    if result is None:
+        abort(404)
+    return asset_response(result)
 
 @app.route("/", methods=["GET", "POST"])
 def index():
     if request.method == "POST":
         return process()
-    return render_template("index.html")
+    # The page is prerendered and precompressed once; see assets.py
+    return asset_response(index_response('GET', request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding')))
@@ -0,0 +1,276 @@
+"""ASGI entry point for long-lived servers.
+
+    uvicorn asgi:application
+
+The event loop receives request bodies and spools them to a temp file, then
+hands the Flask app to a small pool of worker threads ordered by arrival time
+plus a size penalty (ASYNC_PRIORITY_BYTES_PER_S), so a /preview that arrives
+behind a 50MB /process starts first while the big upload still runs within a
+bounded delay. Requests of ASYNC_LARGE_BYTES or more never occupy the last
+free worker. When ASYNC_QUEUE_LIMIT requests are already waiting, new ones
+get a 503 with Retry-After instead of piling up. Response bodies are pulled
+from the WSGI iterator on the same pool and sent from the loop, so a slow
+client costs an await, not a worker. Vercel keeps using the WSGI app in app.py.
+"""
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import sys
+import tempfile
+import threading
+import time
+
+from app import app, METRICS, STREAM_CHUNK_SIZE
+
+class QueueFull(Exception):
+    pass
+
+class PriorityExecutor:
+    # Thread pool that runs the lowest priority first, FIFO among equals.
+    # Large tasks may hold at most workers - 1 threads, so one is always left
+    # for small requests even when every big upload is being worked on. Only
+    # submissions with bounded=True count against `limit`: follow-up work
+    # for a response that is already being sent is never refused.
+    def __init__(self, workers, limit):
+        self.workers = workers
+        self.limit = limit
+        self.large_limit = max(1, workers - 1)
+        self.queues = {False: [], True: []}
+        self.running_large = 0
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.threads = []
+        self.closed = False
+
+    def submit(self, priority, fn, *args, large=False, bounded=True):
+        future = concurrent.futures.Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError('executor is shut down')
+            if bounded and len(self.queues[False]) + len(self.queues[True]) >= self.limit:
+                raise QueueFull()
+            heapq.heappush(self.queues[large], (priority, next(self.counter), future, fn, args))
+            if len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work, name=f'asgi-{len(self.threads)}', daemon=True)
+                self.threads.append(thread)
+                thread.start()
+            self.condition.notify()
+        return future
+
+    def next_task(self):
+        # Called with the condition held; returns (large, task) or None
+        candidates = [large for large in (False, True) if self.queues[large]]
+        if self.running_large >= self.large_limit and True in candidates:
+            candidates.remove(True)
+        if not candidates:
+            return None
+        large = min(candidates, key=lambda large: self.queues[large][0][:2])
+        if large:
+            self.running_large += 1
+        return large, heapq.heappop(self.queues[large])
+
+    def work(self):
+        while True:
+            with self.condition:
+                while True:
+                    task = self.next_task()
+                    if task is not None or (self.closed and not self.queues[False] and not self.queues[True]):
+                        break
+                    self.condition.wait()
+                if task is None:
+                    return
+            large, (_, _, future, fn, args) = task
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args))
+                    except BaseException as exc:
+                        future.set_exception(exc)
+            finally:
+                if large:
+                    with self.condition:
+                        self.running_large -= 1
+                        self.condition.notify()
+
+    def shutdown(self):
+        # Queued work still runs; new submissions are refused
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = PriorityExecutor(app.config['ASYNC_WORKERS'], app.config['ASYNC_QUEUE_LIMIT'])
+        return _executor
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown()
+
+def request_priority(size):
+    # Deadline-style ordering: a request is queued as if it had arrived
+    # size / rate seconds later, so small requests overtake big ones but a
+    # big one is never starved for longer than that
+    return time.monotonic() + size / app.config['ASYNC_PRIORITY_BYTES_PER_S']
+
+def wsgi_environ(scope, headers, body, size):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(size),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers:
+        key = name.upper().replace('-', '_')
+        if key == 'CONTENT_TYPE':
+            environ[key] = value
+        elif key != 'CONTENT_LENGTH':
+            key = f'HTTP_{key}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+def read_chunks(iterator):
+    # Pull WSGI chunks until there is enough to be worth a send; returns
+    # (body, more)
+    parts = []
+    size = 0
+    for chunk in iterator:
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_CHUNK_SIZE:
+            return b''.join(parts), True
+    return b''.join(parts), False
+
+def start_wsgi(environ, queued):
+    waited = time.perf_counter() - queued
+    METRICS.observe_stage('queue', waited)
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = status
+        started['headers'] = headers
+
+    chunks = app(environ, start_response)
+    iterator = iter(chunks)
+    try:
+        # Lazy WSGI apps may only call start_response once iterated
+        body, more = read_chunks(iterator)
+    except BaseException:
+        getattr(chunks, 'close', lambda: None)()
+        raise
+    return started['status'], started['headers'], waited, chunks, iterator, body, more
+
+async def receive_body(receive, body, limit):
+    # Spool the request body; returns its size, or None when it goes over
+    # `limit` or the client disconnects first
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit is not None and size > limit:
+            return None
+        if chunk:
+            body.write(chunk)
+        if not message.get('more_body', False):
+            return size
+
+async def send_plain(send, status, text, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain; charset=utf-8'), (b'content-length', str(len(text)).encode())] + list(headers),
+    })
+    await send({'type': 'http.response.body', 'body': text})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            get_executor()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.get_running_loop().run_in_executor(None, shutdown_executor)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        raise RuntimeError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']]
+    limit = app.config['MAX_CONTENT_LENGTH']
+    declared = next((value for name, value in headers if name.lower() == 'content-length'), '')
+    if limit is not None and declared.isdigit() and int(declared) > limit:
+        return await send_plain(send, 413, b'Request Entity Too Large')
+
+    with tempfile.SpooledTemporaryFile(max_size=app.config['ASYNC_SPOOL_BYTES']) as body:
+        size = await receive_body(receive, body, limit)
+        if size is None:
+            return await send_plain(send, 413, b'Request Entity Too Large')
+        body.seek(0)
+
+        executor = get_executor()
+        priority = request_priority(size)
+        large = size >= app.config['ASYNC_LARGE_BYTES']
+        try:
+            future = executor.submit(priority, start_wsgi, wsgi_environ(scope, headers, body, size), time.perf_counter(), large=large)
+        except QueueFull:
+            METRICS.observe_request('queue_full', 503, 0.0)
+            return await send_plain(send, 503, b'Server busy, retry shortly', [(b'retry-after', b'1')])
+        status, response_headers, waited, chunks, iterator, chunk, more = await asyncio.wrap_future(future)
+
+        response_headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response_headers]
+        queue_timing = f'queue;dur={waited * 1000:.2f}'.encode()
+        for index, (name, value) in enumerate(response_headers):
+            if name == b'server-timing':
+                response_headers[index] = (name, value + b', ' + queue_timing)
+                break
+        else:
+            response_headers.append((b'server-timing', queue_timing))
+
+        try:
+            await send({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]), 'headers': response_headers})
+            while more:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk, more = await asyncio.wrap_future(executor.submit(priority, read_chunks, iterator, large=large, bounded=False))
+            await send({'type': 'http.response.body', 'body': chunk})
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                # Runs the app's call_on_close hooks (request metrics, profiler dumps)
+                await asyncio.wrap_future(executor.submit(priority, close, large=large, bounded=False))
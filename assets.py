@@ -0,0 +1,169 @@
+"""Prerendered, precompressed responses for the page and its static files.
+
+templates/index.html has no template logic, so it is rendered once: read,
+with its /static/ references fingerprinted by content hash, and then kept as
+bytes. gzip and, when the optional brotli package is installed, brotli
+encodings are built the first time a client asks for them. Every
+representation has a strong ETag and conditional requests get a 304.
+Fingerprinted static URLs are cached for a year; the page itself is
+revalidated on every visit, so a deploy shows up at once.
+
+Flask-free, so serverless.py can answer page loads without importing Flask.
+"""
+import functools
+import hashlib
+import os
+import re
+import threading
+import zlib
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(ROOT, 'static')
+INDEX_TEMPLATE = os.path.join(ROOT, 'templates', 'index.html')
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+STATIC_CACHE = 'public, max-age=3600'
+PAGE_CACHE = 'no-cache'
+
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'text/javascript; charset=utf-8',
+    '.json': 'application/json',
+    '.svg': 'image/svg+xml',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.ico': 'image/x-icon',
+}
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'image/svg+xml')
+# Tried in order of preference
+ENCODINGS = ('br', 'gzip')
+STATIC_REF_PATTERN = re.compile(r'''(["'])/static/([\w.-]+)\1''')
+
+@functools.lru_cache(maxsize=None)
+def load_brotli():
+    # Optional; without it only gzip is offered
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+class Asset:
+    def __init__(self, body, content_type):
+        self.content_type = content_type
+        self.version = hashlib.blake2b(body, digest_size=8).hexdigest()
+        self.compressible = content_type.startswith(COMPRESSIBLE_TYPES)
+        self._bodies = {'identity': body}
+        self._lock = threading.Lock()
+
+    def body(self, encoding):
+        with self._lock:
+            if encoding not in self._bodies:
+                identity = self._bodies['identity']
+                if encoding == 'br':
+                    self._bodies[encoding] = load_brotli().compress(identity, quality=11)
+                else:
+                    # wbits 31: gzip container, and no mtime so the bytes are reproducible
+                    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+                    self._bodies[encoding] = compressor.compress(identity) + compressor.flush()
+            return self._bodies[encoding]
+
+    def etag(self, encoding):
+        # Strong, and distinct per encoding since the bytes differ
+        return f'"{self.version}"' if encoding == 'identity' else f'"{self.version}-{encoding}"'
+
+    def encoding_for(self, accept_encoding):
+        if not self.compressible or not accept_encoding:
+            return 'identity'
+        accepted = set()
+        for part in accept_encoding.lower().split(','):
+            name, _, params = part.partition(';')
+            params = params.strip()
+            if params.startswith('q=') and params[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+                continue
+            accepted.add(name.strip())
+        for encoding in ENCODINGS:
+            if (encoding in accepted or '*' in accepted) and (encoding != 'br' or load_brotli() is not None):
+                return encoding
+        return 'identity'
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    # If-None-Match uses the weak comparison
+    return '*' in tags or etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags)
+
+_assets = {}
+_assets_lock = threading.RLock()
+
+def load_asset(name):
+    # 'index' for the page, otherwise a file name directly under static/;
+    # None when there is no such file
+    with _assets_lock:
+        asset = _assets.get(name)
+        if asset is None:
+            asset = build_asset(name)
+            # Misses are not remembered, so probing names cannot grow the table
+            if asset is not None:
+                _assets[name] = asset
+        return asset
+
+def build_asset(name):
+    if name == 'index':
+        with open(INDEX_TEMPLATE, encoding='utf-8') as fh:
+            page = fh.read()
+        page = STATIC_REF_PATTERN.sub(fingerprint_static_ref, page)
+        return Asset(page.encode('utf-8'), CONTENT_TYPES['.html'])
+    if not name or name != os.path.basename(name) or name.startswith('.'):
+        return None
+    path = os.path.join(STATIC_DIR, name)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as fh:
+        body = fh.read()
+    return Asset(body, CONTENT_TYPES.get(os.path.splitext(name)[1].lower(), 'application/octet-stream'))
+
+def fingerprint_static_ref(match):
+    quote, name = match.groups()
+    asset = load_asset(name)
+    if asset is None:
+        return match.group(0)
+    return f'{quote}/static/{name}?v={asset.version}{quote}'
+
+def respond(asset, method, if_none_match, accept_encoding, cache_control):
+    # (status, headers, body) for a GET or HEAD of asset
+    encoding = asset.encoding_for(accept_encoding)
+    etag = asset.etag(encoding)
+    headers = [('ETag', etag), ('Cache-Control', cache_control)]
+    if asset.compressible:
+        headers.append(('Vary', 'Accept-Encoding'))
+    if etag_matches(if_none_match, etag):
+        return 304, headers, b''
+    body = asset.body(encoding)
+    headers += [('Content-Type', asset.content_type), ('Content-Length', str(len(body)))]
+    if encoding != 'identity':
+        headers.append(('Content-Encoding', encoding))
+    return 200, headers, b'' if method == 'HEAD' else body
+
+def index_response(method='GET', if_none_match=None, accept_encoding=None):
+    return respond(load_asset('index'), method, if_none_match, accept_encoding, PAGE_CACHE)
+
+def static_response(name, version=None, method='GET', if_none_match=None, accept_encoding=None):
+    # None when name is not a static file. Only URLs carrying the current
+    # fingerprint may be cached for good.
+    asset = load_asset(name)
+    if asset is None:
+        return None
+    cache_control = IMMUTABLE_CACHE if version == asset.version else STATIC_CACHE
+    return respond(asset, method, if_none_match, accept_encoding, cache_control)
+
+def prerender():
+    # Build the page and every encoding ahead of the first visit
+    asset = load_asset('index')
+    for encoding in ENCODINGS:
+        if encoding != 'br' or load_brotli() is not None:
+            asset.body(encoding)
+    return asset
@@ -0,0 +1,212 @@
+"""Benchmarks for the subtitle pipeline.
+
+Generates synthetic SRT/ASS corpora (Arabic/Hebrew text with tashkeel, HTML
+and ASS override tags, music lines, bracketed SDH annotations), times the
+hot paths and a full /process round trip through the Flask test client, and
+writes machine-readable results so versions can be compared:
+
+    python bench.py --cues 5000 --json before.json
+    python bench.py --cues 5000 --json after.json --compare before.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import app
+import rtlfixer
+
+WORDS_AR = ['مَرْحَبًا', 'كَيْفَ', 'حَالُكَ', 'السَّلَامُ', 'عَلَيْكُمْ', 'نَعَمْ', 'لَا', 'شُكْرًا', 'أَيْنَ', 'الْبَيْتُ']
+WORDS_HE = ['שָׁלוֹם', 'תּוֹדָה', 'כֵּן', 'לֹא', 'בַּיִת', 'אֵיפֹה']
+WORDS_EN = ['hello', 'world', 'OK', 'yes', 'no', '2024', 'NASA']
+SDH = ['[MUSIC PLAYING]', '[door slams]', '(sighs)', '(laughing)', '[IN ARABIC]']
+MUSIC = ['♪ ♪', '♪~ ~♪', '♫', '* * *']
+
+BENCH_OPTS = {
+    'output_format': 'srt',
+    'input_encoding': 'auto',
+    'fix_rtl': True,
+    'fix_rtl_pdf': False,
+    'time_shift_ms': 1500,
+    'time_shift_from': '00:00:00,000',
+    'remove_music_lines': True,
+    'remove_tashkeel': True,
+    'remove_all_tags': True,
+    'keep_italic': True,
+    'keep_bold': False,
+    'keep_font_color': False,
+    'clean_brackets': True,
+    'bracket_options': json.dumps({'remove_square': True, 'remove_round': True}),
+}
+
+def synthetic_line(rng):
+    words = rng.choice((WORDS_AR, WORDS_AR, WORDS_HE))
+    text = ' '.join(rng.choice(words) for _ in range(rng.randint(2, 8)))
+    if rng.random() < 0.2:
+        text += ' ' + rng.choice(WORDS_EN)
+    roll = rng.random()
+    if roll < 0.05:
+        return rng.choice(MUSIC)
+    if roll < 0.15:
+        return rng.choice(SDH) + ' ' + text
+    if roll < 0.25:
+        return f'<i>{text}</i>'
+    if roll < 0.30:
+        return f'<font color="#ffff00">{text}</font>'
+    if roll < 0.35:
+        return '{\\an8}' + text
+    return text
+
+def synthetic_cues(count, seed=0):
+    rng = random.Random(seed)
+    t = 1000
+    for _ in range(count):
+        duration = rng.randint(800, 5000)
+        yield t, t + duration, [synthetic_line(rng) for _ in range(rng.randint(1, 2))]
+        t += duration + rng.randint(40, 1500)
+
+def generate_srt(count, seed=0):
+    blocks = []
+    for index, (start, end, lines) in enumerate(synthetic_cues(count, seed), 1):
+        blocks.append(f"{index}\n{rtlfixer.ms_to_ts_srt(start)} --> {rtlfixer.ms_to_ts_srt(end)}\n" + '\n'.join(lines) + '\n')
+    return '\n'.join(blocks)
+
+def generate_ass(count, seed=0):
+    events = [
+        f"Dialogue: 0,{rtlfixer.ms_to_ts_ass(start)},{rtlfixer.ms_to_ts_ass(end)},Default,,0,0,0,,"
+        + '\\N'.join(line.replace('<i>', '{\\i1}').replace('</i>', '{\\i0}') for line in lines)
+        for start, end, lines in synthetic_cues(count, seed)
+    ]
+    return rtlfixer.ASS_DEFAULT_HEADER + '\n' + '\n'.join(events) + '\n'
+
+def measure(fn, repeat):
+    # Best wall time over `repeat` runs, then one traced run for peak memory
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+def post_process(client, uploads, opts):
+    data = {k: str(v).lower() if isinstance(v, bool) else str(v) for k, v in opts.items()}
+    data['files'] = [(io.BytesIO(payload), name) for name, payload in uploads]
+    response = client.post('/process', data=data)
+    assert response.status_code == 200, response.status_code
+    return response.data
+
+def run(args):
+    srt = generate_srt(args.cues, args.seed)
+    ass = generate_ass(args.cues, args.seed)
+    srt_bytes = srt.encode('utf-8')
+    ass_bytes = ass.encode('utf-8-sig')
+    cp1256_bytes = srt.encode('cp1256', errors='replace')
+    processed_srt = rtlfixer.process_srt(srt, BENCH_OPTS)
+    processed_ass = rtlfixer.process_ass(ass, dict(BENCH_OPTS, time_shift_from='0:00:00.00'))
+
+    # Measure the pipeline itself, not the result cache
+    app.app.config['CACHE_BACKEND'] = 'none'
+    app._result_cache = None
+    client = app.app.test_client()
+    batch = [(f'episode_{i:02d}.srt', generate_srt(args.cues, args.seed + i).encode('utf-8')) for i in range(args.batch)]
+    batch_bytes = sum(len(payload) for _, payload in batch)
+
+    single_opts = rtlfixer.process_options(BENCH_OPTS)
+    multi_opts = rtlfixer.process_options(dict(BENCH_OPTS, output_format='srt,vtt,ass'))
+    reshape_opts = rtlfixer.process_options(dict(BENCH_OPTS, reshape_arabic=True))
+
+    cases = [
+        ('process_srt', len(srt_bytes), args.cues, lambda: rtlfixer.process_srt(srt, BENCH_OPTS)),
+        ('process_ass', len(ass_bytes), args.cues, lambda: rtlfixer.process_ass(ass, dict(BENCH_OPTS, time_shift_from='0:00:00.00'))),
+        ('convert_srt_to_ass', len(processed_srt), args.cues, lambda: rtlfixer.convert_srt_to_ass(processed_srt)),
+        ('convert_ass_to_srt', len(processed_ass), args.cues, lambda: rtlfixer.convert_ass_to_srt(processed_ass)),
+        ('convert_srt_to_vtt', len(processed_srt), args.cues, lambda: rtlfixer.convert_srt_to_vtt(processed_srt)),
+        ('convert_srt_to_lrc', len(processed_srt), args.cues, lambda: rtlfixer.convert_srt_to_lrc(processed_srt)),
+        ('detect_encoding_utf8', len(srt_bytes), args.cues, lambda: rtlfixer.detect_encoding(srt_bytes)),
+        ('detect_encoding_cp1256', len(cp1256_bytes), args.cues, lambda: rtlfixer.detect_encoding(cp1256_bytes)),
+        ('http_process_single', len(srt_bytes), args.cues, lambda: post_process(client, [('episode.srt', srt_bytes)], BENCH_OPTS)),
+        ('http_process_batch', batch_bytes, args.cues * args.batch, lambda: post_process(client, batch, BENCH_OPTS)),
+        ('fix_file_srt', len(srt_bytes), args.cues, lambda: rtlfixer.fix_file('episode.srt', srt_bytes, single_opts)),
+        ('fix_file_srt_vtt_ass', len(srt_bytes), args.cues, lambda: rtlfixer.fix_file_outputs('episode.srt', srt_bytes, multi_opts)),
+        ('fix_file_srt_reshape', len(srt_bytes), args.cues, lambda: rtlfixer.fix_file('episode.srt', srt_bytes, reshape_opts)),
+    ]
+
+    results = []
+    for name, size, cues, fn in cases:
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        seconds, peak = measure(fn, args.repeat)
+        results.append({
+            'name': name,
+            'seconds': round(seconds, 6),
+            'cues_per_s': round(cues / seconds, 1),
+            'mb_per_s': round(size / seconds / 1e6, 3),
+            'peak_mb': round(peak / 1e6, 3),
+            'bytes': size,
+            'cues': cues,
+        })
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cues': args.cues,
+        'batch': args.batch,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': results,
+    }
+
+def print_report(report, baseline=None):
+    previous = {r['name']: r for r in baseline['results']} if baseline else {}
+    header = f"{'benchmark':<26}{'time (ms)':>12}{'cues/s':>14}{'MB/s':>10}{'peak MB':>10}"
+    if previous:
+        header += f"{'vs base':>10}"
+    print(header)
+    for r in report['results']:
+        line = f"{r['name']:<26}{r['seconds'] * 1000:>12.2f}{r['cues_per_s']:>14.0f}{r['mb_per_s']:>10.2f}{r['peak_mb']:>10.2f}"
+        if r['name'] in previous:
+            line += f"{previous[r['name']]['seconds'] / r['seconds']:>9.2f}x"
+        print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cues', type=int, default=5000, help='cues per synthetic file (default: 5000)')
+    parser.add_argument('--batch', type=int, default=8, help='files in the batch /process benchmark (default: 8)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark, best is kept (default: 3)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='*', help='run only benchmarks whose name contains one of these')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='baseline results file to compare against')
+    parser.add_argument('--write-corpus', metavar='DIR', help='also write the synthetic SRT/ASS files to DIR')
+    args = parser.parse_args(argv)
+
+    if args.write_corpus:
+        os.makedirs(args.write_corpus, exist_ok=True)
+        with open(os.path.join(args.write_corpus, f'synthetic_{args.cues}.srt'), 'w', encoding='utf-8') as fh:
+            fh.write(generate_srt(args.cues, args.seed))
+        with open(os.path.join(args.write_corpus, f'synthetic_{args.cues}.ass'), 'w', encoding='utf-8-sig') as fh:
+            fh.write(generate_ass(args.cues, args.seed))
+
+    report = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fh:
+            baseline = json.load(fh)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
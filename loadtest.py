@@ -0,0 +1,244 @@
+"""Mixed-traffic load test for /preview and /process.
+
+Runs small /preview and /process clients next to a few clients uploading a
+large file to /process, all at once, and reports per-class p50/p99 latency:
+
+    python loadtest.py                          # in-process ASGI app (asgi.py)
+    python loadtest.py --target wsgi --workers 4  # in-process, FIFO sync workers
+    python loadtest.py --url http://127.0.0.1:8000  # a running server
+
+Every request carries a unique leading cue so the result cache never answers
+it; in-process targets also switch the cache off.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import http.client
+import json
+import platform
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+import bench
+
+CHUNK_SIZE = 64 * 1024
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        value = str(value).lower() if isinstance(value, bool) else str(value)
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8'))
+    for name, filename, payload in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + payload + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+class Traffic:
+    # One client class: endpoint, payload and how many clients send it
+    def __init__(self, name, path, clients, payload):
+        self.name = name
+        self.path = path
+        self.clients = clients
+        self.payload = payload
+        self.latencies = []
+        self.statuses = {}
+        self.lock = threading.Lock()
+        self.counter = 0
+
+    def request_body(self):
+        with self.lock:
+            self.counter += 1
+            number = self.counter
+        unique = f'1\n00:00:00,000 --> 00:00:00,500\n{self.name} {number} {uuid.uuid4().hex}\n\n'.encode('utf-8')
+        if self.path == '/preview':
+            return multipart({'max_cues': 10}, [('file', 'sample.srt', unique + self.payload)])
+        return multipart(bench.BENCH_OPTS, [('files', 'sample.srt', unique + self.payload)])
+
+    def record(self, seconds, status):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else None
+
+        ok = self.statuses.get(200, 0)
+        return {
+            'name': self.name,
+            'path': self.path,
+            'clients': self.clients,
+            'requests': len(latencies),
+            'ok': ok,
+            'rejected': self.statuses.get(503, 0),
+            'errors': len(latencies) - ok - self.statuses.get(503, 0),
+            'p50_ms': round(percentile(0.50), 2) if latencies else None,
+            'p99_ms': round(percentile(0.99), 2) if latencies else None,
+            'max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+            'payload_bytes': len(self.payload),
+        }
+
+def run_url(url, traffic, duration):
+    # Real server: one thread and one keep-alive connection per client
+    parsed = urllib.parse.urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+    prefix = parsed.path.rstrip('/')
+    deadline = time.monotonic() + duration
+
+    def client(kind):
+        connection = connection_class(parsed.netloc, timeout=600)
+        while time.monotonic() < deadline:
+            body, content_type = kind.request_body()
+            started = time.perf_counter()
+            try:
+                connection.request('POST', prefix + kind.path, body, {'Content-Type': content_type})
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = connection_class(parsed.netloc, timeout=600)
+                status = 0
+            kind.record(time.perf_counter() - started, status)
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(kind,)) for kind in traffic for _ in range(kind.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def run_wsgi(traffic, duration, workers):
+    # A synchronous server in miniature: `workers` threads serve requests
+    # strictly in arrival order
+    import app
+    app.app.config['CACHE_BACKEND'] = 'none'
+    app._result_cache = None
+    deadline = time.monotonic() + duration
+
+    def serve(path, body, content_type):
+        return app.app.test_client().post(path, data=body, content_type=content_type).status_code
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as server:
+        def client(kind):
+            while time.monotonic() < deadline:
+                body, content_type = kind.request_body()
+                started = time.perf_counter()
+                status = server.submit(serve, kind.path, body, content_type).result()
+                kind.record(time.perf_counter() - started, status)
+
+        threads = [threading.Thread(target=client, args=(kind,)) for kind in traffic for _ in range(kind.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+async def asgi_request(application, path, body, content_type):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode('ascii'), 'query_string': b'', 'root_path': '',
+        'headers': [(b'content-type', content_type.encode('latin-1')), (b'content-length', str(len(body)).encode('ascii'))],
+        'client': ('127.0.0.1', 0), 'server': ('127.0.0.1', 80),
+    }
+    offsets = iter(range(0, len(body) or 1, CHUNK_SIZE))
+    status = None
+
+    async def receive():
+        offset = next(offsets, None)
+        if offset is None:
+            # Body fully sent; a real client would now just wait
+            await asyncio.Event().wait()
+        await asyncio.sleep(0)
+        return {'type': 'http.request', 'body': body[offset:offset + CHUNK_SIZE], 'more_body': offset + CHUNK_SIZE < len(body)}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(scope, receive, send)
+    return status
+
+def run_asgi(traffic, duration):
+    import app
+    import asgi
+    app.app.config['CACHE_BACKEND'] = 'none'
+    app._result_cache = None
+    deadline = time.monotonic() + duration
+
+    async def client(kind):
+        while time.monotonic() < deadline:
+            body, content_type = kind.request_body()
+            started = time.perf_counter()
+            status = await asgi_request(asgi.application, kind.path, body, content_type)
+            kind.record(time.perf_counter() - started, status)
+
+    async def main():
+        await asyncio.gather(*(client(kind) for kind in traffic for _ in range(kind.clients)))
+
+    try:
+        asyncio.run(main())
+    finally:
+        asgi.shutdown_executor()
+
+def print_report(report):
+    print(f"{'traffic':<16}{'clients':>8}{'requests':>10}{'ok':>6}{'503':>6}{'errors':>8}{'p50 ms':>11}{'p99 ms':>11}{'max ms':>11}")
+    for r in report['results']:
+        p50, p99, peak = (f'{r[k]:.1f}' if r[k] is not None else '-' for k in ('p50_ms', 'p99_ms', 'max_ms'))
+        print(f"{r['name']:<16}{r['clients']:>8}{r['requests']:>10}{r['ok']:>6}{r['rejected']:>6}{r['errors']:>8}{p50:>11}{p99:>11}{peak:>11}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='load a running server instead of an in-process app')
+    parser.add_argument('--target', choices=('asgi', 'wsgi'), default='asgi', help='in-process app to load (default: asgi)')
+    parser.add_argument('--workers', type=int, default=4, help='sync workers for --target wsgi (default: 4)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to keep sending (default: 10)')
+    parser.add_argument('--preview-clients', type=int, default=8)
+    parser.add_argument('--small-clients', type=int, default=4, help='clients sending small files to /process')
+    parser.add_argument('--large-clients', type=int, default=2, help='clients sending the large file to /process')
+    parser.add_argument('--small-cues', type=int, default=200)
+    parser.add_argument('--large-cues', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args(argv)
+
+    small = bench.generate_srt(args.small_cues, args.seed).encode('utf-8')
+    large = bench.generate_srt(args.large_cues, args.seed).encode('utf-8')
+    traffic = [kind for kind in (
+        Traffic('preview_small', '/preview', args.preview_clients, small),
+        Traffic('process_small', '/process', args.small_clients, small),
+        Traffic('process_large', '/process', args.large_clients, large),
+    ) if kind.clients > 0]
+
+    if args.url:
+        run_url(args.url, traffic, args.duration)
+    elif args.target == 'wsgi':
+        run_wsgi(traffic, args.duration, args.workers)
+    else:
+        run_asgi(traffic, args.duration)
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'target': args.url or args.target,
+        'workers': args.workers if args.target == 'wsgi' and not args.url else None,
+        'duration': args.duration,
+        'results': [kind.summary() for kind in traffic],
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
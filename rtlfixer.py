@@ -0,0 +1,2189 @@
+"""Subtitle RTL fixing pipeline, usable without the web app.
+
+Parses SRT/ASS/VTT/LRC, applies the RTL fix and the text/timing filters and
+writes any of those formats. Importing it does not pull in Flask:
+
+    from rtlfixer import fix_subtitle
+    fixed = fix_subtitle(open('episode.srt', 'rb').read(), {'remove_tashkeel': True})
+
+It doubles as a command-line batch tool:
+
+    python -m rtlfixer season1/ --output-dir fixed/ --output-format srt --remove-tashkeel
+"""
+import array
+import bisect
+import codecs
+import collections
+import contextlib
+import functools
+import hashlib
+import html
+import itertools
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+
+# The special 'Right-to-Left Embedding' Unicode character
+U202B = '\u202b'
+U202C = '\u202c' # PDF (Pop Directional Formatting)
+U200F = '\u200f' # RLM (Right-to-Left Mark)
+
+TASHKEEL = set([
+    '\u064b', '\u064c', '\u064d', '\u064e', '\u064f', '\u0650', '\u0651', '\u0652', 
+    '\u0653', '\u0654', '\u0655', '\u0656', '\u0657', '\u0658',
+    '\u0610', '\u0611', '\u0612', '\u0613', '\u0614', '\u0615', '\u0616', '\u0617', 
+    '\u0618', '\u0619', '\u061a',
+    '\u06d6', '\u06d7', '\u06d8', '\u06d9', '\u06da', '\u06db', '\u06dc'
+])
+
+# str.translate tables: drop every tashkeel mark in a single C-level pass
+TASHKEEL_TABLE = dict.fromkeys(map(ord, TASHKEEL))
+
+ASS_OVERRIDE_RE = r'\{.*?\}'
+ASS_OVERRIDE_PATTERN = re.compile(ASS_OVERRIDE_RE)
+HTML_MARKUP_PATTERN = re.compile(r'<[^>]+>')
+MUSIC_LINE_PATTERN = re.compile(r'^[\s\u266a\u266b\u266c\u266d~*\-\.]+$')
+
+def remove_arabic_tashkeel(text):
+    return text.translate(TASHKEEL_TABLE)
+
+def html_tag_pattern(keep_italic=False, keep_bold=False, keep_font_color=False):
+    # Kept tags are excluded with a lookahead instead of a Python callback,
+    # so the whole substitution stays inside the regex engine.
+    kept = []
+    if keep_italic:
+        kept.append(r'/?i>')
+    if keep_bold:
+        kept.append(r'/?b>')
+    if keep_font_color:
+        kept.append(r'font|/font>')
+    if kept:
+        return r'<(?!(?i:' + '|'.join(kept) + r'))[^>]+>'
+    return r'<[^>]+>'
+
+@functools.lru_cache(maxsize=None)
+def compile_html_tag_pattern(keep_italic=False, keep_bold=False, keep_font_color=False):
+    # Eight possible patterns, all compiled by warm_up()
+    return re.compile(html_tag_pattern(keep_italic, keep_bold, keep_font_color))
+
+def remove_tags(text, keep_italic=False, keep_bold=False, keep_font_color=False):
+    # Remove ASS override tags {...}, then selectively remove HTML tags
+    text = ASS_OVERRIDE_PATTERN.sub('', text)
+    return compile_html_tag_pattern(bool(keep_italic), bool(keep_bold), bool(keep_font_color)).sub('', text)
+
+def is_music_line(text):
+    # Strip tags to check just the text content
+    clean_text = HTML_MARKUP_PATTERN.sub('', ASS_OVERRIDE_PATTERN.sub('', text)).strip()
+    return MUSIC_LINE_PATTERN.match(clean_text) is not None
+
+def parse_bracket_options(opts):
+    if not opts:
+        return {}
+    try:
+        options = json.loads(opts) if isinstance(opts, str) else opts
+    except ValueError:
+        return {}
+    return options if isinstance(options, dict) else {}
+
+def bracket_options_key(opts):
+    # Hashable form of bracket_options, as sent (a JSON string) or parsed
+    if opts is None or isinstance(opts, str):
+        return opts
+    return json.dumps(opts, sort_keys=True)
+
+# User-supplied pairs are unbounded, so their patterns live in a bounded LRU
+BRACKET_PAIR_CACHE_SIZE = 256
+
+@functools.lru_cache(maxsize=BRACKET_PAIR_CACHE_SIZE)
+def bracket_pair_pattern(opening, closing):
+    return re.compile(f'{re.escape(opening)}.*?{re.escape(closing)}')
+
+def bracket_patterns(options):
+    patterns = []
+    if options.get('remove_square'):
+        patterns.append(r'\[.*?\]')
+    if options.get('remove_round'):
+        patterns.append(r'\(.*?\)')
+    if options.get('remove_angle'):
+        # Only remove angle brackets if they aren't part of kept HTML tags
+        # A simple approach: remove <...> if it doesn't look like a standard HTML formatting tag
+        patterns.append(r'<(?!\/?(?:i|b|font)[ >]).*?>')
+    if options.get('remove_curly_text'):
+        # This removes curly braces that were not removed by ASS tag removal (e.g. non-override curlies)
+        patterns.append(ASS_OVERRIDE_RE)
+    for pair in options.get('custom_pairs') or ():
+        if len(pair) == 2:
+            patterns.append(bracket_pair_pattern(pair[0], pair[1]).pattern)
+    return patterns
+
+@functools.lru_cache(maxsize=64)
+def compile_bracket_patterns(key):
+    # One pattern per bracket kind, applied in turn: a single alternation
+    # would differ on overlaps, e.g. '(a [b) c]'
+    return tuple(re.compile(pattern) for pattern in bracket_patterns(parse_bracket_options(key)))
+
+def clean_brackets(text, opts):
+    for pattern in compile_bracket_patterns(bracket_options_key(opts)):
+        text = pattern.sub('', text)
+    return text
+
+def ts_srt_to_ms(ts):
+    parts = ts.split(':')
+    if len(parts) == 3:
+        h = int(parts[0])
+        m = int(parts[1])
+        s_ms = parts[2].split(',')
+        s = int(s_ms[0])
+        ms = int(s_ms[1]) if len(s_ms) > 1 else 0
+        return h * 3600000 + m * 60000 + s * 1000 + ms
+    return 0
+
+def ms_to_ts_srt(ms):
+    ms = max(0, ms)
+    h = ms // 3600000
+    ms %= 3600000
+    m = ms // 60000
+    ms %= 60000
+    s = ms // 1000
+    ms %= 1000
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+def ts_ass_to_ms(ts):
+    parts = ts.split(':')
+    if len(parts) == 3:
+        h = int(parts[0])
+        m = int(parts[1])
+        s_cs = parts[2].split('.')
+        s = int(s_cs[0])
+        cs = int(s_cs[1]) if len(s_cs) > 1 else 0
+        return h * 3600000 + m * 60000 + s * 1000 + cs * 10
+    return 0
+
+def ms_to_ts_ass(ms):
+    ms = max(0, ms)
+    h = ms // 3600000
+    ms %= 3600000
+    m = ms // 60000
+    ms %= 60000
+    s = ms // 1000
+    ms %= 1000
+    cs = ms // 10
+    return f"{h}:{m:02d}:{s:02d}.{cs:02d}"
+
+# ---------------------------------------------------------------------------
+# Bidi analysis
+#
+# Each character maps to a one-letter category through str.translate and a
+# codepoint table, so classifying a line is a single C-level pass. Smart RTL
+# marking and the preview stats both read the resulting string:
+#   R  strong right-to-left (R, AL)     L  strong left-to-right (L)
+#   D  digits (EN, AN)                  W  whitespace and separators (WS, S, B)
+#   M  marks that take the direction of their base (NSM, BN)
+#   N  every other neutral: punctuation, symbols, explicit formatting codes
+# ---------------------------------------------------------------------------
+
+BIDI_CATEGORIES = {'R': 'R', 'AL': 'R', 'L': 'L', 'EN': 'D', 'AN': 'D', 'WS': 'W', 'S': 'W', 'B': 'W', 'NSM': 'M', 'BN': 'M'}
+
+class BidiClassTable(dict):
+    # codepoint -> category; characters outside the precomputed blocks are
+    # looked up once, on first sight
+    def __missing__(self, codepoint):
+        category = BIDI_CATEGORIES.get(unicodedata.bidirectional(chr(codepoint)), 'N')
+        self[codepoint] = category
+        return category
+
+BIDI_CLASSES = BidiClassTable()
+# Latin, Hebrew, Arabic and Syriac, general punctuation and the presentation forms
+for _block in (range(0x0000, 0x0800), range(0x2000, 0x2070), range(0xFB1D, 0xFE00), range(0xFE70, 0xFF00)):
+    for _codepoint in _block:
+        BIDI_CLASSES[_codepoint]
+del _block, _codepoint
+
+BIDI_MARKUP_PATTERN = re.compile(r'<[^>]*>|\{[^}]*\}')
+BIDI_ENTITY_PATTERN = re.compile(r'&(?:[A-Za-z]+|#\d+|#x[0-9A-Fa-f]+);')
+
+def bidi_classes(text):
+    # Category string of the visible text: HTML, WebVTT and ASS override tags
+    # are not rendered, and a WebVTT character reference counts as one neutral
+    if '<' in text or '{' in text:
+        text = BIDI_MARKUP_PATTERN.sub('', text)
+    if '&' in text:
+        text = BIDI_ENTITY_PATTERN.sub('&', text)
+    return text.translate(BIDI_CLASSES)
+
+def bidi_direction(classes):
+    # Base direction a first-strong-character renderer would pick
+    rtl = classes.find('R')
+    ltr = classes.find('L')
+    if rtl < 0 and ltr < 0:
+        return 'neutral'
+    if ltr < 0 or 0 <= rtl < ltr:
+        return 'rtl'
+    return 'ltr'
+
+def rtl_marking_needed(classes):
+    # None when the line renders the same under any base direction: no RTL
+    # text at all, or RTL text with strong characters at both ends.
+    # 'embed' for mixed-direction lines, otherwise which ends need an RLM.
+    if 'R' not in classes:
+        return None
+    if 'L' in classes:
+        return 'embed'
+    core = classes.strip('W')
+    start = core[0] != 'R'                      # leading punctuation or numbers
+    end = core.rstrip('M')[-1] == 'N'           # trailing punctuation; trailing digits follow the RTL run
+    if start and end:
+        return 'both'
+    if start:
+        return 'start'
+    if end:
+        return 'end'
+    return None
+
+def mark_rtl_smart(text, pdf=False):
+    # RLE(+PDF) around mixed-direction lines, a bare RLM where only a leading
+    # or trailing neutral needs anchoring, nothing where nothing is needed.
+    # Markers from an earlier pass are dropped first, so this is idempotent.
+    text = text.replace(U202B, '').replace(U202C, '').strip(U200F)
+    needed = rtl_marking_needed(bidi_classes(text))
+    if needed is None:
+        return text
+    if needed == 'embed':
+        return U202B + text + U202C if pdf else U202B + text
+    if needed != 'end':
+        text = U200F + text
+    if needed != 'start':
+        text = text + U200F
+    return text
+
+# ---------------------------------------------------------------------------
+# Arabic reshaping
+#
+# For players that neither shape Arabic nor run the bidi algorithm (and so
+# ignore the RLE/RLM marks). Letters become their contextual presentation
+# forms -- isolated, final, initial, medial, and lam-alef as one ligature --
+# and each line is rearranged into visual order, so the player only has to
+# draw the glyphs left to right. The form tables are built once at import
+# from the compatibility decompositions of the presentation form blocks;
+# shaping is then a single pass over the line with one dict lookup per
+# character.
+# ---------------------------------------------------------------------------
+
+ARABIC_FORM_TAGS = ('<isolated>', '<final>', '<initial>', '<medial>')
+ARABIC_LAM = '\u0644'
+
+def build_arabic_tables():
+    # forms: letter -> [isolated, final, initial, medial], None where the letter
+    # has no such form; ligatures: alef -> [isolated, final] lam-alef ligature;
+    # joining: letter -> 'D' (joins both sides), 'R' (joins the letter before
+    # it only), 'C' (tatweel, ZWJ: joins without changing shape) or 'T' (marks,
+    # skipped when looking for the neighbouring letter)
+    forms = {}
+    ligatures = {}
+    for codepoint in itertools.chain(range(0xFB50, 0xFC00), range(0xFE70, 0xFF00)):
+        decomposition = unicodedata.decomposition(chr(codepoint)).split()
+        if len(decomposition) < 2 or decomposition[0] not in ARABIC_FORM_TAGS:
+            continue
+        form = ARABIC_FORM_TAGS.index(decomposition[0])
+        letters = ''.join(chr(int(value, 16)) for value in decomposition[1:])
+        if len(letters) == 1:
+            slots = forms.setdefault(letters, [None] * 4)
+        elif len(letters) == 2 and letters[0] == ARABIC_LAM and form < 2:
+            slots = ligatures.setdefault(letters[1], [None] * 2)
+        else:
+            continue
+        if slots[form] is None:
+            slots[form] = chr(codepoint)
+
+    joining = {'\u0640': 'C', '\u200d': 'C'}
+    for letter, slots in forms.items():
+        if slots[2] is not None:
+            joining[letter] = 'D'
+        elif slots[1] is not None:
+            joining[letter] = 'R'
+    for codepoint in itertools.chain(range(0x0610, 0x0700), range(0x08D3, 0x0900)):
+        if unicodedata.category(chr(codepoint)) in ('Mn', 'Me'):
+            joining[chr(codepoint)] = 'T'
+    return forms, ligatures, joining
+
+ARABIC_FORMS, ARABIC_LIGATURES, ARABIC_JOINING = build_arabic_tables()
+# Shaping only looks inside a word, so each word is shaped once and cached
+ARABIC_WORD_PATTERN = re.compile(f'[{re.escape("".join(sorted(set(ARABIC_FORMS) | set(ARABIC_JOINING))))}]+')
+ARABIC_WORD_CACHE_SIZE = 8192
+JOINS_FORWARD = ('D', 'C')
+JOINS_BACKWARD = ('D', 'R', 'C')
+
+# Paired punctuation is mirrored inside right-to-left runs
+MIRRORED_CHARS = str.maketrans('()[]{}<>\u00ab\u00bb', ')(][}{><\u00bb\u00ab')
+MIRRORED_PATTERN = re.compile('[()\\[\\]{}<>\u00ab\u00bb]')
+# Runs of one category in a bidi_classes() string; marks stay with their run
+BIDI_RUN_PATTERN = re.compile(r'R[RM]*|L[LM]*|D[DM]*|[NWM]+')
+BIDI_RUN_KINDS = {'R': 'R', 'L': 'L', 'D': 'D', 'N': 'N', 'W': 'N', 'M': 'N'}
+# Marks of the precomputed blocks, for reversing runs without splitting clusters
+BIDI_MARK_CHARS = ''.join(chr(codepoint) for codepoint, category in sorted(BIDI_CLASSES.items()) if category == 'M')
+BIDI_MARK_PATTERN = re.compile(f'[{re.escape(BIDI_MARK_CHARS)}]')
+BIDI_CLUSTER_PATTERN = re.compile(f'.[{re.escape(BIDI_MARK_CHARS)}]*', re.S)
+HTML_OPEN_TAG_PATTERN = re.compile(r'<([A-Za-z]+)')
+HTML_CLOSE_TAG_PATTERN = re.compile(r'</([A-Za-z]+)\s*>')
+
+def contextual_form(letter, joins_before, joins_after):
+    slots = ARABIC_FORMS.get(letter)
+    if slots is None:
+        return letter
+    form = slots[joins_before + 2 * joins_after]
+    if form is None:
+        # A right-joining letter has no initial or medial form
+        form = slots[joins_before] or slots[0]
+    return form
+
+def shape_arabic(text):
+    # Contextual forms in one pass. The form of a letter depends on the next
+    # letter, so it is settled when that one (or the end of the line) arrives.
+    out = []
+    pending = -1            # index in out of the letter still waiting for its form
+    pending_type = None
+    pending_before = False  # whether that letter joins the one before it
+    for char in text:
+        kind = ARABIC_JOINING.get(char)
+        if kind == 'T':
+            out.append(char)
+            continue
+        joins = pending >= 0 and pending_type in JOINS_FORWARD and kind in JOINS_BACKWARD
+        if pending >= 0 and out[pending] == ARABIC_LAM and char in ARABIC_LIGATURES:
+            # Lam-alef: one glyph that joins backwards only
+            out[pending] = ARABIC_LIGATURES[char][pending_before] or out[pending] + char
+            pending = -1
+            continue
+        if pending >= 0:
+            out[pending] = contextual_form(out[pending], pending_before, joins)
+        out.append(char)
+        if kind in JOINS_BACKWARD:
+            pending, pending_type, pending_before = len(out) - 1, kind, joins
+        else:
+            pending = -1
+    if pending >= 0:
+        out[pending] = contextual_form(out[pending], pending_before, False)
+    return ''.join(out)
+
+def visual_order(text, rtl):
+    # Reorder one line for left-to-right display: a reduced bidi algorithm
+    # with a single paragraph level (rules W7, N1/N2, I1/I2 and L2) over runs
+    # of one bidi category rather than single characters. Tags stay whole;
+    # the ones wrapping the whole line stay where they are, and HTML
+    # open/close pairs inside it are swapped back when the reorder flipped them.
+    units = []
+    kinds = []
+    position = 0
+    for match in itertools.chain(BIDI_MARKUP_PATTERN.finditer(text), (None,)):
+        segment = text[position:match.start() if match else len(text)]
+        if segment:
+            for run in BIDI_RUN_PATTERN.finditer(segment.translate(BIDI_CLASSES)):
+                units.append(segment[run.start():run.end()])
+                kinds.append(BIDI_RUN_KINDS[run.group()[0]])
+        if match:
+            units.append(match.group(0))
+            kinds.append('X')
+            position = match.end()
+
+    head = 0
+    while head < len(kinds) and kinds[head] == 'X':
+        head += 1
+    tail = len(kinds)
+    while tail > head and kinds[tail - 1] == 'X':
+        tail -= 1
+    pairs = html_tag_pairs(units, kinds)
+    # A tag at the end whose partner is inside the line has to move with it
+    moved = True
+    while moved:
+        moved = False
+        for start, end in pairs:
+            if start < head <= end < tail:
+                head, moved = start, True
+            elif head <= start < tail <= end:
+                tail, moved = end + 1, True
+    body = kinds[head:tail]
+
+    base = 'R' if rtl else 'L'
+    strong = base
+    for index, kind in enumerate(body):
+        if kind in 'RL':
+            strong = kind
+        elif kind == 'D' and strong == 'L':
+            body[index] = 'L'
+    # Neutrals (and tags) between two runs of one direction take it, others
+    # the paragraph's; numbers count as right-to-left here
+    index = 0
+    while index < len(body):
+        if body[index] not in 'NX':
+            index += 1
+            continue
+        end = index
+        while end < len(body) and body[end] in 'NX':
+            end += 1
+        before = base if index == 0 else ('L' if body[index - 1] == 'L' else 'R')
+        after = base if end == len(body) else ('L' if body[end] == 'L' else 'R')
+        body[index:end] = [before if before == after else base] * (end - index)
+        index = end
+
+    if rtl:
+        levels = [1 if kind == 'R' else 2 for kind in body]
+    else:
+        levels = [0 if kind == 'L' else 1 if kind == 'R' else 2 for kind in body]
+    order = list(range(head, tail))
+    for level in range(max(levels, default=0), 0, -1):
+        index = 0
+        while index < len(order):
+            if levels[index] < level:
+                index += 1
+                continue
+            end = index
+            while end < len(order) and levels[end] >= level:
+                end += 1
+            order[index:end] = order[index:end][::-1]
+            levels[index:end] = levels[index:end][::-1]
+            index = end
+
+    reordered = units[:head] + [
+        reverse_run(units[i]) if level % 2 and kinds[i] != 'X' else units[i]
+        for i, level in zip(order, levels)
+    ] + units[tail:]
+
+    # Open/close pairs that the reorder flipped are swapped back
+    placed = {original: new for new, original in enumerate(order, head)}
+    for start, end in pairs:
+        if head <= start and end < tail and placed[start] > placed[end]:
+            first, second = placed[start], placed[end]
+            reordered[first], reordered[second] = reordered[second], reordered[first]
+    return ''.join(reordered)
+
+def html_tag_pairs(units, kinds):
+    # (open, close) unit indexes of matching HTML tags
+    pairs = []
+    stack = []
+    for index, kind in enumerate(kinds):
+        if kind != 'X':
+            continue
+        opened = HTML_OPEN_TAG_PATTERN.match(units[index])
+        closed = HTML_CLOSE_TAG_PATTERN.match(units[index])
+        if opened:
+            stack.append((opened.group(1).lower(), index))
+        elif closed:
+            name = closed.group(1).lower()
+            for depth in range(len(stack) - 1, -1, -1):
+                if stack[depth][0] == name:
+                    pairs.append((stack.pop(depth)[1], index))
+                    break
+    return pairs
+
+def reverse_run(run):
+    # Characters of a right-to-left run in display order, combining marks
+    # kept after their base and paired punctuation mirrored
+    if BIDI_MARK_PATTERN.search(run):
+        run = ''.join(reversed(BIDI_CLUSTER_PATTERN.findall(run)))
+    else:
+        run = run[::-1]
+    # translate() looks up every character, so only when there is something to mirror
+    return run.translate(MIRRORED_CHARS) if MIRRORED_PATTERN.search(run) else run
+
+@functools.lru_cache(maxsize=ARABIC_WORD_CACHE_SIZE)
+def shape_arabic_word(word):
+    return shape_arabic(word)
+
+def shape_arabic_match(match):
+    return shape_arabic_word(match.group())
+
+def reshape_arabic_line(text):
+    # Shaped and in visual order; lines without right-to-left text are left
+    # alone. Direction marks from an earlier pass mean nothing in visual order.
+    text = text.replace(U202B, '').replace(U202C, '').replace(U200F, '')
+    classes = bidi_classes(text)
+    if 'R' not in classes:
+        return text
+    shaped = ARABIC_WORD_PATTERN.sub(shape_arabic_match, text)
+    if 'L' not in classes and 'D' not in classes and '<' not in text and '{' not in text:
+        # Right-to-left text and neutrals only, the common case: a single run
+        return reverse_run(shaped)
+    return visual_order(shaped, bidi_direction(classes) == 'rtl')
+
+# Options that change what the per-line text filter does
+TEXT_FILTER_KEYS = (
+    'remove_tashkeel', 'remove_all_tags', 'keep_italic', 'keep_bold', 'keep_font_color',
+    'clean_brackets', 'bracket_options', 'fix_rtl', 'fix_rtl_pdf', 'rtl_marking', 'reshape_arabic',
+)
+
+def text_filter_key(opts):
+    key = []
+    for name in TEXT_FILTER_KEYS:
+        value = opts.get(name)
+        if name == 'bracket_options':
+            value = bracket_options_key(value) if opts.get('clean_brackets') else None
+        elif name == 'rtl_marking':
+            value = value or 'always'
+        else:
+            value = bool(value)
+        key.append(value)
+    return tuple(key)
+
+@functools.lru_cache(maxsize=64)
+def compile_text_filter(key):
+    options = dict(zip(TEXT_FILTER_KEYS, key))
+
+    # Tag and bracket removal run as separate passes in the order of the
+    # individual filters, since one alternation would treat overlapping
+    # brackets differently. Most lines have nothing to strip, so a single
+    # search over all the patterns decides whether the passes run at all.
+    patterns = []
+    if options['remove_all_tags']:
+        patterns.append(ASS_OVERRIDE_PATTERN)
+        patterns.append(compile_html_tag_pattern(options['keep_italic'], options['keep_bold'], options['keep_font_color']))
+    if options['clean_brackets']:
+        patterns.extend(compile_bracket_patterns(bracket_options_key(options['bracket_options'])))
+    strip_subs = [pattern.sub for pattern in patterns]
+    strip_probe = re.compile('|'.join(pattern.pattern for pattern in patterns)).search if patterns else None
+
+    tashkeel_table = TASHKEEL_TABLE if options['remove_tashkeel'] else None
+    fix_rtl = options['fix_rtl']
+    fix_rtl_pdf = options['fix_rtl_pdf']
+    smart_rtl = options['rtl_marking'] == 'smart'
+    reshape = options['reshape_arabic']
+
+    def text_filter(text):
+        if tashkeel_table:
+            text = text.translate(tashkeel_table)
+        if strip_probe and strip_probe(text):
+            for strip_sub in strip_subs:
+                text = strip_sub('', text)
+        if reshape:
+            # Shaped text in visual order replaces the RTL marks
+            return reshape_arabic_line(text)
+        # FIX: only apply RTL marker to non-empty lines to avoid corrupting
+        # SRT block separators and timestamp lines with stray Unicode chars.
+        if fix_rtl and text.strip():
+            if smart_rtl:
+                text = mark_rtl_smart(text, fix_rtl_pdf)
+            elif fix_rtl_pdf:
+                text = U202B + text.replace(U202B, '').replace(U202C, '') + U202C
+            else:
+                text = U202B + text.replace(U202B, '')
+        return text
+
+    return text_filter
+
+def get_text_filter(opts):
+    # Compiled once per distinct option set and reused for every line
+    return compile_text_filter(text_filter_key(opts))
+
+def apply_text_filters(text, opts):
+    return get_text_filter(opts)(text)
+
+# ---------------------------------------------------------------------------
+# Subtitle document model
+#
+# Every format is parsed into a stream of Cue objects plus passthrough items:
+# raw lines for ASS (headers, styles and Comment: events), VttBlock for the
+# WebVTT header and NOTE/STYLE/REGION blocks, LrcTag for LRC metadata. Each
+# writer emits only the passthrough items of its own format. Filtering and
+# time shifting run on that stream and each writer serializes it exactly once.
+# ---------------------------------------------------------------------------
+
+class Cue:
+    __slots__ = ('start', 'end', 'lines', 'fields', 'settings', 'index')
+
+    def __init__(self, start, end, lines, fields=None, settings=None, index=None):
+        self.start = start    # milliseconds
+        self.end = end        # milliseconds
+        self.lines = lines    # list of text lines
+        # ASS only: ("Dialogue: <layer>", "Style,Name,MarginL,MarginR,MarginV,Effect")
+        self.fields = fields
+        # WebVTT only: (identifier or None, cue settings such as "align:start line:0")
+        self.settings = settings
+        # SRT only: the block number as written, if there was one
+        self.index = index
+
+    def __repr__(self):
+        return f"Cue({self.start}, {self.end}, {self.lines!r})"
+
+class Passthrough(str):
+    # Non-cue content of a format other than ASS
+    pass
+
+class VttBlock(Passthrough):
+    pass
+
+class LrcTag(Passthrough):
+    pass
+
+SRT_TIMING_PATTERN = re.compile(r'^(\d+):(\d{2}):(\d{2})[,.](\d{1,3})\s*-->\s*(\d+):(\d{2}):(\d{2})[,.](\d{1,3})')
+VTT_TIMING_PATTERN = re.compile(r'^(?:(\d+):)?(\d{2}):(\d{2})\.(\d{3})\s+-->\s+(?:(\d+):)?(\d{2}):(\d{2})\.(\d{3})')
+ASS_TIME_PATTERN = re.compile(r'^\s*(\d+):(\d{2}):(\d{2})(?:\.(\d{1,3}))?\s*$')
+LRC_TIME_PATTERN = re.compile(r'\[(\d+):(\d{2})(?:[.:](\d{1,3}))?\]')
+ASS_BREAK_PATTERN = re.compile(r'\\[Nn]')
+LRC_TAG_PATTERN = re.compile(r'^\[([A-Za-z#]+):(.*)\]$')
+LRC_WORD_TIME_PATTERN = re.compile(r'<\d+:\d{2}(?:[.:]\d{1,3})?>')
+# WebVTT markup with no SRT/ASS equivalent: class, voice, language and ruby
+# spans and karaoke timestamps (<i>, <b> and <u> are kept)
+VTT_MARKUP_PATTERN = re.compile(r'</?(?:c|v|lang|ruby|rt)(?:[.\s][^>]*)?>|<(?:\d+:)?\d{2}:\d{2}\.\d{3}>')
+VTT_BARE_AMPERSAND_PATTERN = re.compile(r'&(?!(?:[A-Za-z]+|#\d+|#x[0-9A-Fa-f]+);)')
+
+# Cues without an explicit end (LRC) stay on screen until the next one, or this long
+LRC_LAST_CUE_MS = 5000
+
+def frac_to_ms(frac):
+    # "5" -> 500, "05" -> 50, "050" -> 50: the fractional part is a decimal fraction of a second
+    return int(frac.ljust(3, '0')[:3]) if frac else 0
+
+def parse_timestamp(ts):
+    # Accepts both SRT ("00:01:02,500") and ASS ("0:01:02.50") style timestamps
+    match = ASS_TIME_PATTERN.match(ts.replace(',', '.')) if ts else None
+    if not match:
+        return 0
+    h, m, s, frac = match.groups()
+    return int(h) * 3600000 + int(m) * 60000 + int(s) * 1000 + frac_to_ms(frac)
+
+def ms_to_ts_vtt(ms):
+    return ms_to_ts_srt(ms).replace(',', '.')
+
+def ms_to_ts_lrc(ms):
+    ms = max(0, ms)
+    return f"[{ms // 60000:02d}:{ms // 1000 % 60:02d}.{ms % 1000 // 10:02d}]"
+
+def parse_srt(lines, issues=None):
+    cue = None
+    in_text = False
+    pending = None    # (line_number, line) of an index line not yet known to start a block
+
+    for number, line in enumerate(lines, 1):
+        stripped = line.strip()
+        match = SRT_TIMING_PATTERN.match(stripped) if stripped else None
+        if match:
+            if cue is not None:
+                yield cue
+            g = match.groups()
+            cue = Cue(
+                int(g[0]) * 3600000 + int(g[1]) * 60000 + int(g[2]) * 1000 + frac_to_ms(g[3]),
+                int(g[4]) * 3600000 + int(g[5]) * 60000 + int(g[6]) * 1000 + frac_to_ms(g[7]),
+                [],
+                index=int(pending[1]) if pending is not None else None,
+            )
+            in_text = True
+            pending = None
+            continue
+
+        if pending is not None:
+            # The previous digit-only line turned out to be text, not a block index
+            if in_text:
+                cue.lines.append(pending[1])
+            elif issues is not None:
+                issues.append(f"Invalid SRT structure around line {pending[0]}")
+            pending = None
+
+        if not stripped:
+            in_text = False
+        elif stripped.isdigit():
+            pending = (number, line)
+        elif cue is not None:
+            # Text after a stray blank line still belongs to the previous block
+            cue.lines.append(line)
+            if not in_text and issues is not None:
+                issues.append(f"Text outside a subtitle block at line {number}")
+
+    if pending is not None:
+        if in_text:
+            cue.lines.append(pending[1])
+        elif issues is not None:
+            issues.append(f"Invalid SRT structure around line {pending[0]}")
+    if cue is not None:
+        yield cue
+
+def parse_ass(lines):
+    # Dialogue events become cues; every other line is passed through as-is
+    for line in lines:
+        if line.lstrip().startswith('Dialogue:'):
+            parts = line.split(',', 9)
+            if len(parts) == 10:
+                start = ASS_TIME_PATTERN.match(parts[1])
+                end = ASS_TIME_PATTERN.match(parts[2])
+                if start and end:
+                    yield Cue(
+                        parse_timestamp(parts[1]),
+                        parse_timestamp(parts[2]),
+                        ASS_BREAK_PATTERN.split(parts[9]),
+                        (parts[0], ','.join(parts[3:9])),
+                    )
+                    continue
+        yield line
+
+def parse_vtt(lines):
+    # Cues keep their identifier and settings; the header and NOTE, STYLE and
+    # REGION blocks become VttBlock items
+    block = []
+    first = True
+    # A trailing blank line flushes the last block
+    for line in itertools.chain(lines, ('',)):
+        if line.strip():
+            block.append(line)
+            continue
+        if not block:
+            continue
+        if first:
+            first = False
+            if block[0].lstrip('\ufeff').startswith('WEBVTT'):
+                yield VttBlock('\n'.join(block).lstrip('\ufeff'))
+                block = []
+                continue
+        timing = 0 if '-->' in block[0] else 1
+        match = VTT_TIMING_PATTERN.match(block[timing].strip()) if len(block) > timing else None
+        if match:
+            g = match.groups()
+            yield Cue(
+                int(g[0] or 0) * 3600000 + int(g[1]) * 60000 + int(g[2]) * 1000 + int(g[3]),
+                int(g[4] or 0) * 3600000 + int(g[5]) * 60000 + int(g[6]) * 1000 + int(g[7]),
+                block[timing + 1:],
+                settings=(block[0].strip() if timing else None, block[timing].strip()[match.end():].strip()),
+            )
+        elif block[0].startswith(('NOTE', 'STYLE', 'REGION')):
+            yield VttBlock('\n'.join(block))
+        block = []
+
+def parse_lrc(lines):
+    # Metadata tags come first as LrcTag items. [offset:+ms] is applied to
+    # every time stamp (a positive offset shows lyrics earlier). A stamp with
+    # no text only ends the previous line; enhanced-LRC word stamps are dropped.
+    timed = []
+    tags = []
+    offset = 0
+    for line in lines:
+        stamps = LRC_TIME_PATTERN.findall(line)
+        if not stamps:
+            tag = LRC_TAG_PATTERN.match(line.strip())
+            if tag and tag.group(1).lower() == 'offset':
+                try:
+                    offset = int(tag.group(2).strip() or 0)
+                except ValueError:
+                    pass
+            elif tag:
+                tags.append(LrcTag(line.strip()))
+            continue
+        text = LRC_WORD_TIME_PATTERN.sub('', LRC_TIME_PATTERN.sub('', line)).strip()
+        for m, s, frac in stamps:
+            timed.append((max(0, int(m) * 60000 + int(s) * 1000 + frac_to_ms(frac) - offset), text))
+    timed.sort(key=lambda t: t[0])
+    yield from tags
+    for i, (start, text) in enumerate(timed):
+        if not text:
+            continue
+        end = timed[i + 1][0] if i + 1 < len(timed) else start + LRC_LAST_CUE_MS
+        yield Cue(start, end, [text])
+
+def filter_cues(items, opts):
+    # Text filters and music-line removal; timing changes happen in retime_cues
+    text_filter = get_text_filter(opts)
+    remove_music = opts.get('remove_music_lines')
+
+    for item in items:
+        if isinstance(item, Cue):
+            # Remove music lines if requested
+            if remove_music and is_music_line('\n'.join(item.lines)):
+                continue
+            item.lines = [text_filter(line) for line in item.lines]
+        yield item
+
+# ---------------------------------------------------------------------------
+# Retiming engine
+#
+# Start/end times of a batch of cues are loaded into contiguous int64 arrays
+# (NumPy when it is installed, array('q') otherwise) and every timing change
+# is applied to the whole batch at once:
+#   1. framerate conversion (e.g. 23.976 -> 25), a linear scale
+#   2. piecewise shifts: each cue gets the shift of the last segment whose
+#      "from" time is at or before its (converted) start
+#   3. minimum gap / overlap fix: ends are pulled back so every cue ends at
+#      least min_gap_ms before the next one starts
+# ---------------------------------------------------------------------------
+
+RETIME_BATCH_SIZE = 4096
+
+class RetimePlan:
+    __slots__ = ('factor', 'segment_starts', 'segment_shifts', 'min_gap')
+
+    def __init__(self, factor=1.0, segments=(), min_gap=None):
+        segments = sorted(segments)
+        self.factor = factor
+        self.segment_starts = [start for start, _ in segments]
+        self.segment_shifts = [shift for _, shift in segments]
+        self.min_gap = min_gap
+
+    def shifts_times(self):
+        return self.factor != 1.0 or any(self.segment_shifts)
+
+def parse_shift_segments(value):
+    # JSON list of [from, shift_ms] pairs or {"from": ..., "shift_ms": ...} objects;
+    # "from" may be milliseconds or an SRT/ASS timestamp
+    if not value:
+        return []
+    try:
+        raw = json.loads(value) if isinstance(value, str) else value
+    except ValueError:
+        return []
+    segments = []
+    for entry in raw if isinstance(raw, list) else ():
+        if isinstance(entry, dict):
+            start, shift = entry.get('from', 0), entry.get('shift_ms', 0)
+        elif isinstance(entry, (list, tuple)) and len(entry) == 2:
+            start, shift = entry
+        else:
+            continue
+        start = parse_timestamp(start) if isinstance(start, str) else int(start)
+        segments.append((start, int(shift)))
+    return segments
+
+def retime_plan(opts):
+    # None when the options leave every timestamp untouched
+    segments = []
+    time_shift_ms = opts.get('time_shift_ms', 0) or 0
+    if time_shift_ms != 0:
+        segments.append((parse_timestamp(opts.get('time_shift_from')), time_shift_ms))
+    segments.extend(parse_shift_segments(opts.get('time_shift_segments')))
+
+    factor = 1.0
+    fps_from, fps_to = opts.get('framerate_from'), opts.get('framerate_to')
+    if fps_from and fps_to and float(fps_from) != float(fps_to):
+        factor = float(fps_from) / float(fps_to)
+
+    min_gap = opts.get('min_gap_ms')
+    min_gap = int(min_gap) if min_gap not in (None, '') else None
+
+    plan = RetimePlan(factor, segments, min_gap)
+    if not plan.shifts_times() and plan.min_gap is None:
+        return None
+    return plan
+
+@functools.lru_cache(maxsize=None)
+def load_numpy():
+    # Imported on first use so importing this module stays cheap; the
+    # retiming engine falls back to array('q') when NumPy is missing
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def load_times(cues):
+    numpy = load_numpy()
+    if numpy is not None:
+        starts = numpy.fromiter((cue.start for cue in cues), dtype=numpy.int64, count=len(cues))
+        ends = numpy.fromiter((cue.end for cue in cues), dtype=numpy.int64, count=len(cues))
+        return starts, ends
+    return array.array('q', (cue.start for cue in cues)), array.array('q', (cue.end for cue in cues))
+
+def store_times(cues, starts, ends):
+    numpy = load_numpy()
+    if numpy is not None:
+        starts, ends = starts.tolist(), ends.tolist()
+    for cue, start, end in zip(cues, starts, ends):
+        cue.start = start
+        cue.end = end
+
+def shift_times(starts, ends, plan):
+    numpy = load_numpy()
+    if numpy is not None:
+        if plan.factor != 1.0:
+            starts = numpy.rint(starts * plan.factor).astype(numpy.int64)
+            ends = numpy.rint(ends * plan.factor).astype(numpy.int64)
+        if plan.segment_starts:
+            index = numpy.searchsorted(numpy.asarray(plan.segment_starts, dtype=numpy.int64), starts, side='right') - 1
+            shifts = numpy.asarray([0] + plan.segment_shifts, dtype=numpy.int64)[index + 1]
+            starts = starts + shifts
+            ends = ends + shifts
+        return starts, ends
+
+    if plan.factor != 1.0:
+        factor = plan.factor
+        starts = array.array('q', [round(t * factor) for t in starts])
+        ends = array.array('q', [round(t * factor) for t in ends])
+    if plan.segment_starts:
+        segment_starts, all_shifts = plan.segment_starts, [0] + plan.segment_shifts
+        shifts = [all_shifts[bisect.bisect_right(segment_starts, t)] for t in starts]
+        starts = array.array('q', [t + d for t, d in zip(starts, shifts)])
+        ends = array.array('q', [t + d for t, d in zip(ends, shifts)])
+    return starts, ends
+
+def gap_track(cue):
+    # ASS events on different layers overlap by design, so each layer gets
+    # its gaps fixed on its own
+    return cue.fields[0] if cue.fields else None
+
+def fix_gaps(starts, ends, min_gap, tracks):
+    # Ends each cue min_gap before the next cue of its track starts, taking
+    # neighbours in start order rather than file order. Cues that start
+    # together keep overlapping, and a cue too close to its neighbour for the
+    # gap runs up to it instead of losing its duration. Returns (ends, has_next).
+    groups = {}
+    for i, track in enumerate(tracks):
+        groups.setdefault(track, []).append(i)
+    numpy = load_numpy()
+    if numpy is not None:
+        ends = ends.copy()
+        has_next = numpy.zeros(len(starts), dtype=bool)
+        for indices in groups.values():
+            order = numpy.asarray(indices)
+            order = order[numpy.argsort(starts[order], kind='stable')]
+            sorted_starts = starts[order]
+            following = numpy.searchsorted(sorted_starts, sorted_starts, side='right')
+            found = following < len(order)
+            cues = order[found]
+            next_starts = sorted_starts[following[found]]
+            limit = next_starts - min_gap
+            limit = numpy.where(limit > starts[cues], limit, next_starts)
+            ends[cues] = numpy.minimum(ends[cues], limit)
+            has_next[cues] = True
+        return ends, has_next.tolist()
+    ends = array.array('q', ends)
+    has_next = [False] * len(starts)
+    for indices in groups.values():
+        order = sorted(indices, key=starts.__getitem__)
+        sorted_starts = [starts[i] for i in order]
+        for i in order:
+            following = bisect.bisect_right(sorted_starts, starts[i])
+            if following == len(order):
+                continue
+            next_start = sorted_starts[following]
+            limit = next_start - min_gap
+            if limit <= starts[i]:
+                limit = next_start
+            if ends[i] > limit:
+                ends[i] = limit
+            has_next[i] = True
+    return ends, has_next
+
+def retime_cues(items, opts):
+    # Batches cues (passthrough lines keep their place) and retimes each batch
+    # in one go. With a gap fix, cues with no later cue of their track yet are
+    # held back until the next batch is known; in start-ordered input that is
+    # only the last one. Out-of-order cues find their neighbours within a
+    # batch and the cues held back from the one before.
+    plan = retime_plan(opts)
+    if plan is None:
+        yield from items
+        return
+
+    pending = []    # items not yet yielded
+    batch = []      # cues in pending that still need shifting
+    held = []       # already shifted cues in pending, waiting for a later cue of their track
+
+    def retime_batch():
+        nonlocal held
+        if plan.shifts_times() and batch:
+            starts, ends = shift_times(*load_times(batch), plan)
+            store_times(batch, starts, ends)
+        if plan.min_gap is not None:
+            cues = held + batch
+            starts, ends = load_times(cues)
+            ends, has_next = fix_gaps(starts, ends, plan.min_gap, [gap_track(cue) for cue in cues])
+            store_times(cues, starts, ends)
+            held = [cue for cue, found in zip(cues, has_next) if not found]
+        batch.clear()
+
+    for item in items:
+        pending.append(item)
+        if not isinstance(item, Cue):
+            continue
+        batch.append(item)
+        if len(batch) >= RETIME_BATCH_SIZE:
+            retime_batch()
+            if plan.min_gap is None:
+                yield from pending
+                pending.clear()
+            else:
+                # Everything up to the first held cue is final
+                held_ids = {id(cue) for cue in held}
+                cut = next((i for i, item in enumerate(pending) if id(item) in held_ids), len(pending))
+                yield from pending[:cut]
+                del pending[:cut]
+
+    retime_batch()
+    yield from pending
+
+# ---------------------------------------------------------------------------
+# Validation
+#
+# One linear pass over the parsed cues. Every rule is an object that looks at
+# one cue at a time, together with the cue before it, and may keep state
+# across cues. Rules carry a severity (error, warning, info) and optionally a
+# fix() that repairs the cue in place. The cue before the current one is held
+# back until its successor has been checked, so a rule can still change it
+# (the overlap fix trims its end). Checking stops once the time budget is
+# spent; the cues themselves always pass through unchanged in number and order.
+# ---------------------------------------------------------------------------
+
+SEVERITIES = ('error', 'warning', 'info')
+VALIDATION_BUDGET_MS = 100
+VALIDATION_MAX_LISTED = 200
+
+DIRECTIONAL_MARKS = {
+    '\u200e': 'ltr', '\u202a': 'ltr', '\u202d': 'ltr', '\u2066': 'ltr',   # LRM, LRE, LRO, LRI
+    '\u200f': 'rtl', '\u202b': 'rtl', '\u202e': 'rtl', '\u2067': 'rtl',   # RLM, RLE, RLO, RLI
+    '\u061c': 'rtl',                                                   # ALM
+}
+DIRECTIONAL_MARK_PATTERN = re.compile('[' + ''.join(DIRECTIONAL_MARKS) + ']')
+DUPLICATE_MARK_PATTERN = re.compile('([' + ''.join(DIRECTIONAL_MARKS) + r'])\1+')
+HTML_TAG_PATTERN = re.compile(r'<(/?)([biu]|font)\b[^>]*>', re.IGNORECASE)
+# Every directional formatting character, none of which is rendered
+DIRECTIONAL_FORMATTING_PATTERN = re.compile('[' + ''.join(DIRECTIONAL_MARKS) + '\u202c\u2068\u2069]')   # + PDF, FSI, PDI
+
+def visible_text(line):
+    # What the viewer reads: no markup, no directional formatting
+    if '<' in line or '{' in line:
+        line = BIDI_MARKUP_PATTERN.sub('', line)
+    if line.isascii():
+        return line
+    return DIRECTIONAL_FORMATTING_PATTERN.sub('', line)
+
+class ValidationRule:
+    name = None
+    severity = 'warning'
+    formats = None      # input formats the rule applies to; None for all
+    fixable = False
+
+    def check(self, number, cue, previous, visible):
+        # A message describing the problem with this cue, or None
+        return None
+
+    def fix(self, number, cue, previous):
+        pass
+
+    def finish(self):
+        # [(cue number, message)] for problems only visible once every cue is seen
+        return []
+
+class DurationRule(ValidationRule):
+    name = 'duration'
+    severity = 'error'
+    fixable = True
+    fixed_duration_ms = 1000
+
+    def check(self, number, cue, previous, visible):
+        if cue.end <= cue.start:
+            return f"Cue ends {cue.start - cue.end} ms before it starts" if cue.end < cue.start else "Cue has zero duration"
+
+    def fix(self, number, cue, previous):
+        cue.end = cue.start + self.fixed_duration_ms
+
+class OverlapRule(ValidationRule):
+    # Cues in start order are checked against the previous one as they come;
+    # if the starts are not in order, every interval is sorted and swept at the end
+    name = 'overlap'
+    formats = ('srt', 'vtt')    # layered ASS events overlap by design
+    fixable = True
+
+    def __init__(self):
+        self.intervals = []
+        self.ordered = True
+        self.reported = set()
+
+    def check(self, number, cue, previous, visible):
+        self.intervals.append((cue.start, cue.end, number))
+        if previous is None:
+            return None
+        if cue.start < previous.start:
+            self.ordered = False
+        elif self.ordered and cue.start < previous.end:
+            self.reported.add(number)
+            return f"Overlaps the previous cue by {previous.end - cue.start} ms"
+
+    def fix(self, number, cue, previous):
+        if previous.start < cue.start:
+            previous.end = cue.start
+
+    def finish(self):
+        if self.ordered:
+            return []
+        problems = []
+        self.intervals.sort()
+        latest_end, latest = -1, None
+        for start, end, number in self.intervals:
+            if start < latest_end and number not in self.reported:
+                problems.append((number, f"Overlaps cue {latest} by {min(latest_end, end) - start} ms"))
+            if end > latest_end:
+                latest_end, latest = end, number
+        return problems
+
+class ReadingSpeedRule(ValidationRule):
+    name = 'reading_speed'
+    max_cps = 20    # characters per second
+
+    def check(self, number, cue, previous, visible):
+        duration = cue.end - cue.start
+        characters = sum(map(len, visible))
+        if duration > 0 and characters * 1000 > self.max_cps * duration:
+            return f"{characters * 1000 / duration:.1f} characters per second (max {self.max_cps})"
+
+class LineLengthRule(ValidationRule):
+    name = 'line_length'
+    max_length = 42
+
+    def check(self, number, cue, previous, visible):
+        longest = max(map(len, visible), default=0)
+        if longest > self.max_length:
+            return f"Line of {longest} characters (max {self.max_length})"
+
+class UnclosedTagRule(ValidationRule):
+    # <i>, <b>, <u> and <font> must be closed within the cue; ASS overrides
+    # reset at the end of every event, so they cannot be left open
+    name = 'unclosed_tags'
+    formats = ('srt', 'vtt')
+    fixable = True
+
+    def open_tags(self, cue):
+        stack = []
+        for line in cue.lines:
+            if '<' not in line:
+                continue
+            for closing, tag in HTML_TAG_PATTERN.findall(line):
+                tag = tag.lower()
+                if not closing:
+                    stack.append(tag)
+                elif tag in stack:
+                    del stack[len(stack) - 1 - stack[::-1].index(tag)]
+        return stack
+
+    def check(self, number, cue, previous, visible):
+        stack = self.open_tags(cue)
+        if stack:
+            return "Unclosed " + ', '.join(f"<{tag}>" for tag in stack)
+
+    def fix(self, number, cue, previous):
+        if cue.lines:
+            cue.lines[-1] += ''.join(f"</{tag}>" for tag in reversed(self.open_tags(cue)))
+
+class DirectionalMarkRule(ValidationRule):
+    name = 'directional_marks'
+    fixable = True
+
+    def check(self, number, cue, previous, visible):
+        for line in cue.lines:
+            if line.isascii():
+                continue
+            marks = DIRECTIONAL_MARK_PATTERN.findall(line)
+            if not marks:
+                continue
+            if len({DIRECTIONAL_MARKS[mark] for mark in marks}) > 1:
+                return "Mixes left-to-right and right-to-left marks"
+            if DUPLICATE_MARK_PATTERN.search(line):
+                return "Repeated directional mark"
+
+    def fix(self, number, cue, previous):
+        # Only repeats can be fixed safely; which direction was meant is a guess
+        cue.lines = [DUPLICATE_MARK_PATTERN.sub(r'\1', line) for line in cue.lines]
+
+class NumberingRule(ValidationRule):
+    # SRT block numbers; the SRT writer always renumbers, so this is informational
+    name = 'numbering'
+    severity = 'info'
+    formats = ('srt',)
+    fixable = True
+
+    def __init__(self):
+        self.expected = 1
+
+    def check(self, number, cue, previous, visible):
+        expected = self.expected
+        self.expected += 1
+        if cue.index is not None and cue.index != expected:
+            return f"Numbered {cue.index}, expected {expected}"
+
+    def fix(self, number, cue, previous):
+        cue.index = self.expected - 1
+
+# Rule classes run by default, in order; a fresh instance of each checks one document
+VALIDATION_RULES = [
+    DurationRule, OverlapRule, ReadingSpeedRule, LineLengthRule,
+    UnclosedTagRule, DirectionalMarkRule, NumberingRule,
+]
+
+class Validator:
+    def __init__(self, rules=None, auto_fix=False, budget_ms=VALIDATION_BUDGET_MS):
+        self.rule_classes = VALIDATION_RULES if rules is None else rules
+        self.rules = []
+        self.auto_fix = auto_fix
+        self.budget = budget_ms / 1000
+        self.problems = []
+        self.counts = collections.Counter()
+        self.fixed = 0
+        self.cues = 0
+        self.checked = 0
+        self.elapsed = 0.0
+        self.truncated = False
+
+    def record(self, rule, number, message, fixed=False):
+        self.counts[rule.severity] += 1
+        if len(self.problems) < VALIDATION_MAX_LISTED:
+            self.problems.append({'rule': rule.name, 'severity': rule.severity, 'cue': number,
+                                  'message': message, 'fixed': fixed})
+
+    def check(self, cue, previous, rules, report=True):
+        visible = [visible_text(line) for line in cue.lines]
+        for rule in rules:
+            message = rule.check(self.cues, cue, previous, visible)
+            if message is None:
+                continue
+            fixed = self.auto_fix and rule.fixable
+            if fixed:
+                rule.fix(self.cues, cue, previous)
+                self.fixed += 1
+            if report:
+                self.record(rule, self.cues, message, fixed)
+
+    def iter_validated(self, items, input_format='srt'):
+        # Same items, one cue behind: passthrough items keep their place.
+        # Only the checks count against the budget, not the consumer. The
+        # budget only limits the report: with auto_fix, the fixable rules
+        # keep running to the last cue so the output never depends on timing.
+        self.rules = [rule() for rule in self.rule_classes if rule.formats is None or input_format in rule.formats]
+        fixers = [rule for rule in self.rules if rule.fixable] if self.auto_fix else []
+        clock = time.perf_counter
+        pending = []
+        previous = None
+        for item in items:
+            if isinstance(item, Cue):
+                self.cues += 1
+                if not self.truncated:
+                    start = clock()
+                    self.check(item, previous, self.rules)
+                    self.checked += 1
+                    self.elapsed += clock() - start
+                    self.truncated = self.elapsed > self.budget
+                elif fixers:
+                    self.check(item, previous, fixers, report=False)
+                yield from pending
+                pending.clear()
+                previous = item
+            pending.append(item)
+        yield from pending
+        if not self.truncated:
+            start = clock()
+            for rule in self.rules:
+                for number, message in rule.finish():
+                    self.record(rule, number, message)
+            self.elapsed += clock() - start
+
+    def report(self):
+        return {
+            'cues': self.cues,
+            'checked': self.checked,
+            'truncated': self.truncated,
+            'elapsed_ms': round(self.elapsed * 1000, 2),
+            'counts': {severity: self.counts[severity] for severity in SEVERITIES},
+            'fixed': self.fixed,
+            'problems': self.problems,
+        }
+
+# Timestamp formatting: a cached clock prefix per whole second plus a
+# precomputed fractional suffix, applied to a batch of times at once
+TIMESTAMP_MS = [f"{ms:03d}" for ms in range(1000)]
+TIMESTAMP_CS = [f"{ms // 10:02d}" for ms in range(1000)]
+
+@functools.lru_cache(maxsize=1 << 16)
+def clock_prefix(seconds, style):
+    if style == 'lrc':
+        return f"[{seconds // 60:02d}:{seconds % 60:02d}"
+    h, rem = divmod(seconds, 3600)
+    if style == 'ass':
+        return f"{h}:{rem // 60:02d}:{rem % 60:02d}"
+    return f"{h:02d}:{rem // 60:02d}:{rem % 60:02d}"
+
+TIMESTAMP_STYLES = {
+    'srt': (',', TIMESTAMP_MS, ''),
+    'vtt': ('.', TIMESTAMP_MS, ''),
+    'ass': ('.', TIMESTAMP_CS, ''),
+    'lrc': ('.', TIMESTAMP_CS, ']'),
+}
+
+def format_timestamps(values, style):
+    separator, fractions, close = TIMESTAMP_STYLES[style]
+    out = []
+    for ms in values:
+        if ms < 0:
+            ms = 0
+        out.append(clock_prefix(ms // 1000, style) + separator + fractions[ms % 1000] + close)
+    return out
+
+def iter_with_timestamps(items, style, batch_size=RETIME_BATCH_SIZE):
+    # Yields (item, start, end); timestamps are None for passthrough lines
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, batch_size))
+        if not batch:
+            return
+        cues = [item for item in batch if isinstance(item, Cue)]
+        starts = iter(format_timestamps([cue.start for cue in cues], style))
+        ends = iter(format_timestamps([cue.end for cue in cues], style))
+        for item in batch:
+            if isinstance(item, Cue):
+                yield item, next(starts), next(ends)
+            else:
+                yield item, None, None
+
+def plain_lines(cue):
+    # Text lines of a cue for writers of another format: ASS override tags
+    # stripped, WebVTT-only markup removed and its character references decoded
+    if cue.fields is not None:
+        return [ASS_OVERRIDE_PATTERN.sub('', line) for line in cue.lines]
+    if cue.settings is not None:
+        return [html.unescape(VTT_MARKUP_PATTERN.sub('', line)) for line in cue.lines]
+    return cue.lines
+
+def write_srt(items):
+    index = 0
+    for item, start, end in iter_with_timestamps(items, 'srt'):
+        if start is not None:
+            index += 1
+            block = f"{index}\n{start} --> {end}\n"
+            if item.lines:
+                block += '\n'.join(plain_lines(item)) + '\n'
+            yield block if index == 1 else '\n' + block
+
+ASS_DEFAULT_HEADER = '\n'.join([
+    "[Script Info]",
+    "ScriptType: v4.00+",
+    "WrapStyle: 0",
+    "ScaledBorderAndShadow: yes",
+    "Collisions: Normal",
+    "",
+    "[V4+ Styles]",
+    "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding",
+    "Style: Default,Arial,40,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,2,0,2,10,10,10,0",
+    "",
+    "[Events]",
+    "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+])
+ASS_DEFAULT_FIELDS = ("Dialogue: 0", "Default,,0,0,0,")
+
+def write_ass(items):
+    # Lines are separated by newlines, not terminated by them, as process_ass
+    # has always written them
+    started = False
+    for item, start, end in iter_with_timestamps(items, 'ass'):
+        if start is not None:
+            if not started:
+                # Converted from a format without a script header
+                yield ASS_DEFAULT_HEADER
+                started = True
+            if item.fields is None:
+                head, tail = ASS_DEFAULT_FIELDS
+                text = '\\N'.join(line.strip() for line in plain_lines(item))
+            else:
+                head, tail = item.fields
+                text = '\\N'.join(item.lines)
+            yield f"\n{head},{start},{end},{tail},{text}"
+        elif not isinstance(item, Passthrough):
+            yield '\n' + item if started else item
+            started = True
+
+def write_vtt(items):
+    started = False
+    index = 0
+    for item, start, end in iter_with_timestamps(items, 'vtt'):
+        if not started:
+            started = True
+            if isinstance(item, VttBlock) and item.startswith('WEBVTT'):
+                yield item + '\n'
+                continue
+            yield "WEBVTT\n"
+        if start is not None:
+            index += 1
+            if item.settings is not None:
+                identifier, settings = item.settings
+                block = '\n' + (f"{identifier}\n" if identifier else '')
+                block += f"{start} --> {end} {settings}\n" if settings else f"{start} --> {end}\n"
+                lines = item.lines
+            else:
+                block = f"\n{index}\n{start} --> {end}\n"
+                lines = [VTT_BARE_AMPERSAND_PATTERN.sub('&amp;', line) for line in plain_lines(item)]
+            if lines:
+                block += '\n'.join(lines) + '\n'
+            yield block
+        elif isinstance(item, VttBlock):
+            yield '\n' + item + '\n'
+    if not started:
+        yield "WEBVTT\n"
+
+def write_lrc(items):
+    # LRC has no end times: a bare stamp clears the line when a gap follows it
+    previous_end = None
+    for item, start, end in iter_with_timestamps(items, 'lrc'):
+        if start is None:
+            if isinstance(item, LrcTag):
+                yield item + '\n'
+            continue
+        if previous_end is not None and previous_end[0] < item.start:
+            yield previous_end[1] + '\n'
+        text = ' '.join(line.strip() for line in plain_lines(item))
+        yield f"{start}{text}\n"
+        previous_end = (item.end, end)
+    if previous_end is not None:
+        yield previous_end[1] + '\n'
+
+PARSERS = {'srt': parse_srt, 'ass': parse_ass, 'vtt': parse_vtt, 'lrc': parse_lrc}
+WRITERS = {'srt': write_srt, 'ass': write_ass, 'vtt': write_vtt, 'lrc': write_lrc}
+
+def serialize(items, output_format):
+    return ''.join(WRITERS[output_format](items))
+
+INPUT_FORMATS = {'.srt': 'srt', '.ass': 'ass', '.ssa': 'ass', '.vtt': 'vtt', '.lrc': 'lrc'}
+
+def input_format_for(filename):
+    return INPUT_FORMATS.get(os.path.splitext(filename.lower())[1], 'srt')
+
+FORMAT_SNIFF_CHARS = 4096
+LRC_LINE_PATTERN = re.compile(r'^\[\d+:\d{2}(?:[.:]\d{1,3})?\]')
+ASS_SECTION_MARKERS = ('[Script Info]', '[V4+ Styles]', '[V4 Styles]', '[Events]', 'Dialogue:')
+
+def sniff_format(head):
+    # Input format from the start of a document, or None when it is not conclusive
+    lines = [line.strip() for line in head.lstrip('\ufeff').splitlines()]
+    if lines and len(head) >= FORMAT_SNIFF_CHARS and not head.endswith(('\n', '\r')):
+        lines.pop()    # possibly cut short
+    first = next((line for line in lines if line), '')
+    if first.startswith('WEBVTT'):
+        return 'vtt'
+    for line in lines:
+        if line.startswith(ASS_SECTION_MARKERS):
+            return 'ass'
+        if SRT_TIMING_PATTERN.match(line):
+            return 'srt'
+        if LRC_LINE_PATTERN.match(line):
+            return 'lrc'
+    return None
+
+def detect_input_format(content, filename=''):
+    # Content first: a .srt upload that is really WebVTT is parsed as WebVTT
+    return sniff_format(content[:FORMAT_SNIFF_CHARS]) or input_format_for(filename)
+
+def iter_process_document(lines, input_format, output_format, opts, validator=None):
+    # Lazily yields output cue blocks as the input lines are consumed, so a
+    # lines iterator that decodes on demand keeps memory flat (LRC input
+    # is the exception: its cues must be sorted first). The validator, as in
+    # fix_file_outputs, sees the parsed input and applies auto_fix.
+    items = PARSERS[input_format](lines)
+    if validator is not None:
+        items = validator.iter_validated(items, input_format)
+    return WRITERS[output_format](retime_cues(filter_cues(items, opts), opts))
+
+def process_document(content, input_format, output_format, opts):
+    # One parse, one filter pass and one serialization, whatever the formats
+    return ''.join(iter_process_document(content.splitlines(), input_format, output_format, opts))
+
+def process_srt(content, opts):
+    return process_document(content, 'srt', 'srt', opts)
+
+def process_ass(content, opts):
+    return process_document(content, 'ass', 'ass', opts)
+
+def convert_subtitle(content, output_format, input_format=None):
+    # Any format to any other in one parse and one write, no filters applied
+    input_format = input_format or detect_input_format(content)
+    return serialize(PARSERS[input_format](content.splitlines()), output_format)
+
+def convert_srt_to_ass(content):
+    return serialize(parse_srt(content.splitlines()), 'ass')
+
+def convert_ass_to_srt(content):
+    return serialize(parse_ass(content.splitlines()), 'srt')
+
+def convert_srt_to_vtt(content):
+    return serialize(parse_srt(content.splitlines()), 'vtt')
+
+def convert_srt_to_lrc(content):
+    return serialize(parse_srt(content.splitlines()), 'lrc')
+
+# ---------------------------------------------------------------------------
+# Encoding detection
+#
+# BOMs first, then a bounded sample is scored against UTF-8 and the
+# single-byte code pages common for Arabic/Hebrew subtitles. The full
+# payload is decoded exactly once, with the winner.
+# ---------------------------------------------------------------------------
+
+ENCODING_SAMPLE_BYTES = 64 * 1024
+
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# Characters that count as evidence for each candidate: RTL letters that are
+# not glued to ASCII letters, or accented Latin letters that are
+_NOT_LATIN_BEFORE = r'(?<![A-Za-z])'
+_NOT_LATIN_AFTER = r'(?![A-Za-z])'
+SINGLE_BYTE_CANDIDATES = (
+    ('cp1256', re.compile(_NOT_LATIN_BEFORE + r'[؀-ۿ]' + _NOT_LATIN_AFTER)),
+    ('iso-8859-6', re.compile(_NOT_LATIN_BEFORE + r'[؀-ۿ]' + _NOT_LATIN_AFTER)),
+    ('cp1255', re.compile(_NOT_LATIN_BEFORE + r'[֐-׿]' + _NOT_LATIN_AFTER)),
+    ('cp1252', re.compile(r'(?<=[A-Za-z])[À-ÿ]|[À-ÿ](?=[A-Za-z])')),
+)
+HIGH_BYTES = bytes(range(0x80, 0x100))
+
+def sniff_utf16(sample):
+    # UTF-16 without a BOM: the high byte of every code unit is NUL for ASCII
+    # and 0x05/0x06 for Hebrew/Arabic
+    half = len(sample) // 2
+    if half < 2:
+        return None, 0.0
+    even, odd = sample[0::2], sample[1::2]
+    for encoding, high, low in (('utf-16-le', odd, even), ('utf-16-be', even, odd)):
+        ratio = (high.count(0) + high.count(5) + high.count(6)) / len(high)
+        if ratio > 0.9 and low.count(0) < len(low) * 0.05:
+            return encoding, ratio
+    return None, 0.0
+
+def sniff_encoding(content_bytes):
+    # Returns (encoding, confidence between 0 and 1)
+    for bom, encoding in BOMS:
+        if content_bytes.startswith(bom):
+            return encoding, 1.0
+
+    sample = content_bytes[:ENCODING_SAMPLE_BYTES]
+    complete = len(content_bytes) <= ENCODING_SAMPLE_BYTES
+
+    encoding, confidence = sniff_utf16(sample)
+    if encoding:
+        return encoding, confidence
+
+    try:
+        # Not final unless this is everything: the sample may end mid-character
+        codecs.getincrementaldecoder('utf-8')().decode(sample, complete)
+        if not sample.isascii():
+            return 'utf-8', 0.99
+        return 'utf-8', 1.0 if complete else 0.9
+    except UnicodeDecodeError:
+        pass
+
+    high_count = len(sample) - len(sample.translate(None, HIGH_BYTES))
+    scores = []
+    for encoding, evidence in SINGLE_BYTE_CANDIDATES:
+        try:
+            text = sample.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+        scores.append((len(evidence.findall(text)) / high_count, encoding))
+    # Stable sort: earlier candidates win ties
+    scores.sort(key=lambda score: -score[0])
+    if not scores or scores[0][0] == 0:
+        return 'latin-1', 0.1
+    best, encoding = scores[0]
+    runner_up = scores[1][0] if len(scores) > 1 else 0.0
+    return encoding, round(min(best, 1.0) * (1 - runner_up / 2), 2)
+
+def decode_upload(content_bytes, input_encoding='auto', encoding_hint=None):
+    # Returns (text, encoding, confidence) after a single full decode
+    if input_encoding != 'auto':
+        try:
+            return content_bytes.decode(input_encoding), input_encoding, 1.0
+        except (UnicodeDecodeError, LookupError):
+            pass # fallback
+
+    encoding, confidence = encoding_hint or sniff_encoding(content_bytes)
+    try:
+        return content_bytes.decode(encoding), encoding, confidence
+    except UnicodeDecodeError as e:
+        # The sample looked clean but a later part of the file is not: re-score from there
+        retry, retry_confidence = sniff_encoding(content_bytes[e.start:])
+    if retry != encoding:
+        try:
+            return content_bytes.decode(retry), retry, retry_confidence
+        except UnicodeDecodeError:
+            pass
+    return content_bytes.decode(encoding, errors='replace'), encoding, 0.0
+
+def detect_encoding(content_bytes):
+    return decode_upload(content_bytes)[0]
+
+# Large inputs are read through a read-only mmap instead of one bytes object.
+# The encoding is sniffed from the head of the buffer, block boundaries are
+# found on the raw bytes and only one block at a time is decoded, so neither
+# the whole input nor its decoded text is ever held in memory.
+MMAP_MIN_BYTES = 1024 * 1024
+BUFFER_BLOCK_BYTES = 1024 * 1024
+
+# Byte sequences that start a new block, tried in order; every one begins with
+# the newline that ends the previous line, so a cut right after it is always on
+# a line boundary. A plain newline is the fallback.
+BLOCK_SEPARATORS = {
+    'srt': (b'\n\n', b'\n\r\n'),
+    'vtt': (b'\n\n', b'\n\r\n'),
+    'ass': (b'\nDialogue:',),
+    'lrc': (b'\n[',),
+}
+
+@contextlib.contextmanager
+def mapped_content(fh, min_bytes=MMAP_MIN_BYTES):
+    # Content of an open binary file: a read-only mmap when it is backed by a
+    # real file of at least min_bytes, bytes otherwise
+    size = fh.seek(0, os.SEEK_END)
+    fh.seek(0)
+    if size >= min_bytes:
+        try:
+            fileno = fh.fileno()
+        except (AttributeError, OSError):
+            fileno = None # in-memory stream
+        if fileno is not None:
+            import mmap
+            with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as buffer:
+                yield buffer
+            return
+    yield fh.read()
+
+def sniff_buffer_encoding(buffer, input_encoding='auto', encoding_hint=None):
+    # Encoding for a buffer that is decoded in blocks: an explicit choice if it
+    # exists, otherwise whatever the head of the buffer looks like
+    if input_encoding != 'auto':
+        try:
+            return codecs.lookup(input_encoding).name
+        except LookupError:
+            pass # fallback
+    return (encoding_hint or sniff_encoding(buffer[:ENCODING_SAMPLE_BYTES + 1]))[0]
+
+def block_end(buffer, start, separators, block_size=BUFFER_BLOCK_BYTES):
+    # End of the block starting at start: just past the first separator found
+    # within one more block_size bytes, else past the next newline
+    size = len(buffer)
+    if start + block_size >= size:
+        return size
+    for separator in separators:
+        found = buffer.find(separator, start + block_size, start + 2 * block_size)
+        if found != -1:
+            return found + 1
+    found = buffer.find(b'\n', start + block_size)
+    return size if found == -1 else found + 1
+
+def iter_buffer_lines(buffer, encoding, input_format='srt', block_size=BUFFER_BLOCK_BYTES):
+    # Same lines as decoding the whole buffer and calling splitlines()
+    if codecs.lookup(encoding).name.startswith(('utf-16', 'utf-32')):
+        # A newline byte can be half of a wide code unit: no byte-level cuts
+        yield from str(buffer[:], encoding, 'replace').splitlines()
+        return
+    separators = BLOCK_SEPARATORS.get(input_format, ())
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    start = 0
+    while start < len(buffer):
+        end = block_end(buffer, start, separators, block_size)
+        yield from decoder.decode(buffer[start:end], end == len(buffer)).splitlines()
+        start = end
+
+OUTPUT_EXTENSIONS = {'srt': '.srt', 'ass': '.ass', 'vtt': '.vtt', 'lrc': '.lrc'}
+
+def output_filename(filename, output_format, fallback_name="Subtitle"):
+    base_name = os.path.splitext(filename or '')[0]
+    if not base_name:
+        base_name = fallback_name
+    return f"{base_name}_Fixed.by.@bruuhim{OUTPUT_EXTENSIONS[output_format]}"
+
+def encode_output(text, output_format):
+    if output_format in ('srt', 'ass'):
+        return text.encode('utf-8-sig') # with BOM
+    return text.encode('utf-8')
+
+def resolve_output_format(opts):
+    # Unknown output formats fall back to SRT
+    return opts['output_format'] if opts['output_format'] in WRITERS else 'srt'
+
+def resolve_output_formats(opts):
+    # Every requested format, in order and once each; output_format is the first
+    formats = opts.get('output_formats') or [opts['output_format']]
+    return list(dict.fromkeys(f if f in WRITERS else 'srt' for f in formats))
+
+@contextlib.contextmanager
+def untimed_stage(name, nbytes=0, cues=0):
+    # Stand-in for StageTimings.stage when nobody is measuring
+    yield {'bytes': nbytes, 'cues': cues}
+
+def iter_encoded(chunks, output_format, chunk_size=64 * 1024):
+    # Re-chunk writer output into blocks of roughly chunk_size bytes
+    encoder = codecs.getincrementalencoder('utf-8-sig' if output_format in ('srt', 'ass') else 'utf-8')()
+    buffered = []
+    size = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        size += len(chunk)
+        if size >= chunk_size:
+            yield encoder.encode(''.join(buffered))
+            buffered = []
+            size = 0
+    yield encoder.encode(''.join(buffered), final=True)
+
+def fix_file(filename, content_bytes, opts, fallback_name="Subtitle", encoding_hint=None, timings=None, cue_index=None, validator=None):
+    # (out_filename, out_bytes) in output_format alone
+    opts = dict(opts, output_formats=[resolve_output_format(opts)])
+    return fix_file_outputs(filename, content_bytes, opts, fallback_name, encoding_hint, timings, cue_index, validator)[0]
+
+def fix_file_outputs(filename, content_bytes, opts, fallback_name="Subtitle", encoding_hint=None, timings=None, cue_index=None, validator=None):
+    # Decode -> parse -> validate -> filter -> retime once for a single upload,
+    # then write + encode once per output format; returns [(out_filename,
+    # out_bytes)] in the order of resolve_output_formats(). With a CueIndex (see
+    # app.py), cues whose text was already filtered last time are reused; pass a
+    # Validator to read its report after. The validator sees the parsed input,
+    # as /preview does, not the marks and tags the filters put in.
+    stage = timings.stage if timings is not None else untimed_stage
+    output_formats = resolve_output_formats(opts)
+    if validator is None and opts.get('auto_fix'):
+        validator = Validator(auto_fix=True)
+
+    if not isinstance(content_bytes, bytes):
+        # A mapped buffer (see mapped_content): one lazy pass from the decoded
+        # blocks to the encoded output, so no stage holds the whole document.
+        # Several formats share the cues, which are then kept in a list.
+        with stage('decode'):
+            encoding = sniff_buffer_encoding(content_bytes, opts['input_encoding'], encoding_hint)
+            head = content_bytes[:FORMAT_SNIFF_CHARS].decode(encoding, errors='replace')
+            input_format = detect_input_format(head, filename or '')
+        outputs = []
+        with stage('stream', len(content_bytes)) as record:
+            items = PARSERS[input_format](iter_buffer_lines(content_bytes, encoding, input_format))
+            if validator is not None:
+                items = validator.iter_validated(items, input_format)
+            items = filter_cues(items, opts) if cue_index is None else cue_index.filter_cues(items, opts)
+            items = retime_cues(items, opts)
+            if len(output_formats) > 1:
+                items = list(items)
+            for output_format in output_formats:
+                out_bytes = b''.join(iter_encoded(WRITERS[output_format](items), output_format))
+                outputs.append((output_filename(filename, output_format, fallback_name), out_bytes))
+            record['bytes'] = sum(len(out_bytes) for _, out_bytes in outputs)
+        return outputs
+
+    with stage('decode', len(content_bytes)):
+        content = decode_upload(content_bytes, opts['input_encoding'], encoding_hint)[0]
+    input_format = detect_input_format(content, filename or '')
+    with stage('parse', len(content)) as record:
+        items = list(PARSERS[input_format](content.splitlines()))
+        record['cues'] = sum(1 for item in items if isinstance(item, Cue))
+    if validator is not None:
+        with stage('validate', cues=record['cues']):
+            items = list(validator.iter_validated(items, input_format))
+    with stage('filter') as record:
+        items = list(filter_cues(items, opts) if cue_index is None else cue_index.filter_cues(items, opts))
+        record['cues'] = sum(1 for item in items if isinstance(item, Cue))
+    with stage('retime', cues=record['cues']):
+        items = list(retime_cues(items, opts))
+
+    outputs = []
+    for output_format in output_formats:
+        with stage('write') as record:
+            fixed_content = serialize(items, output_format)
+            record['bytes'] = len(fixed_content)
+        with stage('encode') as record:
+            out_bytes = encode_output(fixed_content, output_format)
+            record['bytes'] = len(out_bytes)
+        outputs.append((output_filename(filename, output_format, fallback_name), out_bytes))
+    return outputs
+
+# Processing options shared by the web endpoints, fix_subtitle() and the command
+# line: name -> (type, default). Forms send every value as a string; JSON clients
+# may send native types.
+PROCESS_OPTIONS = {
+    'output_format': (str, 'srt'),
+    'input_encoding': (str, 'auto'),
+    'fix_rtl': (bool, True),
+    'fix_rtl_pdf': (bool, False),
+    'rtl_marking': (str, 'always'),     # 'always': every non-empty line, 'smart': only where needed
+    'time_shift_ms': (int, 0),
+    'time_shift_from': (str, None),     # defaults to zero in the output format's notation
+    'remove_music_lines': (bool, False),
+    'remove_tashkeel': (bool, False),
+    'remove_all_tags': (bool, False),
+    'keep_italic': (bool, False),
+    'keep_bold': (bool, False),
+    'keep_font_color': (bool, False),
+    'clean_brackets': (bool, False),
+    'bracket_options': (dict, {}),
+    'time_shift_segments': (list, []),
+    'framerate_from': (float, None),
+    'framerate_to': (float, None),
+    'min_gap_ms': (int, None),
+    'auto_fix': (bool, False),          # apply the fixes of the validation rules that have one
+    'reshape_arabic': (bool, False),    # presentation forms in visual order, for players without shaping
+}
+
+TRUE_VALUES = ('true', '1', 'yes', 'on')
+FALSE_VALUES = ('false', '0', 'no', 'off')
+
+def coerce_option(kind, value):
+    if kind is bool:
+        if isinstance(value, bool):
+            return value
+        value = str(value).strip().lower()
+        if value in TRUE_VALUES:
+            return True
+        if value in FALSE_VALUES:
+            return False
+        raise ValueError(value)
+    if kind in (dict, list):
+        value = json.loads(value) if isinstance(value, str) else value
+        if not isinstance(value, kind):
+            raise ValueError(value)
+        return value
+    if kind is int:
+        if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+            raise ValueError(value)
+        return int(value)
+    if kind is float:
+        if isinstance(value, bool):
+            raise ValueError(value)
+        value = float(value)
+        if not 0 < value < float('inf'):
+            raise ValueError(value)
+        return value
+    # Form fields are always strings; a JSON list or number here is a mistake
+    if not isinstance(value, str):
+        raise ValueError(value)
+    return value
+
+def parse_output_formats(value):
+    # 'vtt', 'srt,vtt,ass', a JSON list, or a list such as repeated form fields
+    if isinstance(value, str):
+        value = value.strip()
+        value = json.loads(value) if value.startswith('[') else [value]
+    if not isinstance(value, (list, tuple)):
+        raise ValueError(value)
+    formats = []
+    for item in value:
+        if not isinstance(item, str):
+            raise ValueError(item)
+        formats.extend(name.strip() for name in item.split(',') if name.strip())
+    return list(dict.fromkeys(formats))
+
+def process_options(values):
+    # Validates and converts every option once per request; raises ValueError
+    # naming the offending field
+    opts = {}
+    # output_format may name several formats: output_formats lists them all,
+    # output_format stays the first
+    value = values.getlist('output_format') if hasattr(values, 'getlist') else values.get('output_format')
+    try:
+        formats = parse_output_formats(value) if value else []
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid value for 'output_format': {value!r}")
+    for output_format in formats:
+        if output_format not in WRITERS:
+            raise ValueError(f"Unsupported output format: {output_format!r}")
+    opts['output_formats'] = formats or [PROCESS_OPTIONS['output_format'][1]]
+
+    for name, (kind, default) in PROCESS_OPTIONS.items():
+        if name == 'output_format':
+            opts[name] = opts['output_formats'][0]
+            continue
+        value = values.get(name)
+        if value is None or value == '':
+            opts[name] = default
+            continue
+        try:
+            opts[name] = coerce_option(kind, value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value for '{name}': {value!r}")
+
+    if opts['rtl_marking'] not in ('smart', 'always'):
+        raise ValueError(f"Invalid value for 'rtl_marking': {opts['rtl_marking']!r}")
+    if opts['input_encoding'] != 'auto':
+        try:
+            codecs.lookup(opts['input_encoding'])
+        except LookupError:
+            raise ValueError(f"Unknown encoding: {opts['input_encoding']!r}")
+    if opts['time_shift_from'] is None:
+        opts['time_shift_from'] = "00:00:00,000" if opts['output_format'] == 'srt' else "0:00:00.00"
+    elif not ASS_TIME_PATTERN.match(opts['time_shift_from'].replace(',', '.')):
+        raise ValueError(f"Invalid value for 'time_shift_from': {opts['time_shift_from']!r}")
+    try:
+        parse_shift_segments(opts['time_shift_segments'])
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid value for 'time_shift_segments': {opts['time_shift_segments']!r}")
+    return opts
+
+def fix_subtitle(content_bytes, options=None, filename='subtitle.srt'):
+    """Fix one subtitle document and return the encoded output.
+
+    options uses the same names as the web form (see PROCESS_OPTIONS), as
+    native values or strings. The input format is sniffed from the content;
+    the extension of filename only decides when the content does not, and
+    names the output. Raises ValueError for invalid options.
+    """
+    opts = process_options(options or {})
+    return fix_file(filename, content_bytes, opts)[1]
+
+def validate_subtitle(content_bytes, filename='subtitle.srt', budget_ms=VALIDATION_BUDGET_MS):
+    """Check one subtitle document against VALIDATION_RULES without fixing it.
+
+    Returns the report of Validator.report(): counts per severity and the
+    first VALIDATION_MAX_LISTED problems, each with its 1-based cue number.
+    """
+    content = decode_upload(content_bytes)[0]
+    input_format = detect_input_format(content, filename)
+    validator = Validator(budget_ms=budget_ms)
+    for _ in validator.iter_validated(PARSERS[input_format](content.splitlines()), input_format):
+        pass
+    return validator.report()
+
+WARM_UP_SAMPLE = (
+    "1\n00:00:01,000 --> 00:00:02,500\n<i>مَرْحَبًا</i> [MUSIC] hello 42\n\n"
+    "2\n00:00:03,000 --> 00:00:04,000\n♪ ♪\n"
+).encode('utf-8')
+
+def warm_up(options=None):
+    """Build ahead of time what the first request would otherwise pay for.
+
+    Compiles the tag patterns and the text filters for the given options
+    (the defaults if None) with and without tag removal, then runs a small
+    document through every writer and parser. Meant for startup; app.py
+    calls it at import time.
+    """
+    opts = process_options(options or {})
+    get_text_filter(opts)
+    for keep_italic, keep_bold, keep_font_color in itertools.product((False, True), repeat=3):
+        compile_html_tag_pattern(keep_italic, keep_bold, keep_font_color)
+        # The tag-removal variants of the filter: the form's most used switches
+        get_text_filter(dict(opts, remove_all_tags=True, keep_italic=keep_italic, keep_bold=keep_bold, keep_font_color=keep_font_color))
+    for output_format in WRITERS:
+        converted = fix_file('warm-up.srt', WARM_UP_SAMPLE, dict(opts, output_format=output_format))[1]
+        fix_file(f'warm-up.{output_format}', converted, opts)
+    validate_subtitle(WARM_UP_SAMPLE)
+
+# ---------------------------------------------------------------------------
+# Archives
+#
+# Season packs arrive as zips. The member list comes from the central
+# directory and every member is only inflated when it is read, so at most one
+# entry is in memory at a time. Directories, macOS resource forks and anything
+# without a subtitle extension (INPUT_FORMATS) are skipped.
+# ---------------------------------------------------------------------------
+
+ZIP_SIGNATURES = (b'PK\x03\x04', b'PK\x05\x06')  # first entry, or an empty archive
+ARCHIVE_SKIP_DIRS = ('__MACOSX',)
+
+def is_zip_archive(fh):
+    # By signature, so renamed archives are recognised; fh is left at the start
+    head = fh.read(4)
+    fh.seek(0)
+    return head in ZIP_SIGNATURES
+
+def archive_entry_name(name):
+    # Relative POSIX path of a member, or None when it has to be skipped
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or name.endswith(('/', '\\')) or '..' in parts or parts[0] in ARCHIVE_SKIP_DIRS:
+        return None
+    if parts[-1].startswith('.') or os.path.splitext(parts[-1].lower())[1] not in INPUT_FORMATS:
+        return None
+    return '/'.join(parts)
+
+class ArchiveMember:
+    # File-like view of one zip member, opened on first read. Closing the
+    # last member of an archive closes the archive as well.
+    def __init__(self, zf, info, last=False):
+        self.zf = zf
+        self.info = info
+        self.last = last
+        self.fh = None
+
+    def read(self, size=-1):
+        if self.fh is None:
+            self.fh = self.zf.open(self.info)
+        return self.fh.read(size)
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+        if self.last:
+            self.zf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def archive_members(fh, max_bytes=None):
+    """List the subtitles in a zip archive without extracting anything.
+
+    Returns [(entry_name, ArchiveMember)] in archive order. Raises ValueError
+    for an unreadable archive, or when the uncompressed size the archive
+    declares for its subtitles exceeds max_bytes.
+    """
+    import zipfile
+    try:
+        zf = zipfile.ZipFile(fh)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f'Invalid zip archive: {e}') from None
+    entries = []
+    for info in zf.infolist():
+        name = archive_entry_name(info.filename)
+        if name is not None:
+            entries.append((name, info))
+    if max_bytes is not None and sum(info.file_size for _, info in entries) > max_bytes:
+        zf.close()
+        raise ValueError(f'Archive is larger than {max_bytes // (1024 * 1024)}MB once extracted')
+    if not entries:
+        zf.close()
+    return [(name, ArchiveMember(zf, info, last=index == len(entries) - 1)) for index, (name, info) in enumerate(entries)]
+
+# ---------------------------------------------------------------------------
+# Command line
+#
+# Walks files and directories recursively and fixes every subtitle in a
+# process pool. Results are written in place or into a mirror tree. A
+# manifest next to the outputs records what each output was built from, so
+# re-runs skip inputs that did not change (same mtime and size, or failing
+# that the same content hash) under the same options.
+# ---------------------------------------------------------------------------
+
+MANIFEST_NAME = '.rtlfixer-manifest.json'
+# Every extension a parser is registered for
+CLI_EXTENSIONS = tuple(extension for extension, input_format in INPUT_FORMATS.items() if input_format in PARSERS)
+
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as fh:
+        for chunk in iter(functools.partial(fh.read, 1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def iter_inputs(paths, extensions, skip_dir=None):
+    for path in paths:
+        if os.path.isfile(path):
+            yield os.path.abspath(path), os.path.basename(path)
+            continue
+        root = os.path.abspath(path)
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if os.path.join(dirpath, d) != skip_dir)
+            for name in sorted(filenames):
+                if name.lower().endswith(extensions):
+                    full = os.path.join(dirpath, name)
+                    yield full, os.path.relpath(full, root)
+
+def cli_output_path(source, relpath, output_dir, output_format):
+    # Same name with the output extension, next to the input or mirrored under output_dir
+    if output_dir:
+        base = os.path.join(output_dir, os.path.splitext(relpath)[0])
+    else:
+        base = os.path.splitext(source)[0]
+    return base + OUTPUT_EXTENSIONS[output_format]
+
+def is_up_to_date(entry, source, output, options_key):
+    if entry is None or entry['options'] != options_key or not os.path.exists(output):
+        return False
+    stat = os.stat(source)
+    if (stat.st_mtime_ns, stat.st_size) == (entry['mtime_ns'], entry['size']):
+        return True
+    return file_digest(source) == entry['digest']
+
+def fix_path(source, outputs, opts):
+    # Pool entry point: one parse, one output path per requested format, each
+    # written atomically; returns the manifest entry of every output
+    with open(source, 'rb') as fh, mapped_content(fh) as content:
+        results = fix_file_outputs(source, content, opts)
+        source_digest = hashlib.blake2b(content, digest_size=20).hexdigest()
+    entries = {}
+    for output, (_, out_bytes) in zip(outputs, results):
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        partial = output + '.part'
+        with open(partial, 'wb') as fh:
+            fh.write(out_bytes)
+        os.replace(partial, output)
+        # In place with the same format the output becomes the next run's input
+        recorded = output if os.path.samefile(source, output) else source
+        stat = os.stat(recorded)
+        digest = hashlib.blake2b(out_bytes, digest_size=20).hexdigest() if recorded == output else source_digest
+        entries[output] = {'source': source, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'digest': digest}
+    return entries
+
+def load_manifest(path):
+    try:
+        with open(path, encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(path, manifest):
+    partial = path + '.part'
+    with open(partial, 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.replace(partial, path)
+
+def build_parser():
+    # The command line modules are imported here and in main(), not at the top,
+    # so importing the library for the web app stays cheap
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m rtlfixer', description='Fix RTL subtitles in bulk.')
+    parser.add_argument('paths', nargs='+', help='subtitle files or directories (walked recursively)')
+    parser.add_argument('-o', '--output-dir', help='write into a mirror tree here instead of in place')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='worker processes (default: all cores)')
+    parser.add_argument('--ext', action='append', help=f"input extensions to pick up in directories (default: {' '.join(CLI_EXTENSIONS)})")
+    parser.add_argument('--force', action='store_true', help='reprocess even if the output is up to date')
+    group = parser.add_argument_group('processing options')
+    for name, (kind, default) in PROCESS_OPTIONS.items():
+        flag = '--' + name.replace('_', '-')
+        if kind is bool:
+            group.add_argument(flag, dest=name, action=argparse.BooleanOptionalAction, default=None,
+                               help=f'(default: {"on" if default else "off"})')
+        else:
+            group.add_argument(flag, dest=name, metavar=kind.__name__.upper())
+    return parser
+
+def main(argv=None):
+    import concurrent.futures
+    args = build_parser().parse_args(argv)
+    try:
+        opts = process_options({name: getattr(args, name) for name in PROCESS_OPTIONS})
+    except ValueError as e:
+        print(f'error: {e}', file=sys.stderr)
+        return 2
+    output_formats = resolve_output_formats(opts)
+    options_key = json.dumps(opts, sort_keys=True)
+    extensions = tuple(e.lower() if e.startswith('.') else '.' + e.lower() for e in args.ext) if args.ext else CLI_EXTENSIONS
+
+    output_dir = os.path.abspath(args.output_dir) if args.output_dir else None
+    manifest_dir = output_dir or os.path.abspath(args.paths[0] if os.path.isdir(args.paths[0]) else os.path.dirname(args.paths[0]) or '.')
+    manifest_path = os.path.join(manifest_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
+    tasks = []
+    skipped = 0
+    for source, relpath in iter_inputs(args.paths, extensions, output_dir):
+        entry = manifest.get(source)
+        if entry is not None and entry['source'] != source:
+            continue # an output of an earlier run, not an input
+        outputs = [cli_output_path(source, relpath, output_dir, output_format) for output_format in output_formats]
+        if not args.force and all(is_up_to_date(manifest.get(output), source, output, options_key) for output in outputs):
+            skipped += 1
+            continue
+        tasks.append((source, outputs))
+
+    failed = 0
+    executor_class = concurrent.futures.ProcessPoolExecutor if args.jobs > 1 and len(tasks) > 1 else concurrent.futures.ThreadPoolExecutor
+    with executor_class(max_workers=max(1, args.jobs)) as executor:
+        futures = {executor.submit(fix_path, source, outputs, opts): source for source, outputs in tasks}
+        for future in concurrent.futures.as_completed(futures):
+            source = futures[future]
+            try:
+                entries = future.result()
+            except Exception as e:
+                failed += 1
+                print(f'failed: {source}: {e}', file=sys.stderr)
+                continue
+            for output, entry in entries.items():
+                entry['options'] = options_key
+                manifest[output] = entry
+            print(f"fixed: {source} -> {', '.join(entries)}")
+
+    if tasks:
+        os.makedirs(manifest_dir, exist_ok=True)
+        save_manifest(manifest_path, manifest)
+    print(f'{len(tasks) - failed} fixed, {skipped} up to date, {failed} failed', file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Serverless entry point; vercel.json routes every request here.
+
+Page loads never import Flask: GET and HEAD of / and of files under /static/
+are answered by assets.py from prerendered, precompressed bytes. Anything
+else imports app.py on first use and goes to the Flask app, so a cold start
+that only serves the page skips Flask, the pipeline and its warm-up. The
+first response of a process reports in Server-Timing how long this module
+took to import ('entry') and, when it was the one to load it, how long the
+Flask app took ('import'). The latter also goes to /metrics as the 'import'
+stage.
+
+    python serverless.py    # cold-start report, each step in a fresh interpreter
+"""
+import time
+
+ENTRY_STARTED = time.perf_counter()
+
+import os
+import sys
+import threading
+
+import assets
+
+ENTRY_IMPORT_SECONDS = time.perf_counter() - ENTRY_STARTED
+
+STATUS_LINES = {200: '200 OK', 304: '304 Not Modified', 404: '404 Not Found'}
+
+_flask_app = None
+_flask_app_lock = threading.Lock()
+_first_response = threading.Event()
+
+def load_flask_app():
+    # (Flask app, seconds it took to import, or None when already loaded)
+    global _flask_app
+    with _flask_app_lock:
+        if _flask_app is not None:
+            return _flask_app, None
+        started = time.perf_counter()
+        import app as flask_module
+        seconds = time.perf_counter() - started
+        flask_module.METRICS.observe_stage('import', seconds)
+        _flask_app = flask_module.app
+        return _flask_app, seconds
+
+def asset_response(environ):
+    path = environ.get('PATH_INFO') or '/'
+    method = environ['REQUEST_METHOD']
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    accept_encoding = environ.get('HTTP_ACCEPT_ENCODING')
+    if path == '/':
+        return assets.index_response(method, if_none_match, accept_encoding)
+    if path.startswith('/static/'):
+        # ?v=<fingerprint>, parsed by hand to keep urllib out of the cold start
+        version = next((value for name, _, value in (pair.partition('=') for pair in environ.get('QUERY_STRING', '').split('&'))
+                        if name == 'v'), None)
+        response = assets.static_response(path[len('/static/'):], version, method, if_none_match, accept_encoding)
+        # A missing static file is not worth loading Flask for
+        return response or (404, [('Content-Type', 'text/plain; charset=utf-8')], b'Not Found')
+    return None
+
+def cold_start_timings(import_seconds):
+    timings = []
+    if not _first_response.is_set():
+        _first_response.set()
+        timings.append(f'entry;dur={ENTRY_IMPORT_SECONDS * 1000:.2f}')
+    if import_seconds is not None:
+        timings.append(f'import;dur={import_seconds * 1000:.2f}')
+    return timings
+
+def app(environ, start_response):
+    if environ['REQUEST_METHOD'] in ('GET', 'HEAD'):
+        response = asset_response(environ)
+        if response is not None:
+            status, headers, body = response
+            timings = cold_start_timings(None)
+            if timings:
+                headers.append(('Server-Timing', ', '.join(timings)))
+            start_response(STATUS_LINES[status], headers)
+            return [body]
+
+    flask_app, import_seconds = load_flask_app()
+    timings = cold_start_timings(import_seconds)
+    if not timings:
+        return flask_app(environ, start_response)
+
+    def start_with_timings(status, headers, exc_info=None):
+        # A second Server-Timing header; clients merge them
+        headers.append(('Server-Timing', ', '.join(timings)))
+        return start_response(status, headers, exc_info)
+
+    return flask_app(environ, start_with_timings)
+
+# ---------------------------------------------------------------------------
+# Cold-start report
+# ---------------------------------------------------------------------------
+
+REPORT_STEPS = (
+    ('import serverless', 'import serverless'),
+    ('import serverless + GET / (gzip)', 'import serverless; serverless.asset_response('
+        '{"REQUEST_METHOD": "GET", "PATH_INFO": "/", "HTTP_ACCEPT_ENCODING": "gzip"})'),
+    ('import flask', 'import flask'),
+    ('import rtlfixer', 'import rtlfixer'),
+    ('import app (with warm-up)', 'import app'),
+    ('import app (WARM_UP=false)', 'import app'),
+)
+
+def time_in_fresh_interpreter(statement, env=None, runs=5):
+    # Median wall time of `statement` over `runs` new interpreters, in ms
+    import subprocess
+    code = f'import time; _t = time.perf_counter(); {statement}; print(time.perf_counter() - _t)'
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = sorted(
+        float(subprocess.run([sys.executable, '-c', code], cwd=here, env=env, check=True,
+                             capture_output=True, text=True).stdout.split()[-1])
+        for _ in range(runs)
+    )
+    return samples[len(samples) // 2] * 1000
+
+def main():
+    print(f"{'step':<36}{'median ms':>10}")
+    for label, statement in REPORT_STEPS:
+        env = dict(os.environ, WARM_UP='false') if 'WARM_UP=false' in label else None
+        print(f'{label:<36}{time_in_fresh_interpreter(statement, env):>10.1f}')
+    page = assets.prerender()
+    sizes = ', '.join(f'{encoding} {len(page.body(encoding))}' for encoding in ('identity',) + assets.ENCODINGS
+                      if encoding != 'br' or assets.load_brotli() is not None)
+    print(f'index.html bytes: {sizes}; a repeat visit with If-None-Match gets a bodiless 304')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# The warm-up only pays off in a long-lived server
+os.environ.setdefault('WARM_UP', 'false')
+
+GOLDEN_DIR = os.path.join(ROOT, 'tests', 'golden')
+
+def read_golden(name):
+    with open(os.path.join(GOLDEN_DIR, name), 'rb') as fh:
+        return fh.read()
+
+def check_golden(name, data):
+    # UPDATE_GOLDEN=1 rewrites the file instead; review the diff before committing it
+    path = os.path.join(GOLDEN_DIR, name)
+    if os.environ.get('UPDATE_GOLDEN') == '1':
+        with open(path, 'wb') as fh:
+            fh.write(data)
+    assert data == read_golden(name)
+
+@pytest.fixture
+def flask_app(tmp_path):
+    import app
+    app.app.config.update(CACHE_BACKEND='memory', JOB_DIR=str(tmp_path / 'jobs'), BATCH_EXECUTOR='thread')
+    app._result_cache = None
+    app._job_store = None
+    yield app
+    app._result_cache = None
+    app._job_store = None
+
+@pytest.fixture
+def client(flask_app):
+    return flask_app.app.test_client()
@@ -0,0 +1,173 @@
+import io
+import json
+import time
+import zipfile
+
+import pytest
+
+from conftest import read_golden
+
+def upload(name, data=None, **form):
+    data = read_golden(name) if data is None else data
+    return dict(form, files=(io.BytesIO(data), name))
+
+def post_process(client, name, data=None, **form):
+    return client.post('/process', data=upload(name, data, **form), content_type='multipart/form-data')
+
+def test_process_single_file(client):
+    response = post_process(client, 'sample.srt')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert response.data == read_golden('fixed_default.srt')
+
+def wait_for_job(client, job_id):
+    for _ in range(200):
+        status = client.get(f'/jobs/{job_id}').get_json()
+        if status['status'] in ('done', 'failed'):
+            return status
+        time.sleep(0.02)
+    pytest.fail('job did not finish')
+
+@pytest.mark.parametrize('output_format, mimetype', [('srt', 'text/plain'), ('srt,vtt', 'application/zip')])
+def test_job_result_type(client, output_format, mimetype):
+    response = client.post('/jobs', data=upload('sample.srt', output_format=output_format),
+                           content_type='multipart/form-data')
+    assert response.status_code == 202
+    job_id = response.get_json()['id']
+    assert wait_for_job(client, job_id)['status'] == 'done'
+    result = client.get(f'/jobs/{job_id}/result')
+    assert result.status_code == 200
+    assert result.mimetype == mimetype
+
+def test_failed_job_result(flask_app, client):
+    store = flask_app.get_job_store()
+    store.create({'id': 'broken', 'status': 'queued', 'created': time.time(), 'opts': {}, 'files': []}, [])
+    store.update('broken', status='failed', error='No file could be processed')
+    result = client.get('/jobs/broken/result')
+    assert result.status_code == 409
+    assert result.get_json()['error'] == 'No file could be processed'
+
+def test_expiry_leaves_queued_jobs_alone(flask_app):
+    store = flask_app.get_job_store()
+    created = time.time() - 7200
+    for job_id, status in (('old-queued', 'queued'), ('old-done', 'done')):
+        store.create({'id': job_id, 'status': status, 'created': created, 'opts': {}, 'files': []}, [])
+    store.delete_expired(3600)
+    assert store.get('old-queued') is not None
+    assert store.get('old-done') is None
+
+def test_cue_diff_against_a_tracked_version(client):
+    first = post_process(client, 'sample.srt', track_changes='true')
+    digest = first.headers['X-Document-Digest']
+    assert 'X-Cue-Diff' not in first.headers
+
+    edited = read_golden('sample.srt').replace(b'00:00:04,000', b'00:00:04,500')
+    second = post_process(client, 'sample.srt', edited, previous_digest=digest)
+    diff = json.loads(second.headers['X-Cue-Diff'])
+    # Cues are numbered from 1, as in the SRT
+    assert (diff['unchanged'], diff['changed'], diff['changed_cues']) == (2, 1, [2])
+    assert second.headers['X-Document-Digest'] != digest
+
+def test_no_cue_diff_without_tracking(flask_app, client):
+    # One-off uploads leave no index behind to diff against
+    first = post_process(client, 'sample.srt')
+    assert 'X-Document-Digest' not in first.headers
+    guessed = flask_app.content_digest(read_golden('sample.srt'))
+    second = post_process(client, 'sample.srt', previous_digest=guessed)
+    assert 'X-Cue-Diff' not in second.headers
+
+def post_preview(client, name, data=None, **form):
+    data = read_golden(name) if data is None else data
+    return client.post('/preview', data=dict(form, file=(io.BytesIO(data), name)), content_type='multipart/form-data')
+
+def test_preview_is_windowed_by_default(client):
+    response = post_preview(client, 'sample.srt', max_cues='2')
+    preview = response.get_json()
+    assert response.status_code == 200
+    assert [cue['index'] for cue in preview['cues']] == [1, 2]
+    # The totals need a full scan, so they are asked for explicitly
+    assert 'totals' not in preview
+
+@pytest.mark.parametrize('name', ['sample.srt', 'sample.vtt', 'sample.lrc'])
+def test_preview_with_totals(client, name):
+    preview = post_preview(client, name, totals='true').get_json()
+    assert preview['type'] == name[-3:]
+    assert len(preview['cues']) == 3
+    assert preview['totals']['cues'] == 3
+
+def test_process_rejects_bad_options(client):
+    response = post_process(client, 'sample.srt', time_shift_ms='soon')
+    assert response.status_code == 400
+
+def api_lines(client, body, query=''):
+    response = client.post('/api/v1/process' + query, data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+
+def test_api_malformed_documents_do_not_stop_the_stream(client):
+    text = read_golden('sample.srt').decode('utf-8')
+    body = '\n'.join(json.dumps(doc) for doc in [
+        {'id': 'a', 'filename': 'a.srt', 'text': text},
+        {'id': 'b', 'format': ['srt'], 'text': text},
+        {'id': 'c', 'filename': 7, 'text': text},
+        {'id': 'd', 'text': text, 'options': {'time_shift_ms': True}},
+        {'id': 'e', 'filename': 'e.srt', 'text': text, 'options': {'output_format': 'vtt'}},
+    ])
+    lines = api_lines(client, body)
+    assert [(line['id'], line['ok']) for line in lines] == [
+        ('a', True), ('b', False), ('c', False), ('d', False), ('e', True)]
+    assert lines[0]['text'] == read_golden('fixed_default.srt').decode('utf-8-sig')
+    assert lines[4]['filename'].endswith('.vtt')
+
+def test_preview_sniffs_the_format(client):
+    # The extension is wrong on purpose: content decides
+    preview = post_preview(client, 'sample.txt', read_golden('sample.vtt')).get_json()
+    assert preview['type'] == 'vtt'
+    assert len(preview['cues']) == 3
+
+def test_preview_refuses_unknown_content(client):
+    response = post_preview(client, 'notes.txt', b'just some text\n')
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('auto_fix', ['true', 'false'])
+def test_stream_matches_non_stream(client, auto_fix):
+    # Zero durations and unclosed italics, both fixable
+    data = ''.join(f'{i}\n00:00:0{i},000 --> 00:00:0{i},000\n<i>line {i}\n\n' for i in range(1, 5)).encode('utf-8')
+    buffered = post_process(client, 'broken.srt', data, auto_fix=auto_fix)
+    streamed = post_process(client, 'broken.srt', data, auto_fix=auto_fix, stream='true')
+    assert streamed.status_code == 200
+    assert streamed.data == buffered.data
+    assert (b'</i>' in streamed.data) == (auto_fix == 'true')
+
+def test_process_several_output_formats(client):
+    response = post_process(client, 'sample.srt', output_format='srt,vtt')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+
+def test_api_repeated_default_formats(client):
+    # Documents with options of their own still get every default format
+    text = read_golden('sample.srt').decode('utf-8')
+    body = '\n'.join(json.dumps(doc) for doc in [
+        {'id': 'a', 'filename': 'a.srt', 'text': text},
+        {'id': 'b', 'filename': 'b.srt', 'text': text, 'options': {'fix_rtl': False}},
+    ])
+    lines = api_lines(client, body, '?output_format=srt&output_format=vtt')
+    for line in lines:
+        assert [output['filename'][-4:] for output in line['outputs']] == ['.srt', '.vtt']
+
+def zipped(name):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        zf.writestr(name, read_golden(name))
+    return buffer.getvalue()
+
+def test_one_member_zip_job_returns_a_zip(client):
+    # As from /process: an archive comes back as an archive
+    assert post_process(client, 'subs.zip', zipped('sample.srt')).mimetype == 'application/zip'
+    response = client.post('/jobs', data=upload('subs.zip', zipped('sample.srt')), content_type='multipart/form-data')
+    job_id = response.get_json()['id']
+    assert wait_for_job(client, job_id)['status'] == 'done'
+    result = client.get(f'/jobs/{job_id}/result')
+    assert result.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(result.data)) as zf:
+        assert zf.read('sample_Fixed.by.@bruuhim.srt') == read_golden('fixed_default.srt')
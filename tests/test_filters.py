@@ -0,0 +1,95 @@
+import pytest
+
+import rtlfixer
+from rtlfixer import U202B, U202C, U200F
+
+def apply(text, **options):
+    return rtlfixer.apply_text_filters(text, dict(options, fix_rtl=options.get('fix_rtl', False)))
+
+BRACKETS = {'remove_square': True, 'remove_round': True}
+
+@pytest.mark.parametrize('text, expected', [
+    # Round brackets go first, then square ones, as separate passes
+    ('(a [b) c]', '(a '),
+    ('[a (b] c)', ' c)'),
+    ('x (y) [z] w', 'x   w'),
+])
+def test_overlapping_brackets(text, expected):
+    assert apply(text, clean_brackets=True, bracket_options=BRACKETS) == expected
+    assert rtlfixer.clean_brackets(text, BRACKETS) == expected
+
+def test_brackets_after_tags():
+    # Tags are stripped before brackets, so a bracket pair can close across a removed tag
+    options = dict(remove_all_tags=True, keep_italic=True, clean_brackets=True,
+                   bracket_options={'remove_angle': True, 'custom_pairs': [['*', '*']]})
+    assert apply('{\\an8}<b>*x*</b> <i>ok</i> <y>', **options) == ' <i>ok</i> '
+
+def test_custom_pairs_and_tashkeel():
+    options = dict(remove_tashkeel=True, clean_brackets=True, bracket_options={'custom_pairs': [['#', '#']]})
+    assert apply('مَرْحَبًا #note#', **options) == 'مرحبا '
+
+@pytest.mark.parametrize('text', ['مرحبا', 'hello عالم', '42', 'hello'])
+def test_always_marking_is_the_default(text):
+    assert apply(text, fix_rtl=True) == U202B + text
+    assert apply(text, fix_rtl=True, fix_rtl_pdf=True) == U202B + text + U202C
+
+def test_always_marking_skips_blank_lines():
+    assert apply('  ', fix_rtl=True) == '  '
+
+@pytest.mark.parametrize('text, expected', [
+    # Pure right-to-left text displays correctly without a mark
+    ('مرحبا', 'مرحبا'),
+    # Latin only: nothing to fix
+    ('hello 42', 'hello 42'),
+    # Starts left-to-right in a right-to-left line: embedded
+    ('hello عالم', U202B + 'hello عالم'),
+    # Ends in a neutral that would jump to the wrong side
+    ('كيف حالك?', 'كيف حالك?' + U200F),
+])
+def test_smart_marking(text, expected):
+    assert apply(text, fix_rtl=True, rtl_marking='smart') == expected
+
+def test_smart_marking_is_idempotent():
+    once = apply('hello عالم ...', fix_rtl=True, rtl_marking='smart')
+    assert apply(once, fix_rtl=True, rtl_marking='smart') == once
+
+def test_invalid_rtl_marking_is_rejected():
+    with pytest.raises(ValueError):
+        rtlfixer.process_options({'rtl_marking': 'sometimes'})
+
+SRT_WITH_PROBLEMS = ''.join(
+    f'{i}\n00:00:{i:02d},000 --> 00:00:{i:02d},000\n<i>line {i}\n\n' for i in range(1, 40)
+)
+
+def test_auto_fix_does_not_depend_on_the_budget():
+    # Even with no time budget at all, every cue is fixed; only the report is cut short
+    fixed = {}
+    for budget_ms in (0, 10000):
+        validator = rtlfixer.Validator(auto_fix=True, budget_ms=budget_ms)
+        items = list(validator.iter_validated(rtlfixer.parse_srt(SRT_WITH_PROBLEMS.splitlines()), 'srt'))
+        fixed[budget_ms] = rtlfixer.serialize(items, 'srt')
+        assert validator.report()['truncated'] == (budget_ms == 0)
+    assert fixed[0] == fixed[10000]
+    assert fixed[0].count('</i>') == 39
+
+def codepoints(text):
+    return ' '.join(f'{ord(c):04X}' for c in text)
+
+@pytest.mark.parametrize('text, expected', [
+    ('سلام', 'FEE1 FEFC FEB3'),                      # lam-alef ligature
+    ('الله', 'FEEA FEE0 FEDF FE8D'),
+    ('كتاب.', '002E FE8F FE8E FE98 FEDB'),           # punctuation moves to the left
+    ('hello', '0068 0065 006C 006C 006F'),            # untouched
+])
+def test_reshape_arabic(text, expected):
+    assert codepoints(apply(text, reshape_arabic=True)) == expected
+
+def test_reshape_keeps_tags_around_their_text():
+    shaped = apply('سلام <i>عالم</i>', reshape_arabic=True)
+    assert shaped.startswith('<i>') and shaped.index('</i>') < shaped.index(' ')
+    wrapped = apply('{\\an8}<i>سلام</i>', reshape_arabic=True)
+    assert wrapped.startswith('{\\an8}<i>') and wrapped.endswith('</i>')
+
+def test_reshape_replaces_rtl_marks():
+    shaped = apply(U202B + 'سلام' + U202C, reshape_arabic=True, fix_rtl=True)
+    assert U202B not in shaped and U202C not in shaped
@@ -0,0 +1,72 @@
+import io
+import json
+
+import pytest
+
+import rtlfixer
+from conftest import check_golden, read_golden
+
+FORMATS = ('srt', 'ass', 'vtt', 'lrc')
+
+# Filters, marking and retiming together, the way the cleanup card sends them
+CLEANUP_FORM = {
+    'remove_tashkeel': 'true',
+    'remove_all_tags': 'true',
+    'keep_italic': 'true',
+    'clean_brackets': 'true',
+    'bracket_options': json.dumps({'remove_square': True, 'remove_round': True}),
+    'fix_rtl_pdf': 'true',
+    'time_shift_ms': '500',
+}
+
+def parse(input_format, text):
+    return list(rtlfixer.PARSERS[input_format](text.splitlines()))
+
+def process(client, input_format, **form):
+    # One file through the web form, in its own format
+    name = f'sample.{input_format}'
+    data = dict(form, output_format=input_format, files=(io.BytesIO(read_golden(name)), name))
+    response = client.post('/process', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    return response.data
+
+@pytest.mark.parametrize('input_format', FORMATS)
+def test_round_trip(input_format):
+    # Parsing and writing a document in its own format, with no options, changes nothing
+    text = read_golden(f'sample.{input_format}').decode('utf-8')
+    assert rtlfixer.serialize(parse(input_format, text), input_format) == text
+
+@pytest.mark.parametrize('input_format', FORMATS)
+def test_fix_default_options(client, input_format):
+    check_golden(f'fixed_default.{input_format}', process(client, input_format))
+
+@pytest.mark.parametrize('input_format', FORMATS)
+def test_fix_cleanup_options(client, input_format):
+    check_golden(f'fixed_cleanup.{input_format}', process(client, input_format, **CLEANUP_FORM))
+
+@pytest.mark.parametrize('output_format', ('ass', 'vtt', 'lrc'))
+def test_convert_from_srt(output_format):
+    text = read_golden('sample.srt').decode('utf-8')
+    converted = getattr(rtlfixer, f'convert_srt_to_{output_format}')(text)
+    check_golden(f'converted_srt.{output_format}', converted.encode('utf-8'))
+
+@pytest.mark.parametrize('input_format', FORMATS)
+def test_library_matches_the_web_form(input_format):
+    content = read_golden(f'sample.{input_format}')
+    for options, golden in (({}, 'fixed_default'), (CLEANUP_FORM, 'fixed_cleanup')):
+        options = dict(options, output_format=input_format)
+        fixed = rtlfixer.fix_subtitle(content, options, f'sample.{input_format}')
+        assert fixed == read_golden(f'{golden}.{input_format}')
+
+@pytest.mark.parametrize('input_format', FORMATS)
+def test_sniffed_from_content(input_format):
+    # The extension is wrong on purpose: content decides
+    text = read_golden(f'sample.{input_format}').decode('utf-8')
+    assert rtlfixer.detect_input_format(text, 'subtitle.txt') == input_format
+
+def test_several_output_formats_share_one_parse():
+    content = read_golden('sample.srt')
+    opts = rtlfixer.process_options({'output_format': 'srt,vtt'})
+    outputs = rtlfixer.fix_file_outputs('sample.srt', content, opts)
+    assert [name for name, _ in outputs] == ['sample_Fixed.by.@bruuhim.srt', 'sample_Fixed.by.@bruuhim.vtt']
+    assert outputs[0][1] == read_golden('fixed_default.srt')
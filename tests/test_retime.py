@@ -0,0 +1,69 @@
+import pytest
+
+import rtlfixer
+from conftest import read_golden
+
+@pytest.fixture(params=['numpy', 'array'], autouse=True)
+def engine(request, monkeypatch):
+    # Every test runs on the NumPy path and on the array('q') fallback
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(rtlfixer, 'load_numpy', lambda: None)
+    return request.param
+
+def srt(*cues):
+    return ''.join(f'{i}\n{rtlfixer.ms_to_ts_srt(start)} --> {rtlfixer.ms_to_ts_srt(end)}\nline {i}\n\n'
+                   for i, (start, end) in enumerate(cues, 1))
+
+def cue_times(text, input_format='srt', **opts):
+    items = rtlfixer.PARSERS[input_format](text.splitlines())
+    return [(cue.start, cue.end) for cue in rtlfixer.retime_cues(items, opts) if isinstance(cue, rtlfixer.Cue)]
+
+def test_shift_from_timestamp():
+    text = read_golden('sample.srt').decode('utf-8')
+    assert cue_times(text, time_shift_ms=1000, time_shift_from='00:00:04,000') == [
+        (1000, 3500), (5000, 7250), (8000, 10000)]
+
+def test_framerate_and_segments():
+    text = read_golden('sample.srt').decode('utf-8')
+    assert cue_times(text, framerate_from=25, framerate_to=50) == [(500, 1750), (2000, 3125), (3500, 4500)]
+    assert cue_times(text, framerate_from=23.976, framerate_to=25) == [(959, 3357), (3836, 5994), (6713, 8631)]
+    assert cue_times(text, time_shift_segments=[[0, -500], ['00:00:06,000', 2000]]) == [
+        (500, 3000), (3500, 5750), (9000, 11000)]
+
+def test_min_gap():
+    text = srt((1000, 5000), (4000, 6000), (6050, 7000))
+    assert cue_times(text, min_gap_ms=100) == [(1000, 3900), (4000, 5950), (6050, 7000)]
+
+def test_min_gap_keeps_cues_too_close_for_the_gap():
+    # The gap does not fit, so the first cue runs up to the second rather than vanishing
+    assert cue_times(srt((1000, 2000), (1050, 3000)), min_gap_ms=100) == [(1000, 1050), (1050, 3000)]
+
+def test_min_gap_leaves_simultaneous_cues():
+    # A sign and a line of dialogue shown together both end before the next cue
+    text = srt((1000, 4000), (1000, 3000), (3500, 5000))
+    assert cue_times(text, min_gap_ms=100) == [(1000, 3400), (1000, 3000), (3500, 5000)]
+
+def test_min_gap_on_unsorted_cues():
+    # Neighbours go by start time; the file order is kept
+    text = srt((5000, 7000), (1000, 6000), (3000, 4000))
+    assert cue_times(text, min_gap_ms=100) == [(5000, 7000), (1000, 2900), (3000, 4000)]
+
+def test_min_gap_keeps_ass_layers_apart():
+    text = '\n'.join([
+        '[Events]',
+        'Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text',
+        'Dialogue: 0,0:00:01.00,0:00:05.00,Default,,0,0,0,,dialogue',
+        'Dialogue: 1,0:00:02.00,0:00:04.00,Sign,,0,0,0,,sign',
+        'Dialogue: 0,0:00:04.50,0:00:06.00,Default,,0,0,0,,more dialogue',
+    ])
+    assert cue_times(text, 'ass', min_gap_ms=100) == [(1000, 4400), (2000, 4000), (4500, 6000)]
+
+def test_min_gap_across_batches(monkeypatch):
+    # Cues still waiting for a later neighbour are carried into the next batch
+    text = srt((1000, 4000), (1000, 3000), (6000, 9000), (3500, 5000), (7000, 8000), (9500, 9600))
+    expected = [(1010, 3410), (1010, 3010), (6010, 6910), (3510, 5010), (7010, 8010), (9510, 9610)]
+    assert cue_times(text, min_gap_ms=100, time_shift_ms=10, time_shift_from='00:00:00,000') == expected
+    monkeypatch.setattr(rtlfixer, 'RETIME_BATCH_SIZE', 2)
+    assert cue_times(text, min_gap_ms=100, time_shift_ms=10, time_shift_from='00:00:00,000') == expected